@@ -1,30 +1,95 @@
 import asyncio
-from datetime import datetime
+import html
+import os
+import tempfile
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.client.default import DefaultBotProperties
-from aiogram.types import Message
+from aiogram.types import Document, Message, Update
 from aiogram.filters import Command
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from loguru import logger
 
+from . import metrics
 from .config import settings
+from .deal_import import CSV_EXTENSIONS, XLSX_EXTENSIONS, DealImport, ImportFileError, ImportReport, read_rows
+from .fsm_session import StateSessionMiddleware
 from .constants import main_kb, currency_kb, main_inline_kb, currency_inline_kb_in, currency_inline_kb_out
 from .google_sheets import Sheets
-from .storage import Storage
-from .rates import convert_to_eur
+from .ledger import Ledger, Report
+from .middlewares import ChatterFilterMiddleware, SheetsReadyMiddleware, message_commands
+from .outbox import Outbox
+from .sheet_mirror import SheetMirror
+from .storage import SQLiteStorage
+from .task_poller import TaskPoller
+from .quote import DealQuote, normalize_commission, normalize_expenses
+from .recalc import recalc
+from .utils import parse_day
+from .send_scheduler import SendScheduler
 
 bot = Bot(
     token=settings.bot_token,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
+# лимиты Telegram, приоритет подсказок над удалениями, без повторных удалений (см. SendScheduler)
+send_scheduler = SendScheduler(
+    global_rate=settings.send_global_rate / max(1, settings.workers),
+    chat_rate=settings.send_chat_rate,
+    group_per_min=settings.send_group_per_min,
+    max_retries=settings.send_max_retries,
+)
+bot.session.middleware(send_scheduler)
 
-dp = Dispatcher()
+# FSM-состояния заявок переживают перезапуск (таблица fsm_state в excelbot.db)
+fsm_storage = SQLiteStorage(max_items=settings.fsm_hot_size, flush_interval=settings.fsm_flush_sec)
+dp = Dispatcher(storage=fsm_storage)
+# одно чтение и одна запись FSM-данных за апдейт (см. StateSession)
+dp.message.middleware(StateSessionMiddleware())
+dp.callback_query.middleware(StateSessionMiddleware())
 
 # --- Cleanup helpers ---
+DELETE_MESSAGES_LIMIT = 100  # Bot API deleteMessages принимает до 100 id за вызов
+
+# ссылки на фоновые задачи, чтобы их не собрал GC до завершения
+_background: set[asyncio.Task] = set()
+
+
+def _in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def _delete_messages(chat_id: int, ids: list[int]) -> None:
+    """Удаляет сообщения пачками через deleteMessages; если массовое удаление
+    не разрешено — параллельными одиночными deleteMessage."""
+    ids = list(dict.fromkeys(mid for mid in ids if mid))
+
+    async def delete_chunk(chunk: list[int]) -> None:
+        try:
+            await bot.delete_messages(chat_id, chunk)
+            return
+        except Exception as e:
+            logger.debug(f"deleteMessages не сработал в {chat_id}: {e}")
+        await asyncio.gather(*(bot.delete_message(chat_id, mid) for mid in chunk), return_exceptions=True)
+
+    await asyncio.gather(
+        *(delete_chunk(ids[i:i + DELETE_MESSAGES_LIMIT]) for i in range(0, len(ids), DELETE_MESSAGES_LIMIT))
+    )
+
+
+def delete_later(chat_id: int, *ids: int) -> None:
+    """Удаление в фоне: следующий ответ бота не ждёт Telegram."""
+    if any(ids):
+        _in_background(_delete_messages(chat_id, list(ids)))
+
+
 async def _append_cleanup(state: FSMContext, *ids: int):
     data = await state.get_data()
     bucket = list(data.get("cleanup_ids", []))
@@ -36,13 +101,9 @@ async def _append_cleanup(state: FSMContext, *ids: int):
 async def _cleanup_all(message: Message, state: FSMContext):
     data = await state.get_data()
     ids: list[int] = list(data.get("cleanup_ids", []))
-    # try to delete from newest to oldest
-    for mid in reversed(ids):
-        try:
-            await bot.delete_message(message.chat.id, mid)
-        except Exception:
-            pass
     await state.update_data(cleanup_ids=[])
+    # newest first, as before
+    delete_later(message.chat.id, *reversed(ids))
 
 
 async def send_and_delete_prev(message: Message, text: str, state: FSMContext, **kwargs):
@@ -50,34 +111,48 @@ async def send_and_delete_prev(message: Message, text: str, state: FSMContext, *
     prev_bot = data.get("last_bot_msg")
     prev_user = data.get("last_user_msg")
 
-    # delete previous bot prompt
-    if prev_bot:
-        try:
-            await bot.delete_message(message.chat.id, prev_bot)
-        except Exception:
-            pass
-    # delete previous user answer
-    if prev_user:
-        try:
-            await bot.delete_message(message.chat.id, prev_user)
-        except Exception:
-            pass
+    # delete previous bot prompt and user answer in the background
+    delete_later(message.chat.id, prev_bot, prev_user)
 
     sent = await message.answer(text, **kwargs)
 
-    # track current pair for cleanup and as "last"
-    await _append_cleanup(state, message.message_id, sent.message_id)
-    await state.update_data(last_bot_msg=sent.message_id, last_user_msg=message.message_id)
+    # track current pair for cleanup and as "last"; already deleted ones leave the bucket
+    bucket = [mid for mid in data.get("cleanup_ids", []) if mid not in (prev_bot, prev_user)]
+    for mid in (message.message_id, sent.message_id):
+        if mid not in bucket:
+            bucket.append(mid)
+    await state.update_data(cleanup_ids=bucket, last_bot_msg=sent.message_id, last_user_msg=message.message_id)
 
 sheets = Sheets(settings.spreadsheet_id, settings.sheet_name)
-storage = Storage()
+# итоги по дням, парам и операторам для /report; пополняются, когда outbox записал строки в лист
+ledger = Ledger()
+outbox = Outbox(sheets, batch_size=settings.outbox_batch_size, linger=settings.outbox_linger_sec, ledger=ledger)
+mirror = SheetMirror(sheets, edit_window=settings.mirror_edit_window, full_every=settings.mirror_full_every)
+# новые/изменённые строки листа → сообщения в группе GROUP_CHAT_ID (запускается в run.py)
+task_poller = TaskPoller(mirror, bot, settings.group_chat_id, batch_size=settings.tasks_batch_size)
+
+# хендлеры с flags={"sheets": True} ждут подключения к таблице (оно идёт в фоне, см. run.py)
+dp.message.middleware(SheetsReadyMiddleware(sheets))
+dp.callback_query.middleware(SheetsReadyMiddleware(sheets))
+
+if metrics.enabled:
+    dp.message.middleware(metrics.HandlerTimingMiddleware())
+    dp.callback_query.middleware(metrics.HandlerTimingMiddleware())
+    bot.session.middleware(metrics.ApiTimingMiddleware())
+    metrics.OUTBOX_DEPTH.set_function(outbox.depth)
+    metrics.SEND_QUEUE.set_function(send_scheduler.depth)
+
+
+FIX_WORDS = {"фикс"}
+CANCEL_WORDS = {"отмена"}
+NEW_DEAL_WORDS = {"новая заявка"}
 
 
 def _match(text: str | None, variants: set[str]) -> bool:
     return (text or "").strip().lower() in variants
 
 
-@dp.message(F.chat.type.in_({"group", "supergroup"}) & F.text.func(lambda t: _match(t, {"фикс"})))
+@dp.message(F.chat.type.in_({"group", "supergroup"}) & F.text.func(lambda t: _match(t, FIX_WORDS)))
 async def group_fix(message: Message, state: FSMContext):
     sent = await message.answer("Бот активирован. Что делаем?", reply_markup=main_inline_kb)
     await _append_cleanup(state, message.message_id, sent.message_id)
@@ -111,12 +186,256 @@ async def cmd_start(message: Message):
         )
 
 
-@dp.message(F.text.func(lambda t: _match(t, {"отмена"})))
+@dp.message(F.text.func(lambda t: _match(t, CANCEL_WORDS)))
 async def cancel_flow(message: Message, state: FSMContext):
     await state.clear()
     await message.answer("❌ Отменено.", reply_markup=main_kb)
 
 
+# ===== Доступ к отчётам и массовым операциям =====
+def _staff(message: Message) -> bool:
+    """/import, /recalc и /report: только в рабочей группе (GROUP_CHAT_ID) или администраторам (ADMIN_IDS)."""
+    if settings.group_chat_id and message.chat.id == settings.group_chat_id:
+        return True
+    return message.from_user is not None and message.from_user.id in settings.admin_ids
+
+
+STAFF = F.func(_staff)
+
+
+# ===== Импорт заявок из файла =====
+IMPORT_MAX_BYTES = 20 * 1024 * 1024  # больше Bot API (getFile) ботам не отдаёт
+IMPORT_PROGRESS_SEC = 3.0  # не чаще — правка статусного сообщения
+IMPORT_WAIT_SHEET_SEC = 600  # сколько показывать запись в таблицу; дальше outbox допишет сам
+
+
+class ImportForm(StatesGroup):
+    file = State()
+
+
+def _import_summary(report: ImportReport, left: int) -> str:
+    lines = [f"📥 Импорт: строк в файле {report.total}, заявок {report.queued}, с ошибками {report.error_count}"]
+    if report.queued:
+        written = report.queued - left
+        lines.append(f"✅ Записано в таблицу: {written} из {report.queued}" + ("" if not left else " (остальные — в очереди)"))
+    if report.errors:
+        lines.append("⚠️ Пропущены:")
+        lines.extend(f"• {html.escape(e)}" for e in report.errors)
+        if report.error_count > len(report.errors):
+            lines.append(f"… и ещё {report.error_count - len(report.errors)}")
+    return "\n".join(lines)
+
+
+async def _run_import(document: Document, status: Message, user: str) -> None:
+    """Скачивает файл, ставит заявки в outbox и показывает прогресс в статусном сообщении."""
+    loop = asyncio.get_running_loop()
+    shown = {"text": status.text or "", "at": 0.0}
+
+    async def show(text: str, force: bool = True) -> None:
+        if text == shown["text"] or (not force and loop.time() - shown["at"] < IMPORT_PROGRESS_SEC):
+            return
+        shown["text"], shown["at"] = text, loop.time()
+        try:
+            await bot.edit_message_text(text=text, chat_id=status.chat.id, message_id=status.message_id)
+        except TelegramBadRequest as e:
+            logger.debug(f"Импорт: статус не обновлён: {e.message}")
+
+    async def progress(report: ImportReport) -> None:
+        await show(f"⏳ Импорт: обработано строк {report.total}, в очереди {report.queued}, с ошибками {report.error_count}",
+                   force=False)
+
+    filename = document.file_name or ""
+    fd, path = tempfile.mkstemp(prefix="excelbot-import-", suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    try:
+        await bot.download(document, destination=path)
+        importer = DealImport(outbox, chunk_size=settings.import_chunk_size)
+        report = await importer.run(read_rows(path, filename), user, progress)
+    except ImportFileError as e:
+        await show(f"⚠️ Импорт не выполнен: {html.escape(str(e))}")
+        return
+    except Exception as e:
+        logger.exception(e)
+        await show("⚠️ Ошибка импорта. Проверь файл и попробуй ещё раз.")
+        return
+    finally:
+        os.remove(path)
+
+    deadline = loop.time() + IMPORT_WAIT_SHEET_SEC
+    left = outbox.remaining(report.ids)
+    while left and loop.time() < deadline:
+        await show(_import_summary(report, left), force=False)
+        await asyncio.sleep(IMPORT_PROGRESS_SEC)
+        left = outbox.remaining(report.ids)
+    await show(_import_summary(report, left))
+
+
+@dp.message(Command("import"), F.document, STAFF)
+@dp.message(ImportForm.file, F.document, STAFF)
+async def import_file(message: Message, state: FSMContext):
+    await state.clear()
+    document = message.document
+    ext = os.path.splitext(document.file_name or "")[1].lower()
+    if ext not in CSV_EXTENSIONS + XLSX_EXTENSIONS:
+        await message.answer("⚠️ Нужен файл .csv или .xlsx.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.answer("⚠️ Файл больше 20 МБ — раздели его на части.")
+        return
+    user = (message.from_user.full_name or message.from_user.username or "Неизвестный").strip()
+    status = await message.answer("⏳ Импорт: загружаю файл…")
+    # импорт может идти минутами — хендлер не держит апдейты этого чата
+    _in_background(_run_import(document, status, user))
+
+
+@dp.message(Command("import"), STAFF)
+async def cmd_import(message: Message, state: FSMContext):
+    await state.clear()
+    await state.set_state(ImportForm.file)
+    await message.answer(
+        "Пришли файл CSV или XLSX с заявками: колонки как в таблице "
+        "(имя, валюта получил, сумма, валюта отдал, сумма, комиссия, расходы, комментарий, дата) "
+        "или заголовок с их именами. Отмена — «отмена»."
+    )
+
+
+@dp.message(ImportForm.file)
+async def import_wait_file(message: Message):
+    await message.answer("Нужен файл .csv или .xlsx (или «отмена»).")
+
+
+# ===== Пересчёт прибыли за период =====
+_recalc_lock = asyncio.Lock()
+
+
+async def _run_recalc(status: Message, date_from: date, date_to: date, all_rows: bool) -> None:
+    async with _recalc_lock:
+        try:
+            report = await recalc(sheets, mirror, date_from, date_to, all_rows=all_rows, ledger=ledger)
+            text = (
+                f"✅ Пересчёт {date_from.strftime('%d.%m.%Y')}–{date_to.strftime('%d.%m.%Y')}: "
+                f"строк {report.checked}, обновлено {report.updated}"
+            )
+            if report.no_rate or report.invalid:
+                text += f"\n⚠️ Без курса: {report.no_rate}, не разобрать сумму: {report.invalid}"
+        except Exception as e:
+            logger.exception(e)
+            text = "⚠️ Ошибка пересчёта. Попробуй позже."
+    try:
+        await bot.edit_message_text(text=text, chat_id=status.chat.id, message_id=status.message_id)
+    except TelegramBadRequest as e:
+        logger.debug(f"Пересчёт: статус не обновлён: {e.message}")
+
+
+@dp.message(Command("recalc"), STAFF, flags={"sheets": True})
+async def cmd_recalc(message: Message):
+    """/recalc ДД.ММ.ГГГГ ДД.ММ.ГГГГ [все] — пересчитать прибыль «н/д» и по устаревшему курсу (или все строки)."""
+    args = (message.text or "").split()[1:]
+    try:
+        date_from, date_to = parse_day(args[0]), parse_day(args[1] if len(args) > 1 else args[0])
+    except (IndexError, ValueError):
+        await message.answer(
+            "Формат: /recalc 01.03.2025 31.03.2025 [все] — без «все» только строки с прибылью «н/д» "
+            "или по устаревшему курсу."
+        )
+        return
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+    if _recalc_lock.locked():
+        await message.answer("⏳ Пересчёт уже идёт, дождись его окончания.")
+        return
+    all_rows = len(args) > 2 and args[2].lower() in ("все", "all")
+    status = await message.answer("⏳ Пересчитываю прибыль…")
+    _in_background(_run_recalc(status, date_from, date_to, all_rows))
+
+
+
+# ===== Отчёт по заявкам =====
+REPORT_TOP = 10
+_rebuild_lock = asyncio.Lock()
+
+
+def _money(value: float) -> str:
+    return f"{value:,.2f}".replace(",", " ")
+
+
+def _report_period(args: list[str]) -> tuple[date, date]:
+    today = datetime.now().date()
+    if not args or args[0].lower() in ("сегодня", "today"):
+        return today, today
+    word = args[0].lower()
+    if word in ("неделя", "week"):
+        return today - timedelta(days=6), today
+    if word in ("месяц", "month"):
+        return today.replace(day=1), today
+    date_from, date_to = parse_day(args[0]), parse_day(args[1] if len(args) > 1 else args[0])
+    return (date_from, date_to) if date_from <= date_to else (date_to, date_from)
+
+
+def _report_text(report: Report) -> str:
+    span = date.fromisoformat(report.date_from).strftime("%d.%m.%Y")
+    if report.date_to != report.date_from:
+        span += "–" + date.fromisoformat(report.date_to).strftime("%d.%m.%Y")
+    lines = [f"📊 <b>Отчёт {span}</b>", f"Заявок: {report.deals}, прибыль: {_money(report.profit_eur)} EUR"]
+    if report.no_profit:
+        lines.append(f"⚠️ Без прибыли («н/д»): {report.no_profit}")
+    if not report.deals:
+        return "\n".join(lines)
+    if len(report.by_day) > 1:
+        lines.append("\n<b>По дням</b>")
+        lines += [f"{date.fromisoformat(d).strftime('%d.%m')}: {int(n)} · {_money(p)} EUR" for d, n, p in report.by_day]
+    lines.append("\n<b>Пары</b>")
+    lines += [
+        f"{html.escape(cin)}→{html.escape(cout)}: {int(n)} · {_money(a_in)} → {_money(a_out)} · {_money(p)} EUR"
+        for cin, cout, n, a_in, a_out, p in report.by_pair
+    ]
+    lines.append("\n<b>Операторы</b>")
+    lines += [f"{html.escape(name or '—')}: {int(n)} · {_money(p)} EUR" for name, n, p in report.by_user]
+    return "\n".join(lines)
+
+
+async def _run_rebuild(status: Message) -> None:
+    async with _rebuild_lock:
+        try:
+            deals = await ledger.rebuild(sheets)
+            text = f"✅ Итоги пересобраны по таблице: заявок {deals}"
+        except Exception as e:
+            logger.exception(e)
+            text = "⚠️ Не удалось пересобрать итоги. Попробуй позже."
+    try:
+        await bot.edit_message_text(text=text, chat_id=status.chat.id, message_id=status.message_id)
+    except TelegramBadRequest as e:
+        logger.debug(f"Отчёт: статус не обновлён: {e.message}")
+
+
+@dp.message(
+    Command("report", magic=F.args.func(lambda a: _match(a, {"пересобрать", "rebuild"}))), STAFF, flags={"sheets": True}
+)
+async def cmd_report_rebuild(message: Message):
+    """/report пересобрать — пересчитать итоги по всей таблице (после ручных правок листа)."""
+    if _rebuild_lock.locked():
+        await message.answer("⏳ Итоги уже пересобираются.")
+        return
+    status = await message.answer("⏳ Пересобираю итоги по таблице…")
+    _in_background(_run_rebuild(status))
+
+
+@dp.message(Command("report"), STAFF)
+async def cmd_report(message: Message):
+    """/report [неделя|месяц|ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]] — итоги из ledger, без чтения таблицы."""
+    try:
+        date_from, date_to = _report_period((message.text or "").split()[1:])
+    except ValueError:
+        await message.answer("Формат: /report, /report неделя, /report месяц или /report 01.03.2025 31.03.2025.")
+        return
+    report = await asyncio.to_thread(ledger.report, date_from, date_to, REPORT_TOP)
+    await message.answer(_report_text(report))
+
+
+@dp.message(Command("import", "recalc", "report"))
+async def staff_only(message: Message):
+    await message.answer("⛔ Команда доступна только в рабочей группе и администраторам бота.")
+
 # ===== FSM =====
 
 
@@ -130,7 +449,7 @@ class DealForm(StatesGroup):
     comment = State()
 
 
-@dp.message(F.text.func(lambda t: _match(t, {"новая заявка"})))
+@dp.message(F.text.func(lambda t: _match(t, NEW_DEAL_WORDS)))
 async def new_deal_start(message: Message, state: FSMContext):
     await state.clear()
     await state.set_state(DealForm.currency_in)
@@ -181,31 +500,32 @@ async def step_amount_out(message: Message, state: FSMContext):
     # Сохраняем сумму ОТДАЛ
     await state.update_data(amount_out=message.text.strip())
 
-    # Считаем ориентир комиссии по курсу: (EUR(получил) - EUR(отдал)) / EUR(отдал) * 100
+    # Фиксируем курсы сделки и считаем ориентир комиссии: (EUR(получил) - EUR(отдал)) / EUR(отдал) * 100
     data = await state.get_data()
     try:
-        amount_in = Decimal(str(data.get("amount_in", "0")).replace(",", "."))
-        amount_out = Decimal(str(data.get("amount_out", "0")).replace(",", "."))
-        cur_in = data.get("currency_in", "?")
-        cur_out = data.get("currency_out", "?")
-        today = datetime.now().date()
-
-        eur_in = await convert_to_eur(amount_in, cur_in, today)
-        eur_out = await convert_to_eur(amount_out, cur_out, today)
-        suggested = None
-        if eur_in is not None and eur_out not in (None, Decimal("0")) and eur_out > 0:
-            profit_eur = (eur_in - eur_out)
-            suggested = (profit_eur / eur_out * Decimal("100")).quantize(Decimal("0.01"))
+        quote = await DealQuote.create(
+            data.get("currency_in", "?"),
+            Decimal(str(data.get("amount_in", "0")).replace(",", ".")),
+            data.get("currency_out", "?"),
+            Decimal(str(data.get("amount_out", "0")).replace(",", ".")),
+            datetime.now().date(),
+            budget=settings.rates_budget_sec,
+        )
+        await state.update_data(quote=quote.to_dict())
+        suggested = quote.suggested_commission
+        stale_note = quote.stale_note
     except Exception:
         suggested = None
+        stale_note = ""
 
     # Сохраняем ориентир в состоянии и спрашиваем у пользователя его процент
     await state.set_state(DealForm.commission)
     if suggested is not None:
         await state.update_data(suggested_commission=str(suggested))
+        warn = f"\n⚠️ Расчёт по {stale_note}." if stale_note else ""
         await send_and_delete_prev(
             message,
-            f"💰 По курсу прибыль составила примерно <b>{suggested}</b> %.\n\nУкажи свой процент прибыли (если другой). Если согласен — напиши '-' или оставь как есть:",
+            f"💰 По курсу прибыль составила примерно <b>{suggested}</b> %.{warn}\n\nУкажи свой процент прибыли (если другой). Если согласен — напиши '-' или оставь как есть:",
             state,
         )
     else:
@@ -225,16 +545,7 @@ async def step_commission(message: Message, state: FSMContext):
     if txt in {"", "-", "—"} and suggested:
         commission = suggested
     else:
-        raw = txt.replace("%", "").replace(",", ".")
-        try:
-            val = Decimal(raw)
-        except Exception:
-            val = Decimal("0")
-        if val < 0:
-            val = Decimal("0")
-        if val > 10:
-            val = Decimal("10")
-        commission = str(val.quantize(Decimal("0.01")))
+        commission = normalize_commission(txt) or "0.00"
 
     await state.update_data(commission=commission)
     await state.set_state(DealForm.expenses)
@@ -242,27 +553,14 @@ async def step_commission(message: Message, state: FSMContext):
 
 @dp.message(DealForm.expenses)
 async def step_expenses(message: Message, state: FSMContext):
-    txt = (message.text or "").strip()
-    if txt in {"", "-", "—"}:
-        expenses_pct = "0"
-    else:
-        raw = txt.replace("%", "").replace(",", ".")
-        try:
-            val = Decimal(raw)
-        except Exception:
-            val = Decimal("0")
-        if val < 0:
-            val = Decimal("0")
-        if val > 100:
-            val = Decimal("100")
-        expenses_pct = str(val.quantize(Decimal("0.01")))
+    expenses_pct = normalize_expenses(message.text or "")
     await state.update_data(expenses=expenses_pct)
     await state.set_state(DealForm.comment)
     await send_and_delete_prev(message, "Комментарий (если нет — напиши '-'):", state)
 
 
 @dp.message(DealForm.comment)
-async def step_comment(message: Message, state: FSMContext):
+async def step_comment(message: Message, state: FSMContext, event_update: Update):
     data = await state.get_data()
     user = (message.from_user.full_name or message.from_user.username or "Неизвестный").strip()
     comment = message.text.strip()
@@ -278,52 +576,25 @@ async def step_comment(message: Message, state: FSMContext):
 
         today = datetime.now().date()
 
-        eur_in = await convert_to_eur(amount_in, currency_in, today)
-        eur_out = await convert_to_eur(amount_out, currency_out, today)
-
-        profit_eur_gross = None
-        if eur_in is not None and eur_out is not None:
-            profit_eur_gross = (eur_in - eur_out)
-
-        # Комиссия: приоритет — введённая пользователем; иначе авто-маркап
-        commission_str = (data.get("commission") or "").strip()
-        if not commission_str:
-            if profit_eur_gross is not None and eur_out is not None and eur_out > 0:
-                commission_pct = (profit_eur_gross / eur_out * Decimal("100")).quantize(Decimal("0.01"))
-                commission_str = str(commission_pct)
-            else:
-                commission_str = ""
-
-        # Расходы в процентах (из состояния), влияет на чистую прибыль
+        # курсы, зафиксированные на шаге суммы; заново — только если их нет
+        quote = DealQuote.from_dict(data["quote"]) if data.get("quote") else None
+        if quote is None or not quote.matches(currency_in, amount_in, currency_out, amount_out):
+            quote = await DealQuote.create(
+                currency_in, amount_in, currency_out, amount_out, today, budget=settings.rates_budget_sec
+            )
+        # комиссия: введённая пользователем, иначе — рассчитанная по курсам; расходы уменьшают прибыль
         expenses_str = (data.get("expenses") or "0").strip()
-        try:
-            expenses_pct = Decimal(expenses_str.replace(",", "."))
-        except Exception:
-            expenses_pct = Decimal("0")
-        if expenses_pct < 0:
-            expenses_pct = Decimal("0")
-        if expenses_pct > 100:
-            expenses_pct = Decimal("100")
-
-        profit_eur = None
-        if profit_eur_gross is not None:
-            profit_eur = (profit_eur_gross * (Decimal("1") - expenses_pct / Decimal("100"))).quantize(Decimal("0.01"))
-
-        row = [
-            user,
-            currency_in,
-            str(amount_in),
-            currency_out,
-            str(amount_out),
-            commission_str,
-            expenses_str,
-            comment,
-            today.strftime("%d.%m.%Y"),
-            str(profit_eur) if profit_eur is not None else "н/д",
-        ]
-
-        sheets.append_deal(row)
-        ok = await message.answer("✅ Заявка зафиксирована и добавлена в таблицу.")
+        row = quote.sheet_row(user, data.get("commission") or "", expenses_str, comment, today)
+        profit_eur = quote.profit_eur(expenses_str)
+        stale_note = quote.stale_note
+
+        # запись в таблицу идёт в фоне (outbox), пользователь не ждёт Google API;
+        # повтор апдейта после падения воркера заявку второй раз не ставит
+        outbox.enqueue(row, update_id=event_update.update_id)
+        ok_text = "✅ Заявка зафиксирована и будет добавлена в таблицу."
+        if stale_note and profit_eur is not None:
+            ok_text += f"\n⚠️ Прибыль посчитана по {stale_note}."
+        ok = await message.answer(ok_text)
         # include the final user message and ok-message into cleanup
         await _append_cleanup(state, message.message_id, ok.message_id)
         # full wipe: 'фикс' final message
@@ -340,4 +611,16 @@ async def step_comment(message: Message, state: FSMContext):
         logger.exception(e)
         await message.answer("⚠️ Ошибка при обработке заявки. Проверь ввод или подключение.")
 
-    await state.clear()
\ No newline at end of file
+    await state.clear()
+
+
+# ===== Отсев сообщений не боту =====
+# сообщения без команды, ключевого слова и состояния FSM отбрасываются до чтения
+# состояния (FSMContextMiddleware) — поэтому фильтр встаёт перед ним
+dp.update.outer_middleware.unregister(dp.fsm)
+dp.update.outer_middleware(
+    ChatterFilterMiddleware(
+        dp.fsm, fsm_storage, keywords=FIX_WORDS | CANCEL_WORDS | NEW_DEAL_WORDS, commands=message_commands(dp)
+    )
+)
+dp.update.outer_middleware(dp.fsm)
@@ -10,7 +10,70 @@ class Settings:
     spreadsheet_id: str = os.getenv("SPREADSHEET_ID", "")
     sheet_name: str = os.getenv("SHEET_NAME", "Tasks")
     group_chat_id: int = int(os.getenv("GROUP_CHAT_ID", "0"))
+    # Кто, кроме участников группы GROUP_CHAT_ID, может /import, /recalc и /report (id пользователей через запятую)
+    admin_ids: tuple = tuple(int(i) for i in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if i)
     send_interval_sec: int = int(os.getenv("SEND_INTERVAL_SEC", "180"))
+    # Сколько задач из листа публиковать в группу за один цикл SEND_INTERVAL_SEC
+    tasks_batch_size: int = int(os.getenv("TASKS_BATCH_SIZE", "20"))
+    db_path: str = os.getenv("DB_PATH", "excelbot.db")
+    # Режим получения апдейтов: polling | webhook
+    run_mode: str = os.getenv("RUN_MODE", "polling").lower()
+    webhook_base_url: str = os.getenv("WEBHOOK_BASE_URL", "")
+    webhook_path: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    webhook_host: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    webhook_port: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+    webhook_secret: str = os.getenv("WEBHOOK_SECRET", "")
+    webhook_concurrency: int = int(os.getenv("WEBHOOK_CONCURRENCY", "32"))
+    webhook_drain_sec: float = float(os.getenv("WEBHOOK_DRAIN_SEC", "30"))
+    # Процессы-воркеры (1 — всё в одном процессе) и сколько апдейтов разных чатов воркер обрабатывает одновременно
+    workers: int = int(os.getenv("WORKERS", "1"))
+    worker_concurrency: int = int(os.getenv("WORKER_CONCURRENCY", "32"))
+    # Исходящие запросы к Telegram: общий лимит в секунду (на все процессы), лимит чата и группы, повторы после 429
+    send_global_rate: float = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+    send_chat_rate: float = float(os.getenv("SEND_CHAT_RATE", "1"))
+    send_group_per_min: float = float(os.getenv("SEND_GROUP_PER_MIN", "20"))
+    send_max_retries: int = int(os.getenv("SEND_MAX_RETRIES", "3"))
+    # Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 — выключены)
+    metrics_port: int = int(os.getenv("METRICS_PORT", "0"))
+    metrics_host: str = os.getenv("METRICS_HOST", "127.0.0.1")
+    # FSM-хранилище: сколько состояний держать в памяти и как часто сбрасывать на диск
+    fsm_hot_size: int = int(os.getenv("FSM_HOT_SIZE", "10000"))
+    fsm_flush_sec: float = float(os.getenv("FSM_FLUSH_SEC", "0.5"))
+    # Очередь записи заявок в таблицу (outbox в excelbot.db)
+    outbox_batch_size: int = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    outbox_linger_sec: float = float(os.getenv("OUTBOX_LINGER_SEC", "0.5"))
+    # Импорт заявок из файла (/import): сколько строк читать и обсчитывать за раз
+    import_chunk_size: int = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+    # Локальное зеркало листа (sheet_rows в excelbot.db)
+    mirror_sync_sec: int = int(os.getenv("MIRROR_SYNC_SEC", "300"))
+    mirror_edit_window: int = int(os.getenv("MIRROR_EDIT_WINDOW", "200"))
+    mirror_full_every: int = int(os.getenv("MIRROR_FULL_EVERY", "48"))
+    # HTTP-клиент для курсов валют (общий пул соединений)
+    rates_timeout_sec: float = float(os.getenv("RATES_TIMEOUT_SEC", "10"))
+    rates_http2: bool = os.getenv("RATES_HTTP2", "0").lower() in ("1", "true", "yes")
+    rates_max_connections: int = int(os.getenv("RATES_MAX_CONNECTIONS", "20"))
+    rates_max_per_host: int = int(os.getenv("RATES_MAX_PER_HOST", "4"))
+    # Опрос провайдеров курсов: race (все сразу) | hedge (с задержкой) | sequential
+    rates_mode: str = os.getenv("RATES_MODE", "hedge").lower()
+    rates_hedge_delay_sec: float = float(os.getenv("RATES_HEDGE_DELAY_SEC", "0.4"))
+    rates_provider_priority: tuple = tuple(
+        p.strip().lower()
+        for p in os.getenv("RATES_PROVIDER_PRIORITY", "frankfurter,exhost,fawaz,floatrates").split(",")
+        if p.strip()
+    )
+    # Сколько секунд шаг заявки ждёт курс, прежде чем взять последний известный
+    rates_budget_sec: float = float(os.getenv("RATES_BUDGET_SEC", "4"))
+    # Здоровье провайдеров: после N ошибок подряд источник пропускается на время cooldown
+    rates_breaker_failures: int = int(os.getenv("RATES_BREAKER_FAILURES", "3"))
+    rates_breaker_cooldown_sec: float = float(os.getenv("RATES_BREAKER_COOLDOWN_SEC", "60"))
+    # Кэш курсов: LRU в памяти + таблица rates в excelbot.db
+    rates_cache_size: int = int(os.getenv("RATES_CACHE_SIZE", "2048"))
+    rates_cache_max_rows: int = int(os.getenv("RATES_CACHE_MAX_ROWS", "50000"))
+    rates_latest_ttl_sec: int = int(os.getenv("RATES_LATEST_TTL_SEC", "3600"))
+    # Ряды курсов по дням (прошлые даты) — файл рядом с базой
+    rates_series_path: str = os.getenv(
+        "RATES_SERIES_PATH", os.path.splitext(os.getenv("DB_PATH", "excelbot.db"))[0] + ".rates"
+    )
 
 settings = Settings()
 
@@ -16,9 +16,16 @@ COLUMNS = {
     "expenses": 6,          # Расходы % (доп. издержки)
     "comment": 7,           # Комментарий
     "date_fixed": 8,        # Дата фиксации
-    "profit_eur": 9         # Прибыль в евро 💶 (с учётом расходов)
+    "profit_eur": 9,        # Прибыль в евро 💶 (с учётом расходов)
+    "rate_stale": 10,       # Отметка, если прибыль посчитана по устаревшему курсу
+    "rate_source": 11,      # Источник курсов (frankfurter, fawaz, ...)
+    "rate_time": 12         # Когда получены курсы
 }
 
+# Служебная колонка за последней колонкой листа (N): метка заявки из outbox — по ней
+# строка узнаётся в таблице (сверка после потерянного ответа Google, пересборка ledger)
+MARK_COLUMN = len(COLUMNS)
+
 # Главное меню
 main_kb = ReplyKeyboardMarkup(
     keyboard=[
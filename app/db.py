@@ -0,0 +1,14 @@
+from __future__ import annotations
+
+import sqlite3
+from typing import Optional
+
+from .config import settings
+
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """Открывает excelbot.db (WAL, можно использовать из фоновых потоков)."""
+    conn = sqlite3.connect(path or settings.db_path, timeout=10.0, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
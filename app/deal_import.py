@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import itertools
+import os
+from dataclasses import dataclass, field
+from datetime import date as date_type
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from .constants import COLUMNS, CURRENCIES
+from .outbox import Outbox
+from .quote import DealQuote, normalize_commission, normalize_expenses
+from .rates import RateQuote, get_rate_quote
+from .utils import parse_day
+
+# колонки, которые берутся из файла; остальные (прибыль, источник курса...) считает бот
+_INPUT_COLUMNS = ("name", "currency_in", "amount_in", "currency_out", "amount_out", "commission", "expenses",
+                  "comment", "date_fixed")
+CSV_EXTENSIONS = (".csv", ".txt")
+XLSX_EXTENSIONS = (".xlsx", ".xlsm")
+MAX_REPORTED_ERRORS = 20
+
+Progress = Callable[["ImportReport"], Awaitable[None]]
+
+
+class ImportFileError(ValueError):
+    """Файл не прочитать целиком (формат, пустой файл, нет openpyxl)."""
+
+
+@dataclass
+class ImportReport:
+    total: int = 0        # строк с данными в файле (прочитано на текущий момент)
+    queued: int = 0       # поставлено в outbox
+    ids: List[int] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    error_count: int = 0
+
+    def error(self, line: int, text: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"строка {line}: {text}")
+
+
+@dataclass(frozen=True)
+class ImportedDeal:
+    line: int
+    name: str
+    currency_in: str
+    amount_in: Decimal
+    currency_out: str
+    amount_out: Decimal
+    commission: str
+    expenses: str
+    comment: str
+    day: date_type
+
+
+# ===== Чтение файла (построчно, без загрузки целиком) =====
+def _cell(value: object) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y")
+    if isinstance(value, date_type):
+        return value.strftime("%d.%m.%Y")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _csv_rows(path: str) -> Iterator[List[str]]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.reader(f, dialect):
+            yield [c.strip() for c in row]
+
+
+def _xlsx_rows(path: str) -> Iterator[List[str]]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:  # pragma: no cover - зависит от окружения
+        raise ImportFileError("для XLSX нужен пакет openpyxl (pip install openpyxl)") from e
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in wb.worksheets[0].iter_rows(values_only=True):
+            yield [_cell(c) for c in row]
+    finally:
+        wb.close()
+
+
+def read_rows(path: str, filename: str = "") -> Iterator[Tuple[int, List[str]]]:
+    """(номер строки файла, ячейки) для CSV (`;` или `,`) и XLSX (первый лист); пустые строки пропускаются."""
+    ext = os.path.splitext(filename or path)[1].lower()
+    if ext in XLSX_EXTENSIONS:
+        rows = _xlsx_rows(path)
+    elif ext in CSV_EXTENSIONS:
+        rows = _csv_rows(path)
+    else:
+        raise ImportFileError("поддерживаются только файлы .csv и .xlsx")
+    for line, row in enumerate(rows, start=1):
+        if any(row):
+            yield line, row
+
+
+def header_map(row: List[str]) -> Optional[Dict[str, int]]:
+    """Колонки по заголовку (имена как в COLUMNS: currency_in, amount_in...); None — заголовка нет."""
+    names = {c.strip().lower(): i for i, c in enumerate(row) if c}
+    found = {name: names[name] for name in _INPUT_COLUMNS if name in names}
+    return found or None
+
+
+_POSITIONAL = {name: COLUMNS[name] for name in _INPUT_COLUMNS}
+
+
+# ===== Проверка строк =====
+def _amount(text: str) -> Decimal:
+    try:
+        value = Decimal(text.replace(" ", "").replace(" ", "").replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"сумма «{text}» — не число")
+    if not value.is_finite() or value <= 0:
+        raise ValueError(f"сумма «{text}» должна быть больше нуля")
+    return value
+
+
+def _currency(text: str) -> str:
+    code = text.strip().upper()
+    if code not in CURRENCIES:
+        raise ValueError(f"валюта «{text}» не из списка {', '.join(CURRENCIES)}")
+    return code
+
+
+def _day(text: str, default: date_type) -> date_type:
+    return parse_day(text) if text.strip() else default
+
+
+def parse_deal(line: int, row: List[str], columns: Dict[str, int], default_name: str, today: date_type) -> ImportedDeal:
+    def get(name: str) -> str:
+        i = columns.get(name)
+        return row[i].strip() if i is not None and i < len(row) else ""
+
+    day = _day(get("date_fixed"), today)
+    if day > today:
+        raise ValueError(f"дата {day.strftime('%d.%m.%Y')} в будущем")
+    comment = get("comment")
+    return ImportedDeal(
+        line=line,
+        name=get("name") or default_name,
+        currency_in=_currency(get("currency_in")),
+        amount_in=_amount(get("amount_in")),
+        currency_out=_currency(get("currency_out")),
+        amount_out=_amount(get("amount_out")),
+        commission=normalize_commission(get("commission")),
+        expenses=normalize_expenses(get("expenses")),
+        comment="" if comment == "-" else comment,
+        day=day,
+    )
+
+
+# ===== Импорт =====
+class DealImport:
+    """Массовый импорт заявок из файла в outbox.
+
+    Файл читается пачками по `chunk_size` строк (чтение — в потоке, цикл
+    событий не блокируется). Для пачки курсы запрашиваются один раз на каждую
+    пару (валюта, дата), дальше строки листа собираются так же, как в диалоге
+    заявки (DealQuote.sheet_row), и одним enqueue_many уходят в outbox —
+    его воркер пишет их в таблицу пачками append_rows.
+    """
+
+    def __init__(self, outbox: Outbox, chunk_size: int = 500, budget: Optional[float] = None):
+        self.outbox = outbox
+        self.chunk_size = max(1, chunk_size)
+        self.budget = budget
+        self._quotes: Dict[Tuple[str, date_type], Optional[RateQuote]] = {}
+
+    async def _fetch_quotes(self, deals: List[ImportedDeal]) -> None:
+        keys = list({(code, d.day) for d in deals for code in (d.currency_in, d.currency_out)} - self._quotes.keys())
+        if not keys:
+            return
+        results = await asyncio.gather(
+            *(get_rate_quote(code, day, budget=self.budget) for code, day in keys), return_exceptions=True
+        )
+        for key, result in zip(keys, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Импорт: курс {key[0]} на {key[1]} не получен: {result}")
+                result = None
+            # последний известный курс (stale) не годится: строка уйдёт с «н/д», её поправит /recalc
+            self._quotes[key] = result if result is not None and not result.stale else None
+
+    def _row(self, deal: ImportedDeal) -> List[str]:
+        quote = DealQuote(
+            deal.currency_in,
+            deal.amount_in,
+            deal.currency_out,
+            deal.amount_out,
+            self._quotes.get((deal.currency_in, deal.day)),
+            self._quotes.get((deal.currency_out, deal.day)),
+        )
+        return quote.sheet_row(deal.name, deal.commission, deal.expenses, deal.comment, deal.day)
+
+    async def run(
+        self,
+        rows: Iterator[Tuple[int, List[str]]],
+        default_name: str,
+        progress: Optional[Progress] = None,
+    ) -> ImportReport:
+        report = ImportReport()
+        today = datetime.now().date()
+        columns: Optional[Dict[str, int]] = None
+        while True:
+            chunk = await asyncio.to_thread(lambda: list(itertools.islice(rows, self.chunk_size)))
+            if not chunk:
+                break
+            if columns is None:
+                columns = header_map(chunk[0][1])
+                if columns is not None:
+                    chunk = chunk[1:]
+                else:
+                    columns = _POSITIONAL  # без заголовка — колонки в порядке листа
+            deals: List[ImportedDeal] = []
+            for line, row in chunk:
+                report.total += 1
+                try:
+                    deals.append(parse_deal(line, row, columns, default_name, today))
+                except ValueError as e:
+                    report.error(line, str(e))
+            if deals:
+                await self._fetch_quotes(deals)
+                ids = self.outbox.enqueue_many([self._row(d) for d in deals])
+                report.ids.extend(ids)
+                report.queued += len(ids)
+            if progress is not None:
+                await progress(report)
+        logger.info(f"Импорт: строк {report.total}, в очереди {report.queued}, с ошибками {report.error_count}")
+        return report
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType
+from aiogram.types import TelegramObject
+from loguru import logger
+
+# Счётчики обращений к FSM-хранилищу: всего апдейтов, операций и максимум за один апдейт
+stats: Dict[str, int] = {"updates": 0, "ops": 0, "max_ops": 0}
+
+
+class StateSession(FSMContext):
+    """FSMContext на время одного апдейта: данные читаются из хранилища один раз,
+    хендлеры и хелперы меняют локальную копию, а flush() пишет итог одной
+    операцией (set_state_data хранилища; если его нет — set_state и set_data).
+    Состояние берётся из raw_state, который aiogram уже прочитал для фильтров,
+    так что отдельного get_state нет."""
+
+    def __init__(self, context: FSMContext, raw_state: Optional[str]) -> None:
+        super().__init__(storage=context.storage, key=context.key)
+        self._state = raw_state
+        self._data: Optional[Dict[str, Any]] = None
+        self._state_dirty = False
+        self._data_dirty = False
+        self.ops = 0
+
+    async def _load(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = dict(await super().get_data())
+            self.ops += 1
+        return self._data
+
+    async def get_state(self) -> Optional[str]:
+        return self._state
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+        self._state_dirty = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        return dict(await self._load())
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self._data = dict(data)
+        self._data_dirty = True
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        current = await self._load()
+        current.update(kwargs)
+        self._data_dirty = True
+        return dict(current)
+
+    async def clear(self) -> None:
+        self._state = None
+        self._data = {}
+        self._state_dirty = self._data_dirty = True
+
+    async def flush(self) -> None:
+        if self._state_dirty and self._data_dirty and self._data is not None:
+            set_state_data = getattr(self.storage, "set_state_data", None)
+            if set_state_data is not None:
+                await set_state_data(self.key, self._state, self._data)
+                self.ops += 1
+                self._state_dirty = self._data_dirty = False
+                return
+        if self._state_dirty:
+            await super().set_state(self._state)
+            self.ops += 1
+            self._state_dirty = False
+        if self._data_dirty and self._data is not None:
+            await super().set_data(self._data)
+            self.ops += 1
+            self._data_dirty = False
+
+
+class StateSessionMiddleware(BaseMiddleware):
+    """Подменяет `state` в хендлерах на StateSession и сбрасывает изменения после хендлера."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        context = data.get("state")
+        if context is None or isinstance(context, StateSession):
+            return await handler(event, data)
+        session = StateSession(context, data.get("raw_state"))
+        data["state"] = session
+        try:
+            return await handler(event, data)
+        finally:
+            await session.flush()
+            stats["updates"] += 1
+            stats["ops"] += session.ops
+            stats["max_ops"] = max(stats["max_ops"], session.ops)
+            logger.debug(f"FSM: {session.ops} операций с хранилищем за апдейт")
@@ -1,9 +1,12 @@
 from __future__ import annotations
+import asyncio
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
 from loguru import logger
-from typing import Any, cast, List
+from typing import Any, cast, List, Tuple
 
+from . import metrics
 from .constants import COLUMNS
 
 SCOPES = [
@@ -13,37 +16,122 @@ SCOPES = [
 
 
 class Sheets:
+    """Лист с заявками. Конструктор ничего не загружает: подключение к Google
+    (ключ, OAuth, open_by_key, worksheet) выполняет connect()/start() при запуске бота."""
+
     def __init__(self, spreadsheet_id: str, sheet_name: str, cred_path: str = "credentials.json"):
-        creds = Credentials.from_service_account_file(cred_path, scopes=SCOPES)
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.cred_path = cred_path
+        self.spreadsheet: gspread.Spreadsheet | None = None
+        self._ws: gspread.Worksheet | None = None
+        self.ready = asyncio.Event()
+
+    def connect(self) -> None:
+        """Блокирующее подключение к таблице (вызывать из потока, см. start)."""
+        creds = Credentials.from_service_account_file(self.cred_path, scopes=SCOPES)
         client = gspread.authorize(creds)
-        self.ws = client.open_by_key(spreadsheet_id).worksheet(sheet_name)
-        logger.info(f"Google Sheets подключен: {sheet_name}")
+        self.spreadsheet = client.open_by_key(self.spreadsheet_id)
+        self._ws = self.spreadsheet.worksheet(self.sheet_name)
+        logger.info(f"Google Sheets подключен: {self.sheet_name}")
+
+    async def start(self, retry_delay: float = 5.0, max_delay: float = 300.0) -> None:
+        """Подключается в фоне, повторяя попытки, пока Google не ответит."""
+        delay = retry_delay
+        while not self.ready.is_set():
+            try:
+                await asyncio.to_thread(self.connect)
+                self.ready.set()
+            except Exception as e:
+                logger.warning(f"Google Sheets недоступен ({e}), повтор через {delay:.0f} с")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    async def wait_ready(self, timeout: float | None = None) -> bool:
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @property
+    def ws(self) -> gspread.Worksheet:
+        if self._ws is None:
+            raise RuntimeError("Google Sheets ещё не подключен")
+        return self._ws
+
+    @staticmethod
+    def prepare_row(values: List[str]) -> List[str]:
+        """Проверяет длину строки и применяет расходы (%) к прибыли."""
+        if len(values) != len(COLUMNS):
+            logger.warning(f"append_deal: ожидается {len(COLUMNS)} значений, получено {len(values)}")
+
+        # Коррекция прибыли с учетом расходов (%). Если поле заполнено, уменьшаем прибыль.
+        try:
+            expense_pct = float(values[COLUMNS['expenses']]) if values[COLUMNS['expenses']] else 0
+            profit_eur = float(values[COLUMNS['profit_eur']]) if values[COLUMNS['profit_eur']] else 0
+            if expense_pct > 0 and profit_eur != 0:
+                adjusted_profit = profit_eur * (1 - expense_pct / 100)
+                values[COLUMNS['profit_eur']] = f"{adjusted_profit:.2f}"
+        except Exception as err:
+            logger.warning(f"Ошибка расчета прибыли с учетом расходов: {err}")
+        return values
 
     def append_deal(self, values: List[str]) -> None:
         """Добавляет заявку (одну строку) в конец листа по новому ТЗ."""
         try:
-            if len(values) != len(COLUMNS):
-                logger.warning(f"append_deal: ожидается {len(COLUMNS)} значений, получено {len(values)}")
-
-            # Коррекция прибыли с учетом расходов (%). Если поле заполнено, уменьшаем прибыль.
-            try:
-                expense_pct = float(values[COLUMNS['expenses']]) if values[COLUMNS['expenses']] else 0
-                profit_eur = float(values[COLUMNS['profit_eur']]) if values[COLUMNS['profit_eur']] else 0
-                if expense_pct > 0 and profit_eur != 0:
-                    adjusted_profit = profit_eur * (1 - expense_pct / 100)
-                    values[COLUMNS['profit_eur']] = f"{adjusted_profit:.2f}"
-            except Exception as err:
-                logger.warning(f"Ошибка расчета прибыли с учетом расходов: {err}")
-
-            self.ws.append_row(values, value_input_option=cast(Any, "USER_ENTERED"))
+            with metrics.SHEETS_SECONDS.time(op="append_deal"):
+                self.ws.append_row(self.prepare_row(values), value_input_option=cast(Any, "USER_ENTERED"))
             logger.info("Добавлена новая заявка в Google Sheet!")
         except Exception as e:
             logger.exception(e)
             raise
 
+    def append_rows(self, rows: List[List[str]]) -> None:
+        """Добавляет уже подготовленные строки (prepare_row) одним запросом append_rows."""
+        with metrics.SHEETS_SECONDS.time(op="append_rows"):
+            self.ws.append_rows(rows, value_input_option=cast(Any, "USER_ENTERED"))
+        logger.info(f"Добавлено заявок в Google Sheet: {len(rows)}")
+
+    def update_rows(self, updates: List[Tuple[int, List[str]]], first_column: str = "name") -> None:
+        """Переписывает ячейки строк [(номер строки, значения с колонки `first_column`)] одним batch_update."""
+        if not updates:
+            return
+        col = COLUMNS[first_column] + 1
+        data = [
+            {"range": f"{rowcol_to_a1(row, col)}:{rowcol_to_a1(row, col + len(values) - 1)}", "values": [values]}
+            for row, values in updates
+        ]
+        with metrics.SHEETS_SECONDS.time(op="update_rows"):
+            self.ws.batch_update(data, value_input_option=cast(Any, "USER_ENTERED"))
+        logger.info(f"Обновлено строк в Google Sheet: {len(updates)}")
+
+    def tail(self, n: int, columns: int = len(COLUMNS)) -> list[list[str]]:
+        """Последние `n` заполненных строк листа (по первой колонке, `columns` колонок), без чтения всего листа."""
+        with metrics.SHEETS_SECONDS.time(op="tail"):
+            last = len(self.ws.col_values(1))
+            if last == 0 or n <= 0:
+                return []
+            first = max(1, last - n + 1)
+            return self.ws.get(f"A{first}:{rowcol_to_a1(last, columns)}")
+
+    def rows(self, start: int, end: int | None = None, columns: int = len(COLUMNS)) -> list[list[str]]:
+        """Строки листа с `start` по `end` (включительно, 1-based; `columns` колонок); без `end` — до конца листа."""
+        last_col = rowcol_to_a1(1, columns).rstrip("0123456789")
+        rng = f"A{start}:{last_col}{end if end is not None else ''}"
+        with metrics.SHEETS_SECONDS.time(op="rows"):
+            return [list(r) for r in self.ws.get(rng)]
+
+    def last_update_time(self) -> str:
+        """Время последнего изменения таблицы (метаданные Drive, без чтения ячеек)."""
+        if self.spreadsheet is None:
+            raise RuntimeError("Google Sheets ещё не подключен")
+        with metrics.SHEETS_SECONDS.time(op="last_update_time"):
+            return self.spreadsheet.get_lastUpdateTime()
+
     def get_all_rows(self) -> list[list[str]]:
         try:
             return self.ws.get_all_values()
         except Exception as e:
             logger.exception(e)
-            return []
\ No newline at end of file
+            return []
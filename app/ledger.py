@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import date as date_type
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from . import db
+from .constants import COLUMNS, MARK_COLUMN
+from .google_sheets import Sheets
+
+_Key = Tuple[str, str, str, str]  # day, currency_in, currency_out, name
+_Totals = List[float]             # deals, amount_in, amount_out, profit_eur, без прибыли
+
+# Пересборка, не завершившаяся за это время (процесс упал), больше не держит журнал
+REBUILD_STALE_SEC = 3600
+
+
+def _cell(row: List[str], name: str) -> str:
+    i = COLUMNS[name]
+    return str(row[i]).strip() if len(row) > i and row[i] is not None else ""
+
+
+def _mark(row: List[str]) -> str:
+    return str(row[MARK_COLUMN]).strip() if len(row) > MARK_COLUMN and row[MARK_COLUMN] is not None else ""
+
+
+def _number(text: str) -> Optional[float]:
+    v = text.replace(" ", "").replace(" ", "").replace(",", ".")
+    try:
+        return float(v)
+    except ValueError:
+        return None
+
+
+def _entry(row: List[str]) -> Optional[Tuple[_Key, _Totals]]:
+    """Ключ и вклад строки листа в агрегаты; None — не заявка (заголовок, пустая строка, нет даты)."""
+    try:
+        day = datetime.strptime(_cell(row, "date_fixed"), "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        return None
+    profit = _number(_cell(row, "profit_eur"))
+    key = (day, _cell(row, "currency_in").upper(), _cell(row, "currency_out").upper(), _cell(row, "name"))
+    totals = [
+        1.0,
+        _number(_cell(row, "amount_in")) or 0.0,
+        _number(_cell(row, "amount_out")) or 0.0,
+        profit or 0.0,
+        0.0 if profit is not None else 1.0,
+    ]
+    return key, totals
+
+
+def _fold(rows: Iterable[List[str]], sign: float = 1.0) -> Dict[_Key, _Totals]:
+    acc: Dict[_Key, _Totals] = {}
+    for row in rows:
+        entry = _entry(row)
+        if entry is None:
+            continue
+        key, totals = entry
+        current = acc.setdefault(key, [0.0] * 5)
+        for i, v in enumerate(totals):
+            current[i] += sign * v
+    return acc
+
+
+@dataclass
+class Report:
+    date_from: str
+    date_to: str
+    deals: int = 0
+    profit_eur: float = 0.0
+    no_profit: int = 0
+    by_day: List[Tuple[str, int, float]] = field(default_factory=list)
+    by_pair: List[Tuple[str, str, int, float, float, float]] = field(default_factory=list)
+    by_user: List[Tuple[str, int, float]] = field(default_factory=list)
+
+
+class Ledger:
+    """Агрегаты заявок в таблице ledger excelbot.db: по дню, паре валют и оператору.
+
+    Строки добавляются, когда outbox подтвердил запись в лист (в той же
+    транзакции, что и удаление из очереди — без двойного счёта), правки
+    /recalc вносятся разницей. Отчёт (/report) читает только агрегаты, их
+    размер зависит от числа дней × пар × операторов, а не от длины листа.
+    rebuild() один раз пересобирает агрегаты, читая лист страницами; строки,
+    подтверждённые outbox за время чтения, пишутся в журнал ledger_journal и
+    после пересборки добавляются, если их не было в прочитанных страницах
+    (по метке в колонке N). Координация через БД, а не через asyncio.Lock:
+    при шардировании outbox и /report работают в разных процессах.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def ensure_schema(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ledger (
+                day TEXT NOT NULL,
+                currency_in TEXT NOT NULL,
+                currency_out TEXT NOT NULL,
+                name TEXT NOT NULL,
+                deals INTEGER NOT NULL DEFAULT 0,
+                amount_in REAL NOT NULL DEFAULT 0,
+                amount_out REAL NOT NULL DEFAULT 0,
+                profit_eur REAL NOT NULL DEFAULT 0,
+                no_profit INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, currency_in, currency_out, name)
+            )
+            """
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ledger_journal (id INTEGER PRIMARY KEY AUTOINCREMENT, mark TEXT NOT NULL, row TEXT NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS ledger_rebuild (started_at REAL NOT NULL)")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = db.connect(self._path)
+            self.ensure_schema(self._conn)
+            self._conn.commit()
+        return self._conn
+
+    # --- обновление ---
+    @classmethod
+    def apply(cls, conn: sqlite3.Connection, added: Iterable[List[str]] = (), removed: Iterable[List[str]] = ()) -> int:
+        """Вносит строки в агрегаты на соединении `conn` (транзакцию ведёт вызывающий).
+
+        Пока идёт rebuild(), добавленные строки ещё и журналируются: пересборка
+        заменит агрегаты и должна знать, что было подтверждено во время чтения.
+        """
+        added = list(added)
+        if added:
+            cls.ensure_schema(conn)
+            if conn.execute(
+                "SELECT 1 FROM ledger_rebuild WHERE started_at > ?", (time.time() - REBUILD_STALE_SEC,)
+            ).fetchone():
+                conn.executemany(
+                    "INSERT INTO ledger_journal (mark, row) VALUES (?, ?)",
+                    [(_mark(row), json.dumps(row, ensure_ascii=False, default=str)) for row in added],
+                )
+        acc = _fold(added)
+        for key, totals in _fold(removed, sign=-1.0).items():
+            current = acc.setdefault(key, [0.0] * 5)
+            for i, v in enumerate(totals):
+                current[i] += v
+        if not acc:
+            return 0
+        cls.ensure_schema(conn)
+        conn.executemany(
+            """
+            INSERT INTO ledger (day, currency_in, currency_out, name, deals, amount_in, amount_out, profit_eur, no_profit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (day, currency_in, currency_out, name) DO UPDATE SET
+                deals = deals + excluded.deals,
+                amount_in = amount_in + excluded.amount_in,
+                amount_out = amount_out + excluded.amount_out,
+                profit_eur = profit_eur + excluded.profit_eur,
+                no_profit = no_profit + excluded.no_profit
+            """,
+            [(*key, int(t[0]), t[1], t[2], t[3], int(t[4])) for key, t in acc.items()],
+        )
+        return len(acc)
+
+    def replace_rows(self, changes: List[Tuple[List[str], List[str]]]) -> None:
+        """Строки листа изменились (старая, новая) — например, после /recalc."""
+        with self.conn:
+            self.apply(self.conn, added=[new for _, new in changes], removed=[old for old, _ in changes])
+
+    async def rebuild(self, sheets: Sheets, page: int = 5000) -> int:
+        """Пересобирает агрегаты по листу (страницами по `page` строк); возвращает число заявок."""
+        with self.conn:
+            self.conn.execute("DELETE FROM ledger_journal")
+            self.conn.execute("DELETE FROM ledger_rebuild")
+            self.conn.execute("INSERT INTO ledger_rebuild (started_at) VALUES (?)", (time.time(),))
+        acc: Dict[_Key, _Totals] = {}
+        seen: set[str] = set()
+        start = 2  # строка 1 — заголовок
+        try:
+            while True:
+                rows = await asyncio.to_thread(sheets.rows, start, start + page - 1, MARK_COLUMN + 1)
+                seen.update(_mark(row) for row in rows)
+                for key, totals in _fold(rows).items():
+                    current = acc.setdefault(key, [0.0] * 5)
+                    for i, v in enumerate(totals):
+                        current[i] += v
+                if len(rows) < page:
+                    break
+                start += page
+        except BaseException:
+            with self.conn:
+                self.conn.execute("DELETE FROM ledger_rebuild")
+                self.conn.execute("DELETE FROM ledger_journal")
+            raise
+        with self.conn:
+            # Подтверждённые во время чтения строки, которых страницы не застали
+            journal = self.conn.execute("SELECT mark, row FROM ledger_journal ORDER BY id").fetchall()
+            late = [json.loads(row) for mark, row in journal if not mark or mark not in seen]
+            self.conn.execute("DELETE FROM ledger")
+            self.conn.executemany(
+                "INSERT INTO ledger (day, currency_in, currency_out, name, deals, amount_in, amount_out, profit_eur, "
+                "no_profit) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*key, int(t[0]), t[1], t[2], t[3], int(t[4])) for key, t in acc.items()],
+            )
+            self.conn.execute("DELETE FROM ledger_rebuild")
+            self.conn.execute("DELETE FROM ledger_journal")
+            self.apply(self.conn, added=late)
+        deals = int(sum(t[0] for t in acc.values())) + sum(1 for row in late if _entry(row) is not None)
+        logger.info(f"Ledger пересобран: заявок {deals}, агрегатов {len(acc)}, дописано после чтения {len(late)}")
+        return deals
+
+    # --- отчёт ---
+    def report(self, date_from: date_type, date_to: date_type, top: int = 10) -> Report:
+        span = (date_from.isoformat(), date_to.isoformat())
+        where = "WHERE day BETWEEN ? AND ?"
+        report = Report(*span)
+        deals, profit, no_profit = self.conn.execute(
+            f"SELECT COALESCE(SUM(deals), 0), COALESCE(SUM(profit_eur), 0), COALESCE(SUM(no_profit), 0) FROM ledger {where}",
+            span,
+        ).fetchone()
+        report.deals, report.profit_eur, report.no_profit = int(deals), float(profit), int(no_profit)
+        report.by_day = self.conn.execute(
+            f"SELECT day, SUM(deals), SUM(profit_eur) FROM ledger {where} GROUP BY day ORDER BY day", span
+        ).fetchall()
+        report.by_pair = self.conn.execute(
+            f"""
+            SELECT currency_in, currency_out, SUM(deals), SUM(amount_in), SUM(amount_out), SUM(profit_eur)
+            FROM ledger {where} GROUP BY currency_in, currency_out ORDER BY SUM(deals) DESC LIMIT ?
+            """,
+            (*span, top),
+        ).fetchall()
+        report.by_user = self.conn.execute(
+            f"SELECT name, SUM(deals), SUM(profit_eur) FROM ledger {where} GROUP BY name ORDER BY SUM(profit_eur) DESC LIMIT ?",
+            (*span, top),
+        ).fetchall()
+        return report
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+from aiohttp import web
+from loguru import logger
+
+from .config import settings
+
+# Метрики собираются, только если включён HTTP-эндпоинт (METRICS_PORT);
+# иначе inc/observe сразу возвращаются, а middleware не регистрируются.
+enabled = settings.metrics_port > 0
+
+_Key = Tuple[str, ...]
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()  # пишут и потоки (gspread в to_thread)
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> _Key:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _labels(self, key: _Key, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_Key, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if not enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}_total{self._labels(key)} {value:g}"
+
+
+class Gauge(_Metric):
+    """Значение задаётся set() или считается функцией в момент запроса /metrics."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_Key, float] = {}
+        self._fn: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: Any) -> None:
+        if not enabled:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        self._fn = fn
+
+    def samples(self) -> Iterator[str]:
+        if self._fn is not None:
+            try:
+                yield f"{self.name} {float(self._fn()):g}"
+            except Exception as e:
+                logger.debug(f"metrics: {self.name} недоступна: {e}")
+            return
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}{self._labels(key)} {value:g}"
+
+
+class _Timer:
+    __slots__ = ("metric", "labels", "started")
+
+    def __init__(self, metric: "Histogram", labels: Dict[str, Any]):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if "outcome" in self.metric.labelnames and "outcome" not in self.labels:
+            self.labels["outcome"] = "error" if exc_type is not None else "ok"
+        self.metric.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class _NoTimer:
+    def __enter__(self) -> "_NoTimer":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        return None
+
+
+_NO_TIMER = _NoTimer()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key → [счётчики по корзинам..., +Inf], сумма
+        self._counts: Dict[_Key, List[int]] = {}
+        self._sums: Dict[_Key, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        if not enabled:
+            return
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[i] += 1
+            self._sums[key] += value
+
+    def time(self, **labels: Any) -> Any:
+        """`with HISTOGRAM.time(op=...)`: длительность блока; метка outcome — ok/error."""
+        return _Timer(self, labels) if enabled else _NO_TIMER
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            snapshot = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{self._labels(key, (('le', le),))} {cumulative}"
+            yield f"{self.name}_sum{self._labels(key)} {total:.6f}"
+            yield f"{self.name}_count{self._labels(key)} {cumulative}"
+
+
+# ===== Метрики бота =====
+HANDLER_SECONDS = Histogram("excelbot_handler_seconds", "Время работы хендлера aiogram", ("handler", "outcome"))
+TELEGRAM_API_SECONDS = Histogram(
+    "excelbot_telegram_api_seconds", "Время запроса к Bot API", ("method", "outcome")
+)
+RATE_PROVIDER_SECONDS = Histogram(
+    "excelbot_rate_provider_seconds", "Время ответа источника курсов", ("provider", "outcome")
+)
+RATE_LOOKUPS = Counter(
+    "excelbot_rate_lookups",
+    "Запросы курса: hit — из кэша, series — из ряда по дням, miss — к источникам, stale — последний известный",
+    ("result",),
+)
+RATE_TABLE_LOOKUPS = Counter("excelbot_rate_table_lookups", "Запросы таблицы курсов за день", ("result",))
+UPDATES_SKIPPED = Counter(
+    "excelbot_updates_skipped", "Сообщения без состояния FSM и ключевых слов, отброшенные до хендлеров"
+)
+SHEETS_SECONDS = Histogram("excelbot_sheets_seconds", "Время вызова Google Sheets", ("op", "outcome"))
+OUTBOX_DEPTH = Gauge("excelbot_outbox_depth", "Заявок в очереди на запись в таблицу")
+SEND_QUEUE = Gauge("excelbot_send_queue", "Исходящих запросов ждут лимита Telegram")
+LOOP_LAG_SECONDS = Histogram(
+    "excelbot_event_loop_lag_seconds",
+    "Задержка цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Время каждого сработавшего хендлера (внутренний middleware)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        with HANDLER_SECONDS.time(handler=name):
+            return await handler(event, data)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Время запросов к Bot API; регистрируется после SendScheduler, так что ожидание лимита не входит."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[Any], bot: Bot, method: TelegramMethod[Any]) -> Any:
+        with TELEGRAM_API_SECONDS.time(method=type(method).__name__):
+            return await make_request(bot, method)
+
+
+async def watch_loop_lag(interval: float = 0.5) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - started - interval))
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_server(port: int, host: Optional[str] = None) -> web.AppRunner:
+    """HTTP-эндпоинт /metrics в формате Prometheus."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host or settings.metrics_host, port).start()
+    logger.info(f"Метрики: http://{host or settings.metrics_host}:{port}/metrics")
+    return runner
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from aiogram import BaseMiddleware, Router
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.dispatcher.flags import get_flag
+from aiogram.filters import Command
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+
+from . import metrics
+from .google_sheets import Sheets
+from .storage import SQLiteStorage
+
+
+class SheetsReadyMiddleware(BaseMiddleware):
+    """Хендлеры с флагом sheets ждут подключения к таблице (не дольше `timeout`),
+    иначе пользователь получает просьбу повторить позже."""
+
+    def __init__(self, sheets: Sheets, timeout: float = 5.0):
+        self.sheets = sheets
+        self.timeout = timeout
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not get_flag(data, "sheets") or await self.sheets.wait_ready(self.timeout):
+            return await handler(event, data)
+        text = "⏳ Таблица ещё подключается, попробуй через минуту."
+        if isinstance(event, CallbackQuery):
+            await event.answer(text, show_alert=True)
+        elif isinstance(event, Message):
+            await event.answer(text)
+        return None
+
+
+def message_commands(router: Router) -> Optional[Set[str]]:
+    """Команды из фильтров Command хендлеров сообщений (с вложенными роутерами);
+    None — есть команда-регулярка, и отсеивать по имени команды нельзя."""
+    found: Set[str] = set()
+    for r in router.chain_tail:
+        for handler in r.message.handlers:
+            for f in handler.filters or ():
+                if not isinstance(f.callback, Command):
+                    continue
+                for command in f.callback.commands:
+                    if isinstance(command, re.Pattern):
+                        return None
+                    found.add(command.lower())
+    return found
+
+
+class ChatterFilterMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: отбрасывает сообщения, которые ни один хендлер не возьмёт.
+
+    В рабочих группах почти все сообщения — не боту. Сообщение проходит дальше,
+    если это команда из `commands` (в тексте или подписи к файлу), ключевое
+    слово из `keywords` (всё сообщение, без учёта регистра) или у чата и
+    пользователя есть состояние FSM (SQLiteStorage.has_state — множество в
+    памяти). Остальное отсеивается до FSMContextMiddleware — без чтения
+    хранилища и прогона фильтров хендлеров; поэтому регистрируется перед ним.
+    """
+
+    def __init__(
+        self,
+        fsm: FSMContextMiddleware,
+        storage: SQLiteStorage,
+        keywords: Iterable[str],
+        commands: Optional[Iterable[str]],
+    ):
+        self.fsm = fsm
+        self.storage = storage
+        self.keywords = frozenset(k.lower() for k in keywords)
+        self.commands = frozenset(c.lower() for c in commands) if commands is not None else None
+        self._max_len = max(map(len, self.keywords), default=0)  # длинные сообщения не приводим к нижнему регистру
+
+    def _triggered(self, message: Message) -> bool:
+        text = message.text or message.caption
+        if not text:
+            return False
+        if text[0] == "/":
+            if self.commands is None:
+                return True
+            name = text[1:].split(maxsplit=1)
+            return bool(name) and name[0].split("@", 1)[0].lower() in self.commands
+        text = text.strip()
+        return len(text) <= self._max_len and text.lower() in self.keywords
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        message = event.message if isinstance(event, Update) else None
+        if message is None or self._triggered(message):
+            return await handler(event, data)
+        context = self.fsm.resolve_event_context(data["bot"], data)
+        if context is None or self.storage.has_state(context.key):
+            return await handler(event, data)
+        metrics.UPDATES_SKIPPED.inc()
+        return UNHANDLED
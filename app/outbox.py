@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import sqlite3
+import time
+import uuid
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional, Tuple
+
+from gspread.exceptions import APIError
+from loguru import logger
+
+from . import db
+from .constants import COLUMNS, MARK_COLUMN
+from .google_sheets import Sheets
+from .ledger import Ledger
+
+PENDING = "pending"
+SENDING = "sending"
+UPDATE_KEEP_SEC = 7 * 24 * 3600  # сколько помнить update_id, по которому уже поставлена заявка
+
+# Строки из очереди до появления метки сверяются по содержимому (USER_ENTERED эти колонки не меняет)
+_MATCH_COLUMNS = ("name", "currency_in", "amount_in", "currency_out", "amount_out", "comment", "date_fixed", "rate_time")
+
+
+def _norm(value: str) -> str:
+    v = (value or "").strip().replace(" ", "").replace(" ", "")
+    try:
+        return str(Decimal(v.replace(",", ".")).normalize())
+    except (InvalidOperation, ValueError):
+        return v
+
+
+def _fingerprint(row: List[str]) -> Tuple[str, ...]:
+    return tuple(_norm(row[COLUMNS[c]]) if len(row) > COLUMNS[c] else "" for c in _MATCH_COLUMNS)
+
+
+def _mark(row: List[str]) -> str:
+    return str(row[MARK_COLUMN]).strip() if len(row) > MARK_COLUMN else ""
+
+
+class Outbox:
+    """Очередь записи заявок в Google Sheets (write-behind) в таблице outbox excelbot.db.
+
+    Хендлер только кладёт строку в очередь (enqueue) и сразу отвечает
+    пользователю. Фоновый воркер (run) забирает пачки и пишет их одним
+    append_rows в отдельном потоке, с повтором и экспоненциальной паузой при
+    ошибках квоты. Перед отправкой пачка помечается как sending: если ответ
+    Google потерян (таймаут, падение процесса), строки ищутся в хвосте листа
+    по уникальной метке в колонке MARK_COLUMN и повторно не пишутся.
+    """
+
+    def __init__(
+        self,
+        sheets: Sheets,
+        batch_size: int = 50,
+        linger: float = 0.5,
+        max_backoff: float = 300.0,
+        path: Optional[str] = None,
+        ledger: Optional[Ledger] = None,
+    ):
+        self.sheets = sheets
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.max_backoff = max_backoff
+        self._path = path
+        self.ledger = ledger
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._stopping = False
+        self._failures = 0
+        self.enqueued = 0  # счётчик для процессов-воркеров, которые сами очередь не разбирают
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = db.connect(self._path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    row TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_error TEXT
+                )
+                """
+            )
+            # апдейты Telegram, по которым заявка уже в очереди (или уже записана и из неё удалена)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox_updates (update_id INTEGER PRIMARY KEY, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def enqueue(self, values: List[str], update_id: Optional[int] = None) -> Optional[int]:
+        """Сохраняет заявку в очередь; строка сразу приводится к итоговому виду (prepare_row).
+
+        С `update_id` постановка идемпотентна: повтор того же апдейта (воркер
+        упал до подтверждения, см. app.workers) заявку второй раз не ставит и
+        возвращает None.
+        """
+        ids = self.enqueue_many([values], update_id=update_id)
+        return ids[-1] if ids else None
+
+    def enqueue_many(self, rows: List[List[str]], update_id: Optional[int] = None) -> List[int]:
+        ids: List[int] = []
+        with self.conn:
+            if update_id is not None:
+                now = time.time()
+                self.conn.execute("DELETE FROM outbox_updates WHERE created_at < ?", (now - UPDATE_KEEP_SEC,))
+                cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO outbox_updates (update_id, created_at) VALUES (?, ?)", (update_id, now)
+                )
+                if cur.rowcount == 0:
+                    logger.info(f"outbox: апдейт {update_id} уже поставил заявку, повтор пропущен")
+                    return []
+            for values in rows:
+                row = Sheets.prepare_row(list(values))[:MARK_COLUMN]
+                row += [""] * (MARK_COLUMN - len(row)) + [uuid.uuid4().hex[:16]]
+                cur = self.conn.execute(
+                    "INSERT INTO outbox (row, created_at) VALUES (?, ?)",
+                    (json.dumps(row, ensure_ascii=False), time.time()),
+                )
+                ids.append(int(cur.lastrowid))
+        self.enqueued += len(ids)
+        self._wakeup.set()
+        return ids
+
+    def wake(self) -> None:
+        """Строки добавил другой процесс (см. app.workers) — разобрать очередь, не дожидаясь таймаута."""
+        self._wakeup.set()
+
+    def depth(self) -> int:
+        (n,) = self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()
+        return int(n)
+
+    def remaining(self, ids: List[int]) -> int:
+        """Сколько из заявок `ids` ещё не записано в таблицу."""
+        if not ids:
+            return 0
+        (n,) = self.conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)
+        ).fetchone()
+        return int(n)
+
+    def _batch(self, state: str) -> List[Tuple[int, List[str]]]:
+        rows = self.conn.execute(
+            "SELECT id, row FROM outbox WHERE state = ? ORDER BY id LIMIT ?", (state, self.batch_size)
+        ).fetchall()
+        return [(rid, json.loads(row)) for rid, row in rows]
+
+    def _set_state(self, ids: List[int], state: str, error: str | None = None) -> None:
+        marks = ",".join("?" * len(ids))
+        with self.conn:
+            if state == PENDING:
+                self.conn.execute(
+                    f"UPDATE outbox SET state = ?, attempts = attempts + 1, last_error = ? WHERE id IN ({marks})",
+                    (state, error, *ids),
+                )
+            else:
+                self.conn.execute(f"UPDATE outbox SET state = ? WHERE id IN ({marks})", (state, *ids))
+
+    def _done(self, batch: List[Tuple[int, List[str]]]) -> None:
+        """Строки записаны в лист: убрать из очереди и (в той же транзакции) учесть в ledger."""
+        ids = [rid for rid, _ in batch]
+        with self.conn:
+            self.conn.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(ids))})", ids)
+            if self.ledger is not None:
+                self.ledger.apply(self.conn, [row for _, row in batch])
+
+    async def _reconcile(self) -> None:
+        """Строки в состоянии sending: ищем их в хвосте листа, найденные считаем записанными."""
+        while True:
+            batch = self._batch(SENDING)
+            if not batch:
+                return
+            tail = await asyncio.to_thread(self.sheets.tail, len(batch) + self.batch_size, MARK_COLUMN + 1)
+            marks = {_mark(r) for r in tail} - {""}
+            # строки без метки (из очереди до её появления) — по содержимому, и только среди строк без метки
+            written = [_fingerprint(r) for r in tail if not _mark(r)]
+            found: List[Tuple[int, List[str]]] = []
+            for rid, row in batch:
+                mark = _mark(row)
+                if mark:
+                    if mark in marks:
+                        found.append((rid, row))
+                    continue
+                fp = _fingerprint(row)
+                if fp in written:
+                    written.remove(fp)
+                    found.append((rid, row))
+            if found:
+                self._done(found)
+            found_ids = {rid for rid, _ in found}
+            retry = [rid for rid, _ in batch if rid not in found_ids]
+            if retry:
+                self._set_state(retry, PENDING, "unconfirmed")
+            logger.info(f"outbox: сверка — уже в таблице {len(found)}, к повтору {len(retry)}")
+
+    async def flush_once(self) -> int:
+        """Отправляет одну пачку; возвращает число записанных строк."""
+        await self._reconcile()
+        batch = self._batch(PENDING)
+        if not batch:
+            return 0
+        ids = [rid for rid, _ in batch]
+        self._set_state(ids, SENDING)
+        try:
+            await asyncio.to_thread(self.sheets.append_rows, [row for _, row in batch])
+        except APIError as e:
+            # Google ответил ошибкой → строки точно не записаны
+            self._set_state(ids, PENDING, str(e))
+            raise
+        except Exception:
+            # ответ потерян: строки остаются sending, их проверит сверка перед следующей пачкой
+            raise
+        self._done(batch)
+        return len(ids)
+
+    def _backoff(self) -> float:
+        delay = min(self.max_backoff, 2.0 ** min(self._failures, 10))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def run(self) -> None:
+        """Фоновый воркер: пишет очередь в таблицу, пока не вызван stop()."""
+        waiters = [asyncio.create_task(self.sheets.ready.wait()), asyncio.create_task(self._stopped.wait())]
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        for w in waiters:
+            w.cancel()
+        if not self.sheets.ready.is_set():
+            return  # остановлены до подключения к таблице — заявки дождутся следующего запуска
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                sent = await self.flush_once()
+                self._failures = 0
+            except Exception as e:
+                self._failures += 1
+                quota = isinstance(e, APIError) and e.code == 429
+                delay = self._backoff()
+                logger.warning(
+                    f"outbox: ошибка записи ({'квота' if quota else e}), повтор через {delay:.1f} с, в очереди {self.depth()}"
+                )
+                await self._wait(self._stopped, delay)
+                continue
+            if sent:
+                continue  # вычерпываем очередь пачками без пауз
+            if await self._wait(self._wakeup, 30.0):
+                await asyncio.sleep(self.linger)  # собираем пачку из заявок, пришедших одновременно
+
+    @staticmethod
+    async def _wait(event: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._stopped.set()
+        self._wakeup.set()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import asdict, dataclass
+from datetime import date as date_type
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from .rates import RateQuote, get_rate_quote
+
+
+def normalize_commission(text: str) -> str:
+    """Комиссия в % ("2,5%") → строка 0.00–10.00; "" для пустого ввода или "-" (значит — посчитать по курсам)."""
+    txt = (text or "").strip()
+    if txt in {"", "-", "—"}:
+        return ""
+    raw = txt.replace("%", "").replace(",", ".")
+    try:
+        val = Decimal(raw)
+    except Exception:
+        val = Decimal("0")
+    if val < 0:
+        val = Decimal("0")
+    if val > 10:
+        val = Decimal("10")
+    return str(val.quantize(Decimal("0.01")))
+
+
+def normalize_expenses(text: str) -> str:
+    """Расходы в % как их вводят ("-", "1,5%", "120") → строка 0.00–100.00 ("0" для пустого)."""
+    txt = (text or "").strip()
+    if txt in {"", "-", "—"}:
+        return "0"
+    raw = txt.replace("%", "").replace(",", ".")
+    try:
+        val = Decimal(raw)
+    except Exception:
+        val = Decimal("0")
+    if val < 0:
+        val = Decimal("0")
+    if val > 100:
+        val = Decimal("100")
+    return str(val.quantize(Decimal("0.01")))
+
+
+def _leg_to_dict(q: Optional[RateQuote]) -> Optional[Dict[str, Any]]:
+    if q is None:
+        return None
+    d = asdict(q)
+    d["rate"] = str(q.rate)
+    return d
+
+
+def _leg_from_dict(d: Optional[Dict[str, Any]]) -> Optional[RateQuote]:
+    if not d:
+        return None
+    return RateQuote(**{**d, "rate": Decimal(d["rate"])})
+
+
+@dataclass(frozen=True)
+class DealQuote:
+    """Курсы сделки, зафиксированные на шаге суммы ОТДАЛ.
+
+    Создаётся один раз (create), хранится в FSM-данных (to_dict/from_dict) и
+    используется и для подсказки комиссии, и для profit_eur в таблице — так
+    обе цифры считаются по одним и тем же курсам.
+    """
+
+    currency_in: str
+    amount_in: Decimal
+    currency_out: str
+    amount_out: Decimal
+    leg_in: Optional[RateQuote]
+    leg_out: Optional[RateQuote]
+
+    @classmethod
+    async def create(
+        cls,
+        currency_in: str,
+        amount_in: Decimal,
+        currency_out: str,
+        amount_out: Decimal,
+        day: date_type,
+        budget: Optional[float] = None,
+    ) -> "DealQuote":
+        leg_in, leg_out = await asyncio.gather(
+            get_rate_quote(currency_in, day, budget=budget),
+            get_rate_quote(currency_out, day, budget=budget),
+        )
+        return cls(currency_in, amount_in, currency_out, amount_out, leg_in, leg_out)
+
+    def matches(self, currency_in: str, amount_in: Decimal, currency_out: str, amount_out: Decimal) -> bool:
+        return (self.currency_in, self.amount_in, self.currency_out, self.amount_out) == (
+            currency_in, amount_in, currency_out, amount_out,
+        )
+
+    @property
+    def eur_in(self) -> Optional[Decimal]:
+        return self.leg_in.to_eur(self.amount_in) if self.leg_in is not None else None
+
+    @property
+    def eur_out(self) -> Optional[Decimal]:
+        return self.leg_out.to_eur(self.amount_out) if self.leg_out is not None else None
+
+    @property
+    def profit_eur_gross(self) -> Optional[Decimal]:
+        if self.eur_in is None or self.eur_out is None:
+            return None
+        return self.eur_in - self.eur_out
+
+    @property
+    def suggested_commission(self) -> Optional[Decimal]:
+        """(EUR(получил) - EUR(отдал)) / EUR(отдал) * 100"""
+        gross, eur_out = self.profit_eur_gross, self.eur_out
+        if gross is None or eur_out is None or eur_out <= 0:
+            return None
+        return (gross / eur_out * Decimal("100")).quantize(Decimal("0.01"))
+
+    @property
+    def stale_note(self) -> str:
+        """Пометка для ответа/таблицы, если какой-то курс взят из старых данных."""
+        stale = [q for q in (self.leg_in, self.leg_out) if q is not None and q.stale]
+        if not stale:
+            return ""
+        days = sorted({datetime.fromtimestamp(q.fetched_at).strftime("%d.%m.%Y") for q in stale})
+        return "устаревший курс (" + ", ".join(days) + ")"
+
+    @property
+    def source_label(self) -> str:
+        """Источники курсов для таблицы, напр. "frankfurter" или "frankfurter / fawaz"."""
+        sources = [q.source for q in (self.leg_in, self.leg_out) if q is not None and q.source]
+        return " / ".join(dict.fromkeys(sources))
+
+    @property
+    def fetched_label(self) -> str:
+        """Время получения курсов (самого старого из двух) для таблицы."""
+        times = [q.fetched_at for q in (self.leg_in, self.leg_out) if q is not None and q.source]
+        return datetime.fromtimestamp(min(times)).strftime("%d.%m.%Y %H:%M") if times else ""
+
+    def profit_eur(self, expenses: str) -> Optional[Decimal]:
+        """Прибыль в EUR за вычетом расходов (`expenses` — проценты, 0–100)."""
+        gross = self.profit_eur_gross
+        if gross is None:
+            return None
+        try:
+            expenses_pct = Decimal((expenses or "0").strip().replace(",", "."))
+        except Exception:
+            expenses_pct = Decimal("0")
+        expenses_pct = min(max(expenses_pct, Decimal("0")), Decimal("100"))
+        return (gross * (Decimal("1") - expenses_pct / Decimal("100"))).quantize(Decimal("0.01"))
+
+    def sheet_row(self, name: str, commission: str, expenses: str, comment: str, day: date_type) -> List[str]:
+        """Строка листа (порядок COLUMNS). Пустая комиссия заменяется рассчитанной по курсам."""
+        commission = (commission or "").strip()
+        if not commission:
+            suggested = self.suggested_commission
+            commission = str(suggested) if suggested is not None else ""
+        expenses = (expenses or "0").strip()
+        profit = self.profit_eur(expenses)
+        return [
+            name,
+            self.currency_in,
+            str(self.amount_in),
+            self.currency_out,
+            str(self.amount_out),
+            commission,
+            expenses,
+            comment,
+            day.strftime("%d.%m.%Y"),
+            str(profit) if profit is not None else "н/д",
+            self.stale_note,
+            self.source_label,
+            self.fetched_label,
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "currency_in": self.currency_in,
+            "amount_in": str(self.amount_in),
+            "currency_out": self.currency_out,
+            "amount_out": str(self.amount_out),
+            "leg_in": _leg_to_dict(self.leg_in),
+            "leg_out": _leg_to_dict(self.leg_out),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "DealQuote":
+        return cls(
+            d["currency_in"],
+            Decimal(d["amount_in"]),
+            d["currency_out"],
+            Decimal(d["amount_out"]),
+            _leg_from_dict(d.get("leg_in")),
+            _leg_from_dict(d.get("leg_out")),
+        )
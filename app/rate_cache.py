@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import date as date_type
+from decimal import Decimal
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+from . import db
+
+
+class CachedRate(NamedTuple):
+    rate: Decimal
+    source: str
+    fetched_at: float
+
+
+class RateCache:
+    """Two-tier rate cache: in-memory LRU in front of the `rates` table in excelbot.db.
+
+    Keys are (code, day_str) where day_str is "latest" or YYYY-MM-DD.
+    "latest" and today's/future dates expire after `latest_ttl` seconds,
+    past dates never expire. Expired rows stay in the table so they can
+    still serve as the last known rate.
+    """
+
+    def __init__(self, max_items: int, max_rows: int, latest_ttl: float, path: Optional[str] = None):
+        self.max_items = max_items
+        self.max_rows = max_rows
+        self.latest_ttl = latest_ttl
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lru: "OrderedDict[Tuple[str, str], CachedRate]" = OrderedDict()
+        self._writes_since_evict = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = db.connect(self._path)
+            self._ensure_schema(self._conn)
+        return self._conn
+
+    @staticmethod
+    def _ensure_schema(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rates (
+                code TEXT NOT NULL,
+                day TEXT NOT NULL,
+                rate TEXT NOT NULL,
+                source TEXT NOT NULL DEFAULT '',
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (code, day)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS rates_fetched_at ON rates (fetched_at)")
+        conn.commit()
+
+    def is_fresh(self, day_str: str, fetched_at: float) -> bool:
+        if day_str != "latest" and day_str < date_type.today().isoformat():
+            return True
+        return time.time() - fetched_at < self.latest_ttl
+
+    def _remember(self, key: Tuple[str, str], entry: CachedRate) -> None:
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def get_entry(self, code: str, day_str: str) -> Optional[CachedRate]:
+        key = (code, day_str)
+        entry = self._lru.get(key)
+        if entry is None:
+            row = self.conn.execute(
+                "SELECT rate, source, fetched_at FROM rates WHERE code = ? AND day = ?", key
+            ).fetchone()
+            if row is None:
+                return None
+            entry = CachedRate(Decimal(row[0]), row[1], row[2])
+        if not self.is_fresh(day_str, entry.fetched_at):
+            self._lru.pop(key, None)
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def get(self, code: str, day_str: str) -> Optional[Decimal]:
+        entry = self.get_entry(code, day_str)
+        return entry.rate if entry is not None else None
+
+    def put(self, code: str, day_str: str, rate: Decimal, source: str = "", fetched_at: Optional[float] = None) -> None:
+        self.put_many(day_str, {code: (rate, source)}, fetched_at)
+
+    def put_many(
+        self, day_str: str, rates: Mapping[str, Tuple[Decimal, str]], fetched_at: Optional[float] = None
+    ) -> None:
+        """Store {code: (rate, source)} for one day in a single transaction."""
+        ts = fetched_at if fetched_at is not None else time.time()
+        for code, (rate, source) in rates.items():
+            self._remember((code, day_str), CachedRate(rate, source, ts))
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO rates (code, day, rate, source, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                    [(code, day_str, str(rate), source, ts) for code, (rate, source) in rates.items()],
+                )
+            self._writes_since_evict += len(rates)
+            if self._writes_since_evict >= 100:
+                self._evict()
+        except sqlite3.Error as e:
+            logger.warning(f"rates cache: не удалось сохранить курсы за {day_str}: {e}")
+
+    def last_known(self, code: str) -> Optional[Tuple[str, CachedRate]]:
+        """Most recently fetched rate for `code`, ignoring TTL: (day_str, entry)."""
+        row = self.conn.execute(
+            "SELECT day, rate, source, fetched_at FROM rates WHERE code = ? ORDER BY fetched_at DESC LIMIT 1",
+            (code,),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], CachedRate(Decimal(row[1]), row[2], row[3])
+
+    def _evict(self) -> None:
+        self._writes_since_evict = 0
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM rates").fetchone()
+        excess = count - self.max_rows
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM rates WHERE rowid IN (SELECT rowid FROM rates ORDER BY fetched_at LIMIT ?)",
+                (excess,),
+            )
+            self.conn.commit()
+            logger.debug(f"rates cache: удалено {excess} старых курсов")
+
+    def recent_rows(self) -> list:
+        """Most recently fetched rows, read over a separate connection (safe to call from a thread)."""
+        conn = db.connect(self._path)
+        try:
+            self._ensure_schema(conn)
+            return conn.execute(
+                "SELECT code, day, rate, source, fetched_at FROM rates ORDER BY fetched_at DESC LIMIT ?",
+                (self.max_items,),
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def load(self, rows: list) -> int:
+        """Put rows from `recent_rows` into the in-memory tier (newest ends up most recent)."""
+        for code, day_str, rate, source, fetched_at in reversed(rows):
+            if (code, day_str) not in self._lru and self.is_fresh(day_str, fetched_at):
+                self._remember((code, day_str), CachedRate(Decimal(rate), source, fetched_at))
+        return len(self._lru)
+
+    def warm(self) -> int:
+        """Load the most recently fetched rows into the in-memory tier."""
+        return self.load(self.recent_rows())
+
+    def clear_memory(self) -> None:
+        self._lru.clear()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Dict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderHealth:
+    """Latency/error EWMA and a circuit breaker for one rate provider.
+
+    closed → open after `failure_threshold` consecutive failures; open skips
+    the provider until `cooldown` passes, then half_open lets exactly one
+    probe through. A successful probe closes the breaker, a failed one opens
+    it again with a doubled cooldown (up to `max_cooldown`).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        cooldown: float = 60.0,
+        max_cooldown: float = 900.0,
+        alpha: float = 0.3,
+        latency_prior: float = 0.5,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.alpha = alpha
+        self.latency = latency_prior
+        self.error_rate = 0.0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self.probing = False
+        self.calls = 0
+        self.failures = 0
+
+    def _ewma(self, old: float, sample: float) -> float:
+        return old + self.alpha * (sample - old)
+
+    def available(self, now: float | None = None) -> bool:
+        """Whether the provider may be put in the queue right now (no side effects)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return (now if now is not None else time.monotonic()) - self.opened_at >= self.cooldown
+
+    def begin(self) -> bool:
+        """Claim a call slot; in half-open state only one probe is let through."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = HALF_OPEN
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self, latency: float) -> None:
+        self.calls += 1
+        self.latency = self._ewma(self.latency, latency)
+        self.error_rate = self._ewma(self.error_rate, 0.0)
+        self.consecutive_failures = 0
+        self.probing = False
+        if self.state != CLOSED:
+            self.state = CLOSED
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self, latency: float) -> None:
+        self.calls += 1
+        self.failures += 1
+        self.latency = self._ewma(self.latency, latency)
+        self.error_rate = self._ewma(self.error_rate, 1.0)
+        self.consecutive_failures += 1
+        was_probe = self.state == HALF_OPEN
+        self.probing = False
+        if was_probe:
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self._trip()
+        elif self.consecutive_failures >= self.failure_threshold:
+            self._trip()
+
+    def record_cancelled(self, elapsed: float) -> None:
+        """A call lost the race: it took at least `elapsed`, so only ever raise the estimate."""
+        self.probing = False
+        if elapsed > self.latency:
+            self.latency = self._ewma(self.latency, elapsed)
+
+    def _trip(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    @property
+    def score(self) -> float:
+        """Lower is better: expected latency inflated by the recent error rate."""
+        return self.latency * (1.0 + 4.0 * self.error_rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "latency_ewma": round(self.latency, 4),
+            "error_rate": round(self.error_rate, 4),
+            "calls": self.calls,
+            "failures": self.failures,
+            "cooldown": self.cooldown,
+        }
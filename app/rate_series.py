@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import date as date_type
+from decimal import Decimal
+from typing import Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+
+from .rate_cache import CachedRate
+
+MAGIC = b"EXRS"
+VERSION = 1
+# magic, version, codes, sources, ordinal of the first day, days
+_HEADER = struct.Struct("<4sHHHiI")
+_CODE_LEN = 8
+_SOURCE_LEN = 16
+
+UNKNOWN = math.nan   # nobody asked for this day yet
+MISSING = 0.0        # the day was fetched and the currency is not there (weekend, holiday, not published)
+
+_Doubles = Union[array, memoryview]
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class RateSeries:
+    """Daily EUR rates per currency in flat typed arrays indexed by day number.
+
+    Cell `[day - first_day][code]` holds EUR per unit of the code (a double),
+    NaN when the day was never fetched, 0.0 when it was fetched and the code
+    was not there. `at_or_before(code, day)` walks back from `day` over at most
+    `max_back` cells and stops at the first unknown one — so a weekend or a
+    holiday resolves to the closest earlier business day with a few array
+    reads and no network, but a day nobody fetched is never guessed.
+
+    The arrays are saved to one file (header, codes, sources, then the rate,
+    fetched-at and source-index arrays, 8-byte aligned) that is read back
+    through mmap without copying; the first write switches to in-memory
+    copies, and `save()` writes the file again (atomically, merging cells
+    another process saved meanwhile).
+    """
+
+    def __init__(self, path: str, codes: Sequence[str], max_back: int = 5, save_every: float = 60.0):
+        self.path = path
+        self.codes: Tuple[str, ...] = tuple(codes)
+        self.max_back = max_back
+        self.save_every = save_every
+        self._index = {c: i for i, c in enumerate(self.codes)}
+        self._sources: List[str] = [""]
+        self._first = 0                      # ordinal of day 0
+        self._days = 0
+        self._rates: _Doubles = array("d")   # days × codes
+        self._fetched: _Doubles = array("d")  # days
+        self._source_ids: Union[bytearray, memoryview] = bytearray()  # days × codes
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None  # whole mmap; the arrays above are slices of it
+        self._loaded = False
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._file_mtime = 0  # mtime_ns of the file as we last read or wrote it
+        self._lock = threading.Lock()
+
+    # --- file ---
+    @staticmethod
+    def _read(path: str) -> Optional[Tuple["RateSeries", mmap.mmap]]:
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < _HEADER.size:
+                    return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        magic, version, n_codes, n_sources, first, days = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            raise ValueError(f"{path}: not a rate series file")
+        pos = _HEADER.size
+        file_codes = [mm[pos + i * _CODE_LEN:pos + (i + 1) * _CODE_LEN].rstrip(b"\0").decode() for i in range(n_codes)]
+        pos += n_codes * _CODE_LEN
+        sources = [mm[pos + i * _SOURCE_LEN:pos + (i + 1) * _SOURCE_LEN].rstrip(b"\0").decode() for i in range(n_sources)]
+        pos = _pad8(pos + n_sources * _SOURCE_LEN)
+        view = memoryview(mm)
+        series = RateSeries(path, file_codes)
+        series._sources = sources or [""]
+        series._first, series._days = first, days
+        series._rates = view[pos:pos + days * n_codes * 8].cast("d")
+        pos += days * n_codes * 8
+        series._fetched = view[pos:pos + days * 8].cast("d")
+        pos += days * 8
+        series._source_ids = view[pos:pos + days * n_codes]
+        series._view = view
+        series._loaded = True
+        return series, mm
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            found = self._read(self.path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"rate series: {self.path} не прочитан ({e}), начинаем заново")
+            return
+        if found is None:
+            return
+        self._file_mtime = self._mtime()
+        other, mm = found
+        if other.codes == self.codes:
+            self._sources, self._first, self._days = other._sources, other._first, other._days
+            self._rates, self._fetched, self._source_ids = other._rates, other._fetched, other._source_ids
+            self._mmap, self._view = mm, other._view
+        else:  # the currency list changed: copy the common columns
+            self._merge(other)
+            other._release()
+            mm.close()
+        logger.debug(f"rate series: {self._days} дней × {len(self.codes)} валют из {self.path}")
+
+    def _mtime(self) -> int:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _release(self) -> None:
+        for name in ("_rates", "_fetched", "_source_ids"):
+            value = getattr(self, name)
+            if isinstance(value, memoryview):
+                value.release()
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+
+    def _materialize(self) -> None:
+        """Switch from the read-only mmap views to in-memory arrays (before the first write)."""
+        if self._mmap is None:
+            return
+        rates, fetched, source_ids = array("d", self._rates), array("d", self._fetched), bytearray(self._source_ids)
+        self._release()
+        self._mmap.close()
+        self._mmap = None
+        self._rates, self._fetched, self._source_ids = rates, fetched, source_ids
+
+    def _encode(self) -> bytes:
+        codes = b"".join(c.encode()[:_CODE_LEN].ljust(_CODE_LEN, b"\0") for c in self.codes)
+        sources = b"".join(s.encode()[:_SOURCE_LEN].ljust(_SOURCE_LEN, b"\0") for s in self._sources)
+        head = _HEADER.pack(MAGIC, VERSION, len(self.codes), len(self._sources), self._first, self._days) + codes + sources
+        head = head.ljust(_pad8(len(head)), b"\0")
+        return head + bytes(memoryview(self._rates).cast("B")) + bytes(memoryview(self._fetched).cast("B")) + bytes(
+            self._source_ids
+        )
+
+    def save(self) -> None:
+        """Write the file if anything changed (cells saved by another process are kept)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            found = None
+            if self._mtime() != self._file_mtime:  # another process saved since: keep its cells
+                try:
+                    found = self._read(self.path)
+                except (OSError, ValueError, struct.error):
+                    found = None
+            if found is not None:
+                other, mm = found
+                self._merge(other, overwrite=False)
+                other._release()
+                mm.close()
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "wb") as f:
+                    f.write(self._encode())
+                os.replace(tmp, self.path)
+                self._file_mtime = self._mtime()
+            except OSError as e:
+                logger.warning(f"rate series: не удалось сохранить {self.path}: {e}")
+                return
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+    def close(self) -> None:
+        self.save()
+        self._release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._rates, self._fetched, self._source_ids = array("d"), array("d"), bytearray()
+        self._days, self._loaded = 0, False
+
+    # --- layout ---
+    def _grow(self, ordinal: int) -> int:
+        """Row of `ordinal`, extending the arrays at either end when needed."""
+        self._materialize()
+        n = len(self.codes)
+        if self._days == 0:
+            self._first = ordinal
+        if ordinal < self._first:
+            extra = self._first - ordinal
+            self._rates = array("d", [UNKNOWN]) * (extra * n) + self._rates
+            self._fetched = array("d", [0.0]) * extra + self._fetched
+            self._source_ids = bytearray(extra * n) + self._source_ids
+            self._first, self._days = ordinal, self._days + extra
+        row = ordinal - self._first
+        if row >= self._days:
+            extra = row - self._days + 1
+            self._rates.extend(array("d", [UNKNOWN]) * (extra * n))
+            self._fetched.extend(array("d", [0.0]) * extra)
+            self._source_ids.extend(bytearray(extra * n))
+            self._days += extra
+        return row
+
+    def _source_id(self, source: str) -> int:
+        try:
+            return self._sources.index(source)
+        except ValueError:
+            if len(self._sources) >= 255:
+                return 0
+            self._sources.append(source)
+            return len(self._sources) - 1
+
+    def _merge(self, other: "RateSeries", overwrite: bool = True) -> None:
+        for row in range(other._days):
+            ordinal = other._first + row
+            for code, j in other._index.items():
+                i = self._index.get(code)
+                value = other._rates[row * len(other.codes) + j]
+                if i is None or math.isnan(value):
+                    continue
+                mine = self._cell(ordinal, i)
+                if not overwrite and mine is not None and not math.isnan(mine):
+                    continue
+                r = self._grow(ordinal)
+                self._rates[r * len(self.codes) + i] = value
+                self._source_ids[r * len(self.codes) + i] = self._source_id(other._sources[other._source_ids[row * len(other.codes) + j]])
+                self._fetched[r] = max(self._fetched[r], other._fetched[row])
+                self._dirty = True
+
+    def _cell(self, ordinal: int, i: int) -> Optional[float]:
+        row = ordinal - self._first
+        if row < 0 or row >= self._days:
+            return None
+        return self._rates[row * len(self.codes) + i]
+
+    # --- API ---
+    def put_day(
+        self,
+        day: date_type,
+        rates: Mapping[str, Tuple[Decimal, str]],
+        fetched_at: float,
+        missing: Iterable[str] = (),
+    ) -> None:
+        """Store {code: (eur_per_unit, source)} for `day`; codes in `missing` are marked as not published that day."""
+        with self._lock:
+            self._ensure_loaded()
+            row = self._grow(day.toordinal())
+            n = len(self.codes)
+            for code, (rate, source) in rates.items():
+                i = self._index.get(code)
+                if i is not None:
+                    self._rates[row * n + i] = float(rate)
+                    self._source_ids[row * n + i] = self._source_id(source)
+            for code in missing:
+                i = self._index.get(code)
+                if i is not None and math.isnan(self._rates[row * n + i]):
+                    self._rates[row * n + i] = MISSING
+            self._fetched[row] = max(self._fetched[row], fetched_at)
+            self._dirty = True
+        if time.monotonic() - self._saved_at >= self.save_every:
+            self.save()
+
+    def at_or_before(self, code: str, day: date_type) -> Optional[Tuple[str, CachedRate]]:
+        """(day_str, rate) of `day` or the closest earlier day that has the code, None if that needs a fetch."""
+        self._ensure_loaded()
+        i = self._index.get(code)
+        if i is None:
+            return None
+        n = len(self.codes)
+        row = day.toordinal() - self._first
+        if row >= self._days:
+            return None
+        for r in range(row, max(-1, row - self.max_back - 1), -1):
+            if r < 0:
+                return None
+            value = self._rates[r * n + i]
+            if math.isnan(value):
+                return None  # never fetched — cannot tell a holiday from a gap
+            if value > 0:
+                found = date_type.fromordinal(self._first + r).isoformat()
+                return found, CachedRate(Decimal(repr(value)), self._sources[self._source_ids[r * n + i]], self._fetched[r])
+        return None
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return self._days
+
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Mapping, Optional, Tuple
+
+
+def normalize_code(code: str) -> str:
+    c = (code or "").strip().upper()
+    if c == "USDT":  # treat USDT as USD-peg
+        return "USD"
+    return c
+
+
+@dataclass(frozen=True)
+class RateTable:
+    """All known currencies for one day, as EUR per 1 unit, plus the cross-rate matrix.
+
+    `matrix[i][j]` is how many units of `codes[j]` one unit of `codes[i]` buys;
+    it is computed once per table so conversions never touch the network.
+    """
+
+    day: str
+    codes: Tuple[str, ...]
+    to_eur: Tuple[Decimal, ...]
+    sources: Tuple[str, ...]
+    fetched_at: float
+    matrix: Tuple[Tuple[Decimal, ...], ...] = field(init=False, repr=False, compare=False)
+    _index: Dict[str, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        index = {c: i for i, c in enumerate(self.codes)}
+        inverse = [Decimal(1) / r for r in self.to_eur]
+        matrix = tuple(tuple(r * inv for inv in inverse) for r in self.to_eur)
+        object.__setattr__(self, "_index", index)
+        object.__setattr__(self, "matrix", matrix)
+
+    @classmethod
+    def build(cls, day: str, rates: Mapping[str, Tuple[Decimal, str]], fetched_at: float) -> "RateTable":
+        """rates: {code: (eur_per_unit, source)}; EUR itself is always present."""
+        merged: Dict[str, Tuple[Decimal, str]] = {"EUR": (Decimal("1"), "")}
+        for code, (rate, source) in rates.items():
+            if rate > 0:
+                merged[normalize_code(code)] = (rate, source)
+        codes = tuple(sorted(merged))
+        return cls(
+            day=day,
+            codes=codes,
+            to_eur=tuple(merged[c][0] for c in codes),
+            sources=tuple(merged[c][1] for c in codes),
+            fetched_at=fetched_at,
+        )
+
+    def __contains__(self, code: str) -> bool:
+        return normalize_code(code) in self._index
+
+    def missing(self, codes: List[str]) -> List[str]:
+        return [c for c in codes if normalize_code(c) not in self._index]
+
+    def rate_to_eur(self, code: str) -> Optional[Decimal]:
+        i = self._index.get(normalize_code(code))
+        return self.to_eur[i] if i is not None else None
+
+    def source(self, code: str) -> str:
+        i = self._index.get(normalize_code(code))
+        return self.sources[i] if i is not None else ""
+
+    def cross_rate(self, from_code: str, to_code: str) -> Optional[Decimal]:
+        i = self._index.get(normalize_code(from_code))
+        j = self._index.get(normalize_code(to_code))
+        if i is None or j is None:
+            return None
+        return self.matrix[i][j]
+
+    def convert(self, amount: Decimal, from_code: str, to_code: str = "EUR") -> Optional[Decimal]:
+        """Convert `amount` and round to 2 places, or None if a code is unknown."""
+        rate = self.cross_rate(from_code, to_code)
+        if rate is None:
+            return None
+        return (amount * rate).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
@@ -1,186 +1,678 @@
 from __future__ import annotations
 
+import asyncio
+import importlib.util
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import date as date_type
 from datetime import timedelta
 import httpx
 from decimal import Decimal, ROUND_HALF_UP, getcontext
-from typing import Optional, Tuple, Dict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
 
 from loguru import logger
 
+from . import metrics
+from .config import settings
+from .constants import CURRENCIES
+from .rate_cache import CachedRate, RateCache
+from .rate_health import ProviderHealth
+from .rate_series import RateSeries
+from .rate_table import RateTable, normalize_code
+
 # Decimal precision high enough for currency math, rounded to 2 at the edge
 getcontext().prec = 28
 
-# Simple in-memory cache: {(code, yyyy-mm-dd): Decimal(rate_to_eur)}
-_CACHE: Dict[Tuple[str, str], Decimal] = {}
+# Two-tier cache {(code, "latest" | yyyy-mm-dd): rate_to_eur}: LRU + `rates` table in excelbot.db
+_CACHE = RateCache(
+    max_items=settings.rates_cache_size,
+    max_rows=settings.rates_cache_max_rows,
+    latest_ttl=settings.rates_latest_ttl_sec,
+)
+# Recently built tables by day string (matrix is computed once per table)
+_TABLES: "OrderedDict[str, RateTable]" = OrderedDict()
+_TABLES_MAX = 32
+
+# In-flight lookups {key: task}: concurrent callers for the same key share one task
+_INFLIGHT: Dict[Tuple[str, ...], asyncio.Task] = {}
+_COALESCED = 0
+
+# Codes every table should cover (USDT is folded into USD)
+RATE_CODES: list[str] = sorted({normalize_code(c) for c in CURRENCIES} - {"EUR"})
+
+# Past days as typed arrays per currency (file next to excelbot.db): a weekend or holiday
+# resolves to the closest earlier business day without probing the providers again
+_SERIES = RateSeries(settings.rates_series_path, RATE_CODES)
+
+# Base-EUR endpoints: one request returns every currency for the day
+FRANKFURTER_URL = "https://api.frankfurter.app/{day}?from=EUR"
+# Time series: every business day of [start, end] in one response (ECB currencies only)
+FRANKFURTER_SERIES_URL = "https://api.frankfurter.app/{start}..{end}?from=EUR"
+SERIES_MAX_DAYS = 90
+EXHOST_URL = "https://api.exchangerate.host/{day}?base=EUR&symbols={symbols}"
+FAWAZ_URL = "https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@{vers}/currencies/eur.json"
+FLOATRATES_URL = "https://www.floatrates.com/daily/eur.json"
+
+# Shared connection-pooled client, opened/closed together with the bot (see run.py)
+_CLIENT: Optional[httpx.AsyncClient] = None
+# Per-host concurrency slots: httpx only limits the pool as a whole
+_HOST_SLOTS: Dict[str, asyncio.Semaphore] = {}
+
+
+async def open_client() -> httpx.AsyncClient:
+    """Create the shared HTTP client (keep-alive pool, optional HTTP/2)."""
+    global _CLIENT
+    if _CLIENT is not None and not _CLIENT.is_closed:
+        return _CLIENT
+    http2 = settings.rates_http2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("RATES_HTTP2 включен, но пакет h2 не установлен — используем HTTP/1.1")
+        http2 = False
+    _CLIENT = httpx.AsyncClient(
+        timeout=settings.rates_timeout_sec,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.rates_max_connections,
+            max_keepalive_connections=settings.rates_max_connections,
+            keepalive_expiry=60.0,
+        ),
+        headers={"User-Agent": "excelbot/2"},
+    )
+    _HOST_SLOTS.clear()
+    return _CLIENT
+
+
+async def close_client() -> None:
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+    _HOST_SLOTS.clear()
+    _SERIES.save()  # at shutdown, together with the client
+
+
+def _host_slot(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    slot = _HOST_SLOTS.get(host)
+    if slot is None:
+        slot = _HOST_SLOTS[host] = asyncio.Semaphore(max(1, settings.rates_max_per_host))
+    return slot
+
+
+async def _get_json(url: str) -> Any:
+    """GET `url` through the shared pool and return decoded JSON (raises httpx.HTTPError)."""
+    client = _CLIENT if _CLIENT is not None and not _CLIENT.is_closed else await open_client()
+    async with _host_slot(url):
+        r = await client.get(url)
+        r.raise_for_status()
+        return r.json()
+
+
+async def _single_flight(key: Tuple[str, ...], factory: Callable[[], Awaitable[Any]]) -> Any:
+    """Run `factory()` once per key; concurrent callers await the same task.
 
-FRANKFURTER_URL = "https://api.frankfurter.app/{day}?from={code}&to=EUR"
-EXHOST_URL = "https://api.exchangerate.host/convert?from={code}&to=EUR&amount=1&date={day}"
-FAWAZ_URL = "https://cdn.jsdelivr.net/gh/fawazahmed0/currency-api@{vers}/currencies/{code}/eur.json"
-FLOATRATES_URL = "https://www.floatrates.com/daily/{code}.json"
+    A cancelled caller does not cancel the shared task (others may still
+    wait on it); errors propagate to every waiter and the key is released
+    so the next call retries.
+    """
+    global _COALESCED
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda t: _flight_done(key, t))
+    else:
+        _COALESCED += 1
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if task.cancelled():
+            # the shared task itself was cancelled, not this caller: start over
+            return await _single_flight(key, factory)
+        raise
+
+
+def _flight_done(key: Tuple[str, ...], task: asyncio.Task) -> None:
+    if _INFLIGHT.get(key) is task:
+        del _INFLIGHT[key]
+    if not task.cancelled():
+        task.exception()  # mark as retrieved even if every waiter went away
+
+
+def coalesced_calls() -> int:
+    """How many lookups joined an already running request instead of starting one."""
+    return _COALESCED
 
 
 def _normalize_code(code: str) -> str:
-    c = (code or "").strip().upper()
-    if c == "USDT":  # treat USDT as USD-peg
-        return "USD"
-    return c
+    return normalize_code(code)
+
+
+def _invert(per_eur: Dict[str, Any]) -> Dict[str, Decimal]:
+    """{code: units per 1 EUR} → {code: EUR per 1 unit}, only for RATE_CODES."""
+    out: Dict[str, Decimal] = {}
+    for code in RATE_CODES:
+        val = per_eur.get(code)
+        if val is None:
+            val = per_eur.get(code.lower())
+        if val is None:
+            continue
+        val_dec = Decimal(str(val))
+        if val_dec > 0:
+            out[code] = Decimal(1) / val_dec
+    return out
 
 
-async def _exhost_rate(code_n: str, day_str: str) -> Optional[Decimal]:
-    url = EXHOST_URL.format(code=code_n, day=day_str)
+async def _frankfurter_table(day_str: str) -> Optional[Dict[str, Decimal]]:
+    url = FRANKFURTER_URL.format(day=day_str)
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-            data = r.json()
-            # Prefer explicit rate if present
-            rate = (data.get("info", {}) or {}).get("rate")
-            if rate is None:
-                # Some responses return only result for amount=1
-                rate = data.get("result")
-            if rate is None:
-                logger.warning(f"exchangerate.host: no EUR rate for {code_n} on {day_str}")
-                return None
-            return Decimal(str(rate))
+        data = await _get_json(url)
+        return _invert(data.get("rates") or {}) or None
+    except httpx.HTTPError as e:
+        logger.debug(f"Frankfurter HTTP error for {day_str}: {e}")
+        return None
+    except Exception as e:
+        logger.debug(f"Frankfurter unexpected error for {day_str}: {e}")
+        return None
+
+
+async def _exhost_table(day_str: str) -> Optional[Dict[str, Decimal]]:
+    # no 'latest' support → use today when needed
+    if day_str == "latest":
+        day_str = date_type.today().isoformat()
+    url = EXHOST_URL.format(day=day_str, symbols=",".join(RATE_CODES))
+    try:
+        data = await _get_json(url)
+        table = _invert(data.get("rates") or {})
+        if not table:
+            logger.warning(f"exchangerate.host: no rates on {day_str}")
+            return None
+        return table
     except httpx.HTTPError as e:
-        logger.error(f"exchangerate.host HTTP error for {code_n} {day_str}: {e}")
+        logger.error(f"exchangerate.host HTTP error for {day_str}: {e}")
         return None
     except Exception as e:
         logger.exception(e)
         return None
 
 
-async def _fawaz_rate(code_n: str, day_str: str) -> Optional[Decimal]:
+async def _fawaz_table(day_str: str) -> Optional[Dict[str, Decimal]]:
     # day_str: "latest" or "YYYY-MM-DD"
-    vers = "latest" if day_str == "latest" else day_str
-    url = FAWAZ_URL.format(vers=vers, code=code_n.lower())
+    url = FAWAZ_URL.format(vers=day_str)
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-            data = r.json()
-            val = data.get("eur")
-            if val is None:
-                logger.warning(f"fawaz: no EUR for {code_n} on {day_str}")
-                return None
-            return Decimal(str(val))
+        data = await _get_json(url)
+        table = _invert(data.get("eur") or {})
+        if not table:
+            logger.warning(f"fawaz: no rates on {day_str}")
+            return None
+        return table
     except httpx.HTTPError as e:
-        logger.debug(f"fawaz HTTP error {code_n} {day_str}: {e}")
+        logger.debug(f"fawaz HTTP error {day_str}: {e}")
         return None
     except Exception as e:
-        logger.debug(f"fawaz unexpected {code_n} {day_str}: {e}")
+        logger.debug(f"fawaz unexpected {day_str}: {e}")
         return None
 
 
-async def _floatrates_rate(code_n: str, day_str: str) -> Optional[Decimal]:
+async def _floatrates_table(day_str: str) -> Optional[Dict[str, Decimal]]:
     """
-    Floatrates: returns JSON for base=code_n; take lowercase key 'eur'.
+    Floatrates: JSON for base=EUR keyed by lowercase code.
     Ignores day_str (latest-only), but we keep signature uniform.
     """
-    url = FLOATRATES_URL.format(code=code_n.lower())
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-            data = r.json()
-            eur = (data.get("eur") or {}).get("rate")
-            if eur is None:
-                logger.warning(f"floatrates: no EUR for {code_n}")
-                return None
-            return Decimal(str(eur))
+        data = await _get_json(FLOATRATES_URL)
+        table: Dict[str, Decimal] = {}
+        for code in RATE_CODES:
+            inverse = (data.get(code.lower()) or {}).get("inverseRate")
+            if inverse is not None:
+                table[code] = Decimal(str(inverse))
+        if not table:
+            logger.warning("floatrates: no rates")
+            return None
+        return table
     except httpx.HTTPError as e:
-        logger.debug(f"floatrates HTTP error {code_n}: {e}")
+        logger.debug(f"floatrates HTTP error: {e}")
         return None
     except Exception as e:
-        logger.debug(f"floatrates unexpected {code_n}: {e}")
+        logger.debug(f"floatrates unexpected: {e}")
         return None
 
 
-async def get_rate_to_eur(code: str, day: date_type) -> Optional[Decimal]:
-    """Return 1 unit of `code` in EUR for the given day.
-    Strategy: Frankfurter (latest/dated) → fallback to exchangerate.host; try up to 5 days back.
-    Cache successful result under the original requested date (day.isoformat()) to stabilize output.
+ProviderFn = Callable[[str], Awaitable[Optional[Dict[str, Decimal]]]]
+
+# Registry of rate sources; default order comes from settings.rates_provider_priority
+PROVIDERS: Dict[str, ProviderFn] = {
+    "frankfurter": _frankfurter_table,
+    "exhost": _exhost_table,
+    "fawaz": _fawaz_table,
+    "floatrates": _floatrates_table,
+}
+
+
+# Sources that only serve the current rates and ignore the requested day
+LATEST_ONLY = frozenset({"floatrates"})
+
+
+def _serves_day(name: str, day_str: str) -> bool:
+    return name not in LATEST_ONLY or day_str in ("latest", date_type.today().isoformat())
+
+
+# Per-provider latency/error tracking and circuit breakers
+_HEALTH: Dict[str, ProviderHealth] = {}
+
+
+def _health(name: str) -> ProviderHealth:
+    health = _HEALTH.get(name)
+    if health is None:
+        health = _HEALTH[name] = ProviderHealth(
+            name,
+            failure_threshold=settings.rates_breaker_failures,
+            cooldown=settings.rates_breaker_cooldown_sec,
+        )
+    return health
+
+
+def _priority_order() -> list[str]:
+    order = [name for name in settings.rates_provider_priority if name in PROVIDERS]
+    return order or list(PROVIDERS)
+
+
+def _day_providers(day_str: str) -> list[str]:
+    """Providers that can answer for `day_str`: latest-only sources are left out for past days."""
+    return [name for name in _priority_order() if _serves_day(name, day_str)]
+
+
+def _provider_order(day_str: str = "latest") -> list[str]:
+    """Healthy providers for `day_str`, fastest (latency EWMA × error rate) first; priority breaks ties.
+    Providers with an open breaker are left out until their cooldown ends."""
+    priority = _priority_order()
+    rank = {name: i for i, name in enumerate(priority)}
+    now = time.monotonic()
+    healthy = [name for name in _day_providers(day_str) if _health(name).available(now)]
+    return sorted(healthy, key=lambda name: (round(_health(name).score, 2), rank[name]))
+
+
+def provider_health() -> Dict[str, Dict[str, Any]]:
+    return {name: _health(name).snapshot() for name in _priority_order()}
+
+
+async def _call_provider(name: str, day_str: str) -> Optional[Dict[str, Decimal]]:
+    health = _health(name)
+    if not health.begin():
+        return None
+    started = time.monotonic()
+    try:
+        table = await PROVIDERS[name](day_str)
+    except asyncio.CancelledError:
+        health.record_cancelled(time.monotonic() - started)
+        metrics.RATE_PROVIDER_SECONDS.observe(time.monotonic() - started, provider=name, outcome="cancelled")
+        raise
+    except Exception as e:
+        logger.debug(f"{name} failed for {day_str}: {e}")
+        table = None
+    elapsed = time.monotonic() - started
+    metrics.RATE_PROVIDER_SECONDS.observe(elapsed, provider=name, outcome="ok" if table else "error")
+    if table:
+        health.record_success(elapsed)
+    else:
+        health.record_failure(elapsed)
+        if health.state != "closed":
+            logger.warning(f"Провайдер курсов {name} отключен на {health.cooldown:.0f} с")
+    return table
+
+
+_Merged = Dict[str, Tuple[Decimal, str]]  # code -> (EUR per unit, provider)
+
+
+async def _race_day(day_str: str) -> Optional[Tuple[str, _Merged, set[str]]]:
+    """Query the providers for one day string: (winner, {code: (rate, provider)}, providers that answered).
+
+    race: all providers start at once; hedge: the next provider starts after
+    `rates_hedge_delay_sec` or as soon as the previous one fails. The first
+    non-empty table is the winner (if several finish in the same tick the
+    configured priority decides), but the race ends only when the tables so
+    far cover RATE_CODES: until then the other providers keep running — in
+    hedge mode the ones not started yet start at once — and fill the gaps
+    concurrently; a code keeps the rate of the first table that had it. The
+    rest are cancelled once everything is covered. Launch order follows
+    `_provider_order()`, i.e. current provider health; latest-only sources
+    are not asked for a past day.
     """
-    code_n = _normalize_code(code)
-    if not code_n:
+    order = _provider_order(day_str)
+    if not order:
+        logger.warning(f"Все провайдеры курсов временно отключены ({day_str})")
         return None
-    if code_n == "EUR":
-        return Decimal("1")
+    rank = {name: i for i, name in enumerate(_priority_order())}
+    merged: _Merged = {}
+    answered: set[str] = set()
+
+    def absorb(results: list[Tuple[int, str, Dict[str, Decimal]]]) -> None:
+        for _, name, table in sorted(results, key=lambda r: r[0]):
+            answered.add(name)
+            for code, rate in table.items():
+                merged.setdefault(code, (rate, name))
+
+    def covered() -> bool:
+        return all(code in merged for code in RATE_CODES)
+
+    def result() -> Optional[Tuple[str, _Merged, set[str]]]:
+        if not merged:
+            return None
+        winner = next(source for _, source in merged.values())
+        return winner, merged, answered
+
+    if settings.rates_mode == "sequential":
+        for name in order:
+            table = await _call_provider(name, day_str)
+            if table:
+                absorb([(rank[name], name, table)])
+                if covered():
+                    break
+        return result()
+
+    stagger = 0.0 if settings.rates_mode == "race" else max(0.0, settings.rates_hedge_delay_sec)
+    queue = list(order)
+    pending: Dict[asyncio.Task, str] = {}
+
+    def launch() -> None:
+        name = queue.pop(0)
+        pending[asyncio.create_task(_call_provider(name, day_str))] = name
+
+    launch()
+    while queue and stagger == 0:
+        launch()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, timeout=stagger if queue else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                launch()  # hedge: the leader is slow, start the next provider
+                continue
+            tables: list[Tuple[int, str, Dict[str, Decimal]]] = []
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    table = task.result()
+                except Exception as e:
+                    logger.debug(f"{name} failed for {day_str}: {e}")
+                    table = None
+                if table:
+                    tables.append((rank[name], name, table))
+            absorb(tables)
+            if merged and covered():
+                break
+            if merged:
+                while queue:
+                    launch()  # a partial table: the gaps are filled by everyone else at once
+            elif queue and len(pending) == 0:
+                launch()  # everything in flight failed — don't wait for the stagger
+        return result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _remember_past_day(
+    day_str: str, rates: Dict[str, Tuple[Decimal, str]], fetched_at: float, missing: list[str]
+) -> None:
+    """Past days go into the series as well (today's rates still change, they stay in the TTL cache)."""
+    if day_str == "latest" or day_str >= date_type.today().isoformat():
+        return
+    _SERIES.put_day(date_type.fromisoformat(day_str), rates, fetched_at, missing)
+
+
+def _remember_table(table: RateTable) -> None:
+    _TABLES[table.day] = table
+    _TABLES.move_to_end(table.day)
+    while len(_TABLES) > _TABLES_MAX:
+        _TABLES.popitem(last=False)
+
+
+def _cached_table(day_str: str) -> Optional[RateTable]:
+    table = _TABLES.get(day_str)
+    if table is not None:
+        if _CACHE.is_fresh(day_str, table.fetched_at):
+            return table
+        del _TABLES[day_str]
+    # rebuild from the persistent cache after a restart
+    entries = {code: _CACHE.get_entry(code, day_str) for code in RATE_CODES}
+    if any(e is None for e in entries.values()):
+        return None
+    table = RateTable.build(
+        day_str,
+        {code: (e.rate, e.source) for code, e in entries.items() if e is not None},
+        fetched_at=min(e.fetched_at for e in entries.values() if e is not None),
+    )
+    _remember_table(table)
+    return table
+
+
+async def _fetch_table(day_str: str) -> Optional[RateTable]:
+    # provider fallback is per table: the race itself fills the winner's gaps from the other sources
+    found = await _race_day(day_str)
+    if found is None:
+        return None
+    winner, merged, answered = found
+    fetched_at = time.time()
+    _CACHE.put_many(day_str, merged, fetched_at)
+    missing = [c for c in RATE_CODES if c not in merged]
+    # "not published that day" only if every provider answered without the code; after a
+    # timeout or an open breaker the gap is not remembered and the next lookup fetches again
+    complete = not missing or answered >= set(_day_providers(day_str))
+    _remember_past_day(day_str, merged, fetched_at, missing=missing if complete else [])
+    table = RateTable.build(day_str, merged, fetched_at)
+    if complete:
+        _remember_table(table)
+    logger.debug(f"rate table {day_str}: {len(merged)} codes from {winner}" + (f", missing {missing}" if missing else ""))
+    return table
+
+
+async def get_rate_table(day_str: str) -> Optional[RateTable]:
+    """Rate table for a day string ("latest" or YYYY-MM-DD), from cache or one request per provider."""
+    table = _cached_table(day_str)
+    if table is not None:
+        metrics.RATE_TABLE_LOOKUPS.inc(result="hit")
+        return table
+    metrics.RATE_TABLE_LOOKUPS.inc(result="miss")
+    return await _single_flight(("table", day_str), lambda: _fetch_table(day_str))
+
+
+async def get_rate_series(start: date_type, end: date_type) -> Dict[str, Dict[str, Decimal]]:
+    """Rates for every business day in [start, end] from Frankfurter's time-series endpoint:
+    {day_str: {code: EUR per unit}}, one request per SERIES_MAX_DAYS. Days come back without
+    the currencies the ECB does not publish (RUB, UAH...) — those still go through
+    `get_rate_quote`. Past days are stored in the rate series: a day of the range that is
+    not in the response is a weekend or holiday for the published currencies, so
+    `get_rate_quote` resolves it to the earlier business day without the network.
+    """
+    series: Dict[str, Dict[str, Decimal]] = {}
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(end, chunk_start + timedelta(days=SERIES_MAX_DAYS - 1))
+        url = FRANKFURTER_SERIES_URL.format(start=chunk_start.isoformat(), end=chunk_end.isoformat())
+        try:
+            with metrics.RATE_PROVIDER_SECONDS.time(provider="frankfurter_series"):
+                data = await _get_json(url)
+        except Exception as e:
+            logger.warning(f"Frankfurter: ряд курсов {chunk_start}..{chunk_end} не получен: {e}")
+            data = {}
+        fetched_at = time.time()
+        chunk: Dict[str, Dict[str, Decimal]] = {}
+        for day_str, per_eur in (data.get("rates") or {}).items():
+            table = _invert(per_eur or {})
+            if table and chunk_start.isoformat() <= day_str <= chunk_end.isoformat():
+                chunk[day_str] = table
+        published = sorted({code for table in chunk.values() for code in table})
+        day = chunk_start
+        while chunk and day <= chunk_end:
+            table = chunk.get(day.isoformat(), {})
+            _remember_past_day(
+                day.isoformat(),
+                {code: (rate, "frankfurter") for code, rate in table.items()},
+                fetched_at,
+                missing=[c for c in published if c not in table],
+            )
+            day += timedelta(days=1)
+        series.update(chunk)
+        chunk_start = chunk_end + timedelta(days=1)
+    logger.debug(f"rate series {start}..{end}: {len(series)} days")
+    return series
+
 
-    # Build list of day strings to try
+def _day_tries(day: date_type) -> list[str]:
     tries: list[str] = []
-    today_iso = date_type.today().isoformat()
     if day == date_type.today():
         tries.append("latest")
     tries.append(day.isoformat())
     for i in range(1, 6):  # up to 5 days back
         tries.append((day - timedelta(days=i)).isoformat())
+    return tries
+
+
+@dataclass(frozen=True)
+class RateQuote:
+    """Rate of 1 unit of `code` in EUR plus where and when it came from.
+    `stale` marks a last-known rate served because the lookup ran out of budget or failed."""
+
+    code: str
+    rate: Decimal
+    day: str
+    source: str
+    fetched_at: float
+    stale: bool = False
+
+    def to_eur(self, amount: Decimal) -> Decimal:
+        return (amount * self.rate).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def _quote(code_n: str, day_str: str, entry: CachedRate, stale: bool = False) -> RateQuote:
+    return RateQuote(code_n, entry.rate, day_str, entry.source, entry.fetched_at, stale)
+
+
+def _stale_quote(code_n: str) -> Optional[RateQuote]:
+    last = _CACHE.last_known(code_n)
+    if last is None:
+        return None
+    day_str, entry = last
+    return _quote(code_n, day_str, entry, stale=True)
+
+
+async def get_rate_quote(code: str, day: date_type, budget: Optional[float] = None) -> Optional[RateQuote]:
+    """Return 1 unit of `code` in EUR for the given day, with its source.
+    Strategy: the day's rate table is fetched from the raced/hedged providers
+    (see `_race_day`); the next, earlier day is tried only when no provider
+    had the currency for the current one (up to 5 days back).
+    Cache successful result under the original requested date (day.isoformat()) to stabilize output.
+
+    `budget` (seconds) caps the whole lookup: when it runs out, or the lookup
+    fails, the most recent known rate is returned with stale=True while the
+    request keeps running in the background and refreshes the cache. That
+    fallback applies to today's rate only; without a budget, or for a past
+    day, a failed lookup returns None.
+    """
+    code_n = _normalize_code(code)
+    if not code_n:
+        return None
+    if code_n == "EUR":
+        return RateQuote("EUR", Decimal("1"), day.isoformat(), "", time.time())
 
     requested_key = (code_n, day.isoformat())
 
     # Return from cache if already known for the exact requested day
-    if requested_key in _CACHE:
-        return _CACHE[requested_key]
+    cached = _CACHE.get_entry(*requested_key)
+    if cached is not None:
+        metrics.RATE_LOOKUPS.inc(result="hit")
+        return _quote(code_n, requested_key[1], cached)
+    known = _SERIES.at_or_before(code_n, day)
+    if known is not None:
+        metrics.RATE_LOOKUPS.inc(result="series")
+        return _quote(code_n, *known)
+    metrics.RATE_LOOKUPS.inc(result="miss")
 
-    for day_str in tries:
-        cache_key = (code_n, day_str)
-        if cache_key in _CACHE:
-            # also pin to requested day cache for stability
-            _CACHE[requested_key] = _CACHE[cache_key]
-            return _CACHE[cache_key]
-
-        # 1) Try Frankfurter
+    # the shared task outlives a timed-out caller, so it doubles as the background refresh
+    lookup = _single_flight(("rate",) + requested_key, lambda: _lookup_rate(code_n, day))
+    if budget is None:
+        quote = await lookup
+    else:
         try:
-            url = FRANKFURTER_URL.format(day=day_str, code=code_n)
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                r = await client.get(url)
-                r.raise_for_status()
-                data = r.json()
-                rate = data.get("rates", {}).get("EUR")
-                if rate is not None:
-                    rate_dec = Decimal(str(rate))
-                    _CACHE[cache_key] = rate_dec
-                    _CACHE[requested_key] = rate_dec
-                    return rate_dec
-        except httpx.HTTPError as e:
-            logger.debug(f"Frankfurter HTTP error for {code_n} {day_str}: {e}")
-        except Exception as e:
-            logger.debug(f"Frankfurter unexpected error for {code_n} {day_str}: {e}")
-
-        # 2) Fallback: exchangerate.host (no 'latest' support → use today when needed)
-        ex_day = day_str if day_str != "latest" else today_iso
-        rate_dec = await _exhost_rate(code_n, ex_day)
-        if rate_dec is not None:
-            _CACHE[cache_key] = rate_dec
-            _CACHE[requested_key] = rate_dec
-            return rate_dec
-
-        # 3) Final fallback: Fawaz currency API via jsDelivr
-        rate_dec = await _fawaz_rate(code_n, day_str)
-        if rate_dec is not None:
-            _CACHE[cache_key] = rate_dec
-            _CACHE[requested_key] = rate_dec
-            return rate_dec
-
-        # 4) Floatrates final fallback (latest only)
-        rate_dec = await _floatrates_rate(code_n, day_str)
-        if rate_dec is not None:
-            _CACHE[cache_key] = rate_dec
-            _CACHE[requested_key] = rate_dec
-            return rate_dec
+            quote = await asyncio.wait_for(lookup, timeout=max(0.0, budget))
+        except asyncio.TimeoutError:
+            logger.warning(f"Курс {code_n} не получен за {budget} с — используем последний известный")
+            quote = None
+    if quote is None and budget is not None and day >= date_type.today():
+        quote = _stale_quote(code_n)
+        if quote is not None:
+            metrics.RATE_LOOKUPS.inc(result="stale")
+    return quote
+
+
+async def get_rate_to_eur(code: str, day: date_type, budget: Optional[float] = None) -> Optional[Decimal]:
+    """Return 1 unit of `code` in EUR for the given day (see `get_rate_quote`)."""
+    quote = await get_rate_quote(code, day, budget)
+    return quote.rate if quote is not None else None
+
+
+async def _lookup_rate(code_n: str, day: date_type) -> Optional[RateQuote]:
+    requested_key = (code_n, day.isoformat())
+    past = requested_key[1] < date_type.today().isoformat()
+    for day_str in _day_tries(day):
+        if past:
+            # every fetched past day lands in the series; it answers as soon as it knows the day
+            known = _SERIES.at_or_before(code_n, day)
+            if known is not None:
+                return _quote(code_n, *known)
+        cached = _CACHE.get_entry(code_n, day_str)
+        if cached is None:
+            table = await get_rate_table(day_str)
+            if table is None or table.rate_to_eur(code_n) is None:
+                continue
+            cached = CachedRate(table.rate_to_eur(code_n), table.source(code_n), table.fetched_at)
+        if day_str != requested_key[1] and not past:
+            # today's rate came from "latest" or an earlier day: pin it to today (TTL applies)
+            _CACHE.put(*requested_key, cached.rate, cached.source, cached.fetched_at)
+        return _quote(code_n, day_str, cached)
 
     return None
 
 
-async def convert_to_eur(amount: Decimal, code: str, day: date_type) -> Optional[Decimal]:
-    """Convert `amount` of `code` to EUR using daily rate. Returns Decimal rounded to 2 places, or None."""
+async def convert(amount: Decimal, from_code: str, to_code: str, day: date_type) -> Optional[Decimal]:
+    """Direct cross conversion through the day's rate matrix, rounded to 2 places."""
+    try:
+        for day_str in _day_tries(day):
+            table = await get_rate_table(day_str)
+            if table is not None and from_code in table and to_code in table:
+                return table.convert(amount, from_code, to_code)
+        return None
+    except Exception as e:
+        logger.exception(e)
+        return None
+
+
+async def warm_cache() -> int:
+    """Fill the in-memory cache tier from excelbot.db (startup; the read runs in a thread)."""
+    try:
+        rows = await asyncio.to_thread(_CACHE.recent_rows)
+        n = _CACHE.load(rows)
+        logger.info(f"Кэш курсов прогрет: {n} записей, ряд курсов: {len(_SERIES)} дней")
+        return n
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть кэш курсов: {e}")
+        return 0
+
+
+async def convert_to_eur(
+    amount: Decimal, code: str, day: date_type, budget: Optional[float] = None
+) -> Optional[Decimal]:
+    """Convert `amount` of `code` to EUR using daily rate. Returns Decimal rounded to 2 places, or None.
+    With `budget`, today's amount may use a stale last-known rate (see `get_rate_quote`)."""
     try:
-        rate = await get_rate_to_eur(code, day)
-        if rate is None:
+        quote = await get_rate_quote(code, day, budget)
+        if quote is None:
             return None
-        eur = (amount * rate).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-        return eur
+        return quote.to_eur(amount)
     except Exception as e:
         logger.exception(e)
         return None
\ No newline at end of file
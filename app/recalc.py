@@ -0,0 +1,174 @@
+"""Пересчёт profit_eur (и колонок курса) для строк листа за период.
+
+    python -m app.recalc 01.03.2025 31.03.2025 [--all] [--dry-run]
+
+Без --all пересчитываются только строки, где прибыль не посчитана («н/д»
+или пусто) или посчитана по устаревшему курсу (заполнена колонка rate_stale).
+То же делает команда бота /recalc.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+from datetime import date as date_type
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from . import rates
+from .config import settings
+from .constants import COLUMNS
+from .google_sheets import Sheets
+from .ledger import Ledger
+from .quote import DealQuote, normalize_expenses
+from .rates import RateQuote
+from .sheet_mirror import SheetMirror
+from .utils import parse_day
+
+MISSING_PROFIT = ("", "н/д")
+# колонки, которые переписывает пересчёт (идут подряд: прибыль, пометка, источник, время курса)
+_FIRST, _LAST = "profit_eur", "rate_time"
+_SPAN = slice(COLUMNS[_FIRST], COLUMNS[_LAST] + 1)
+_LOOKBACK_DAYS = 5  # ряд берётся с запасом: выходные в начале периода берут курс ближайшего прошлого дня
+
+
+@dataclass
+class RecalcReport:
+    checked: int = 0      # строк за период, подходящих под фильтр
+    updated: int = 0      # строк с изменившимися значениями (записаны, если не dry_run)
+    no_rate: int = 0      # курс так и не найден — строка не тронута
+    invalid: int = 0      # не разобрать валюту/сумму
+    rows: List[int] = field(default_factory=list)
+
+
+def _cell(row: List[str], name: str) -> str:
+    i = COLUMNS[name]
+    return row[i].strip() if len(row) > i and row[i] else ""
+
+
+def _amount(text: str) -> Decimal:
+    value = Decimal(text.replace(" ", "").replace(" ", "").replace(",", "."))
+    if not value.is_finite() or value <= 0:
+        raise InvalidOperation(text)
+    return value
+
+
+async def _quotes(keys: List[Tuple[str, date_type]]) -> Dict[Tuple[str, date_type], Optional[RateQuote]]:
+    """Курсы для (валюта, дата); после get_rate_series ECB-валюты берутся из ряда без запросов."""
+    results = await asyncio.gather(*(rates.get_rate_quote(code, day) for code, day in keys), return_exceptions=True)
+    found: Dict[Tuple[str, date_type], Optional[RateQuote]] = {}
+    for key, result in zip(keys, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Пересчёт: курс {key[0]} на {key[1]} не получен: {result}")
+            result = None
+        # последний известный курс (stale) для пересчёта не годится — строка останется как есть
+        found[key] = result if result is not None and not result.stale else None
+    return found
+
+
+async def recalc(
+    sheets: Sheets,
+    mirror: SheetMirror,
+    date_from: date_type,
+    date_to: date_type,
+    all_rows: bool = False,
+    dry_run: bool = False,
+    ledger: Optional[Ledger] = None,
+) -> RecalcReport:
+    """Пересчитывает строки за [date_from, date_to] и записывает изменения одним batch_update.
+
+    Строки берутся из зеркала листа (перед этим — инкрементальный sync), курсы ECB-валют — одним
+    запросом ряда Frankfurter на каждые SERIES_MAX_DAYS дней, остальные — как
+    при вводе заявки. Прибыль считается так же, как при добавлении строки:
+    DealQuote.sheet_row и Sheets.prepare_row.
+    """
+    await mirror.sync()  # инкрементально; целиком лист читается, только если зеркало ещё пустое
+    report = RecalcReport()
+    deals: List[Tuple[int, List[str], date_type]] = []
+    for row_index, row in mirror.deals(date_from.isoformat(), date_to.isoformat()):
+        if not all_rows and _cell(row, "profit_eur") not in MISSING_PROFIT and not _cell(row, "rate_stale"):
+            continue
+        report.checked += 1
+        deals.append((row_index, row, parse_day(_cell(row, "date_fixed"))))
+    if not deals:
+        return report
+
+    await rates.get_rate_series(date_from - timedelta(days=_LOOKBACK_DAYS), date_to)
+    keys = sorted({(_cell(row, c), day) for _, row, day in deals for c in ("currency_in", "currency_out")})
+    quotes = await _quotes(keys)
+
+    updates: List[Tuple[int, List[str]]] = []
+    changes: List[Tuple[List[str], List[str]]] = []  # (было, стало) для ledger
+    for row_index, row, day in deals:
+        currency_in, currency_out = _cell(row, "currency_in"), _cell(row, "currency_out")
+        try:
+            amount_in, amount_out = _amount(_cell(row, "amount_in")), _amount(_cell(row, "amount_out"))
+        except InvalidOperation:
+            report.invalid += 1
+            continue
+        leg_in, leg_out = quotes.get((currency_in, day)), quotes.get((currency_out, day))
+        if leg_in is None or leg_out is None:
+            report.no_rate += 1
+            continue
+        quote = DealQuote(currency_in, amount_in, currency_out, amount_out, leg_in, leg_out)
+        fresh = Sheets.prepare_row(
+            quote.sheet_row(
+                _cell(row, "name"),
+                _cell(row, "commission"),
+                normalize_expenses(_cell(row, "expenses")),
+                _cell(row, "comment"),
+                day,
+            )
+        )
+        padded = (list(row) + [""] * len(COLUMNS))[: len(COLUMNS)]
+        old, new = padded[_SPAN], fresh[_SPAN]
+        # если прибыль та же и курс не был устаревшим, строку (и время курса в ней) не трогаем;
+        # пометка rate_stale входит в переписываемые колонки и снимается (устаревший курс сюда не попадает)
+        if new[0] != old[0] or _cell(row, "rate_stale"):
+            updates.append((row_index, new))
+            changes.append((padded, padded[: _SPAN.start] + new + padded[_SPAN.stop:]))
+    report.updated = len(updates)
+    report.rows = [i for i, _ in updates]
+    if updates and not dry_run:
+        await asyncio.to_thread(sheets.update_rows, updates, _FIRST)
+        if ledger is not None:
+            ledger.replace_rows(changes)
+    logger.info(
+        f"Пересчёт {date_from}..{date_to}: строк {report.checked}, обновлено {report.updated}, "
+        f"без курса {report.no_rate}, с ошибками {report.invalid}" + (" (dry run)" if dry_run else "")
+    )
+    return report
+
+
+async def _main(args: argparse.Namespace) -> None:
+    date_from, date_to = parse_day(args.date_from), parse_day(args.date_to)
+    sheets = Sheets(settings.spreadsheet_id, settings.sheet_name)
+    await asyncio.to_thread(sheets.connect)
+    sheets.ready.set()
+    mirror = SheetMirror(sheets, edit_window=settings.mirror_edit_window, full_every=settings.mirror_full_every)
+    ledger = Ledger()
+    await rates.open_client()
+    try:
+        report = await recalc(sheets, mirror, date_from, date_to, all_rows=args.all, dry_run=args.dry_run, ledger=ledger)
+    finally:
+        await rates.close_client()
+        mirror.close()
+        ledger.close()
+    print(
+        f"строк: {report.checked}, обновлено: {report.updated}, без курса: {report.no_rate}, "
+        f"с ошибками: {report.invalid}" + (" (без записи)" if args.dry_run else "")
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.recalc", description="Пересчёт profit_eur за период")
+    parser.add_argument("date_from", help="дд.мм.гггг или гггг-мм-дд")
+    parser.add_argument("date_to", help="дд.мм.гггг или гггг-мм-дд")
+    parser.add_argument(
+        "--all", action="store_true", help="пересчитать все строки, а не только «н/д» и по устаревшему курсу"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать, в таблицу не писать")
+    asyncio.run(_main(parser.parse_args()))
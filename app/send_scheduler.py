@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextvars
+import itertools
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, DeleteMessage, DeleteMessages, TelegramMethod
+from aiogram.methods.base import TelegramType
+from loguru import logger
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # ответы и подсказки пользователю
+    BACKGROUND = 1   # рассылки, уведомления
+    CLEANUP = 2      # удаление старых сообщений
+
+
+_priority: contextvars.ContextVar[Optional[Priority]] = contextvars.ContextVar("send_priority", default=None)
+
+
+@contextmanager
+def send_priority(priority: Priority) -> Iterator[None]:
+    """Приоритет исходящих запросов внутри блока (и созданных в нём задач)."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до следующего токена (0 — можно сейчас)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        """Telegram ответил 429 — до `until` ничего не отправляем."""
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = 0.0
+
+    def idle(self, now: float) -> bool:
+        return now >= self.blocked_until and self.wait_time(now) == 0 and self.tokens >= self.capacity
+
+
+# (priority, seq, chat_id, future)
+_Waiter = Tuple[int, int, Any, "asyncio.Future[None]"]
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API (middleware сессии бота).
+
+    Каждый запрос, адресованный чату, берёт токен из общего ведра
+    (`global_rate` в секунду); отправка и правка сообщений — ещё и из ведра
+    чата (`chat_rate` в личке, `group_per_min` в группах). Ожидающие запросы
+    получают токены по приоритету: подсказки пользователю раньше фоновых
+    рассылок, а те раньше удаления старых сообщений. На 429 чат (или всё, если
+    запрос не к чату) ставится на паузу на retry_after, запрос повторяется.
+    Удаление сообщения, которое уже удаляется, не отправляется повторно.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: int = 3,
+        group_per_min: float = 20.0,
+        group_burst: int = 5,
+        max_retries: int = 3,
+        max_buckets: int = 10000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate / 4)  # без большого всплеска в первую секунду
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.group_rate, self.group_burst = group_per_min / 60.0, group_burst
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._arrived: Optional[asyncio.Event] = None
+        self._pump: Optional[asyncio.Task] = None
+        self._deleting: Dict[Tuple[Any, int], "asyncio.Future[Any]"] = {}
+        self.stats = {"sent": 0, "queued": 0, "retry_after": 0, "deduplicated": 0}
+
+    def depth(self) -> int:
+        return len(self._queue)
+
+    # --- токены ---
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                now = time.monotonic()
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.idle(now)}
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = (
+                TokenBucket(self.group_rate, self.group_burst) if group else TokenBucket(self.chat_rate, self.chat_burst)
+            )
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _ready(self, chat_id: Any, now: float) -> float:
+        wait = self.global_bucket.wait_time(now)
+        if chat_id is not None:
+            wait = max(wait, self._bucket(chat_id).wait_time(now))
+        return wait
+
+    def _take(self, chat_id: Any, now: float) -> None:
+        self.global_bucket.take(now)
+        if chat_id is not None:
+            self._bucket(chat_id).take(now)
+
+    async def _acquire(self, priority: Priority, chat_id: Any) -> None:
+        now = time.monotonic()
+        if not self._queue and self._ready(chat_id, now) == 0:
+            self._take(chat_id, now)
+            return
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        bisect.insort(self._queue, (int(priority), next(self._seq), chat_id, future), key=lambda w: w[:2])
+        self.stats["queued"] += 1
+        if self._arrived is None:
+            self._arrived = asyncio.Event()
+        self._arrived.set()
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    def _grant(self) -> Optional[float]:
+        """Раздаёт токены ожидающим по приоритету; возвращает, сколько ждать следующей раздачи."""
+        now = time.monotonic()
+        next_wait: Optional[float] = None
+        i = 0
+        while i < len(self._queue):
+            _, _, chat_id, future = self._queue[i]
+            if future.done():  # ожидание отменили
+                del self._queue[i]
+                continue
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                return global_wait
+            wait = self._ready(chat_id, now)
+            if wait > 0:  # этот чат ещё на паузе — пропускаем его, другие чаты не ждут
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+                i += 1
+                continue
+            self._take(chat_id, now)
+            future.set_result(None)
+            del self._queue[i]
+        return next_wait
+
+    async def _run_pump(self) -> None:
+        while self._queue:
+            self._arrived.clear()
+            wait = self._grant()
+            if not self._queue:
+                break
+            try:
+                await asyncio.wait_for(self._arrived.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- запросы ---
+    @staticmethod
+    def _classify(method: TelegramMethod[Any]) -> Tuple[Priority, bool]:
+        """(приоритет, расходует ли лимит чата)."""
+        explicit = _priority.get()
+        if isinstance(method, (DeleteMessage, DeleteMessages)):
+            return Priority.CLEANUP if explicit is None else explicit, False
+        name = type(method).__name__
+        chat_limited = name.startswith(("Send", "Edit", "Copy", "Forward"))
+        return Priority.INTERACTIVE if explicit is None else explicit, chat_limited
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None and not isinstance(method, AnswerCallbackQuery):
+            return await make_request(bot, method)  # getUpdates, getMe, setWebhook...
+        if isinstance(method, DeleteMessage):
+            return await self._delete_once(make_request, bot, method)
+        if isinstance(method, DeleteMessages):
+            return await self._delete_many_once(make_request, bot, method)
+        return await self._send(make_request, bot, method)
+
+    async def _send(self, make_request: NextRequestMiddlewareType[Any], bot: Bot, method: TelegramMethod[Any]) -> Any:
+        priority, chat_limited = self._classify(method)
+        chat_id = getattr(method, "chat_id", None)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority, chat_id if chat_limited else None)
+            try:
+                result = await make_request(bot, method)
+                self.stats["sent"] += 1
+                return result
+            except TelegramRetryAfter as e:
+                self.stats["retry_after"] += 1
+                if attempt == self.max_retries:
+                    raise
+                bucket = self._bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.block(time.monotonic() + e.retry_after)
+                logger.warning(f"Telegram 429 в {chat_id or 'API'}: пауза {e.retry_after} с ({type(method).__name__})")
+                if not chat_limited and chat_id is not None:
+                    await asyncio.sleep(e.retry_after)  # такие запросы ведро чата не проверяют
+
+    async def _delete_once(self, make_request: NextRequestMiddlewareType[Any], bot: Bot, method: DeleteMessage) -> Any:
+        key = (method.chat_id, method.message_id)
+        pending = self._deleting.get(key)
+        if pending is not None:
+            self.stats["deduplicated"] += 1
+            return await asyncio.shield(pending)
+        task = asyncio.ensure_future(self._send(make_request, bot, method))
+        self._deleting[key] = task
+
+        def release(_: Any) -> None:
+            if self._deleting.get(key) is task:
+                del self._deleting[key]
+
+        task.add_done_callback(release)
+        return await asyncio.shield(task)
+
+    async def _delete_many_once(
+        self, make_request: NextRequestMiddlewareType[Any], bot: Bot, method: DeleteMessages
+    ) -> Any:
+        pending = [self._deleting[(method.chat_id, mid)] for mid in method.message_ids if (method.chat_id, mid) in self._deleting]
+        fresh = [mid for mid in dict.fromkeys(method.message_ids) if (method.chat_id, mid) not in self._deleting]
+        self.stats["deduplicated"] += len(method.message_ids) - len(fresh)
+        if fresh:
+            if len(fresh) != len(method.message_ids):
+                method = DeleteMessages(chat_id=method.chat_id, message_ids=fresh)
+            task = asyncio.ensure_future(self._send(make_request, bot, method))
+            keys = [(method.chat_id, mid) for mid in fresh]
+            for key in keys:
+                self._deleting[key] = task
+
+            def release(_: Any) -> None:
+                for key in keys:
+                    if self._deleting.get(key) is task:
+                        del self._deleting[key]
+
+            task.add_done_callback(release)
+            pending.append(task)
+        results = await asyncio.gather(*(asyncio.shield(p) for p in pending))
+        return all(bool(r) for r in results)
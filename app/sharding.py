@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Generic, Hashable, Iterable, List, Tuple, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Консистентное хеширование: ключ → узел. У каждого узла `replicas`
+    виртуальных точек на кольце, так что при изменении числа узлов
+    переезжает только ~1/N ключей, а не почти все, как при `key % N`."""
+
+    def __init__(self, nodes: Iterable[Hashable], replicas: int = 64):
+        self.nodes = list(nodes)
+        if not self.nodes:
+            raise ValueError("HashRing: нужен хотя бы один узел")
+        points: List[Tuple[int, Hashable]] = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._points = [p for p, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: Any) -> Hashable:
+        i = bisect.bisect(self._points, _hash(str(key)))
+        return self._owners[i % len(self._owners)]
+
+
+def shard_key(update: Dict[str, Any]) -> int:
+    """chat_id сырого апдейта Bot API (для callback_query — чат сообщения с кнопкой,
+    как у FSM-ключа aiogram); если чата нет — id пользователя."""
+    for name, event in update.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return int(chat["id"])
+        user = event.get("from") or event.get("user")
+        if user:
+            return int(user["id"])
+    return 0
+
+
+class ChatLanes(Generic[T]):
+    """Апдейты одного чата обрабатываются строго по очереди, разных чатов —
+    параллельно, но не больше `concurrency` одновременно."""
+
+    def __init__(self, handle: Callable[[T], Awaitable[None]], concurrency: int = 32):
+        self._handle = handle
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._lanes: Dict[int, Deque[T]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def submit(self, chat_id: int, item: T) -> None:
+        lane = self._lanes.get(chat_id)
+        if lane is not None:
+            lane.append(item)
+            return
+        self._lanes[chat_id] = deque([item])
+        task = asyncio.create_task(self._drain(chat_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, chat_id: int) -> None:
+        lane = self._lanes[chat_id]
+        try:
+            while lane:
+                item = lane.popleft()
+                async with self._slots:
+                    try:
+                        await self._handle(item)
+                    except Exception as e:
+                        logger.exception(f"Ошибка обработки апдейта чата {chat_id}: {e}")
+        finally:
+            del self._lanes[chat_id]
+
+    async def join(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from . import db
+from .constants import COLUMNS
+from .google_sheets import Sheets
+
+
+@dataclass
+class SyncResult:
+    added: List[int] = field(default_factory=list)
+    changed: List[int] = field(default_factory=list)
+    removed: List[int] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+def _row_hash(row: List[str]) -> str:
+    return hashlib.blake2b(json.dumps(row, ensure_ascii=False).encode(), digest_size=12).hexdigest()
+
+
+def _iso_day(row: List[str]) -> Optional[str]:
+    """date_fixed (дд.мм.гггг) → гггг-мм-дд для запросов по диапазону дат."""
+    i = COLUMNS["date_fixed"]
+    if len(row) <= i:
+        return None
+    try:
+        return datetime.strptime(row[i].strip(), "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        return None
+
+
+class SheetMirror:
+    """Локальная копия листа в таблице sheet_rows excelbot.db.
+
+    sync() сначала проверяет время изменения таблицы (Drive metadata) и,
+    если оно сдвинулось, одним запросом читает строки начиная с
+    `edit_window` последних уже известных — так подтягиваются новые строки
+    и правки недавних. Раз в `full_every` синхронизаций с изменениями лист сверяется
+    целиком, чтобы поймать правки старых строк. Номера строк — как в листе
+    (1-based, включая заголовок).
+    """
+
+    def __init__(self, sheets: Sheets, edit_window: int = 200, full_every: int = 48, path: Optional[str] = None):
+        self.sheets = sheets
+        self.edit_window = max(0, edit_window)
+        self.full_every = max(1, full_every)
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[SyncResult], Awaitable[None]]] = []
+        self._syncs = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = db.connect(self._path)
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS sheet_rows (
+                    row_index INTEGER PRIMARY KEY,
+                    row TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    day TEXT,
+                    synced_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sheet_rows_day ON sheet_rows (day);
+                CREATE TABLE IF NOT EXISTS sheet_sync (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                """
+            )
+        return self._conn
+
+    # --- состояние синхронизации ---
+    def _meta(self, key: str, default: str = "") -> str:
+        row = self.conn.execute("SELECT value FROM sheet_sync WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO sheet_sync (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def last_row(self) -> int:
+        return int(self._meta("last_row", "0"))
+
+    def subscribe(self, callback: Callable[[SyncResult], Awaitable[None]]) -> None:
+        """callback(result) вызывается после каждой синхронизации, нашедшей изменения."""
+        self._listeners.append(callback)
+
+    async def sync(self, full: bool = False) -> SyncResult:
+        async with self._lock:
+            result = await self._sync(full)
+        if result:
+            for callback in self._listeners:
+                try:
+                    await callback(result)
+                except Exception as e:
+                    logger.exception(e)
+        return result
+
+    async def _sync(self, full: bool) -> SyncResult:
+        force = full or self.last_row == 0
+        modified = await asyncio.to_thread(self.sheets.last_update_time)
+        if not force and modified == self._meta("modified"):
+            return SyncResult()
+        self._syncs += 1
+        full = force or self._syncs % self.full_every == 0
+
+        last_row = self.last_row
+        start = 1 if full else max(1, last_row - self.edit_window + 1)
+        fetched = await asyncio.to_thread(self.sheets.rows, start)
+        end = start + len(fetched) - 1
+
+        known = dict(
+            self.conn.execute(
+                "SELECT row_index, hash FROM sheet_rows WHERE row_index >= ?", (start,)
+            ).fetchall()
+        )
+        result = SyncResult()
+        now = time.time()
+        upserts: List[Tuple[int, str, str, Optional[str], float]] = []
+        for offset, row in enumerate(fetched):
+            row_index = start + offset
+            h = _row_hash(row)
+            old = known.get(row_index)
+            if old == h:
+                continue
+            (result.changed if old is not None else result.added).append(row_index)
+            upserts.append((row_index, json.dumps(row, ensure_ascii=False), h, _iso_day(row), now))
+        result.removed = sorted(i for i in known if i > end)
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sheet_rows (row_index, row, hash, day, synced_at) VALUES (?, ?, ?, ?, ?)",
+                upserts,
+            )
+            if result.removed:
+                self.conn.execute("DELETE FROM sheet_rows WHERE row_index > ?", (end,))
+            self._set_meta("last_row", str(max(end, 0)))
+            self._set_meta("modified", modified)
+        if result:
+            logger.info(
+                f"Зеркало листа: +{len(result.added)} ~{len(result.changed)} -{len(result.removed)} "
+                f"(прочитано {len(fetched)} строк с {start})"
+            )
+        return result
+
+    async def run(self, interval: float) -> None:
+        """Фоновая синхронизация каждые `interval` секунд."""
+        await self.sheets.ready.wait()
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"Зеркало листа: ошибка синхронизации: {e}")
+            await asyncio.sleep(interval)
+
+    # --- запросы к зеркалу (без обращения к Google) ---
+    def count(self) -> int:
+        (n,) = self.conn.execute("SELECT COUNT(*) FROM sheet_rows").fetchone()
+        return int(n)
+
+    def get(self, row_index: int) -> Optional[List[str]]:
+        row = self.conn.execute("SELECT row FROM sheet_rows WHERE row_index = ?", (row_index,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def rows(self, start: int = 1, end: Optional[int] = None) -> Iterator[Tuple[int, List[str]]]:
+        sql = "SELECT row_index, row FROM sheet_rows WHERE row_index >= ?"
+        args: list = [start]
+        if end is not None:
+            sql += " AND row_index <= ?"
+            args.append(end)
+        for row_index, row in self.conn.execute(sql + " ORDER BY row_index", args):
+            yield row_index, json.loads(row)
+
+    def deals(
+        self, date_from: Optional[str] = None, date_to: Optional[str] = None, **equals: str
+    ) -> Iterator[Tuple[int, List[str]]]:
+        """Строки-заявки (с корректной date_fixed) за период [date_from, date_to] (ISO-даты),
+        с фильтром по значениям колонок: deals(currency_in="USD", name="Иван")."""
+        sql = "SELECT row_index, row FROM sheet_rows WHERE day IS NOT NULL"
+        args: list = []
+        if date_from:
+            sql += " AND day >= ?"
+            args.append(date_from)
+        if date_to:
+            sql += " AND day <= ?"
+            args.append(date_to)
+        for name, value in equals.items():
+            sql += f" AND json_extract(row, '$[{COLUMNS[name]}]') = ?"
+            args.append(value)
+        for row_index, row in self.conn.execute(sql + " ORDER BY row_index", args):
+            yield row_index, json.loads(row)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,37 +1,169 @@
 from __future__ import annotations
-from typing import Any, Dict, Optional
+
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
 from loguru import logger
 
+from . import db
+
+# (state, data) одной записи
+_Entry = Tuple[Optional[str], Dict[str, Any]]
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else ""
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram в таблице fsm_state excelbot.db (WAL).
+
+    Горячие записи живут в LRU в памяти (до `max_items`), записи на диск
+    копятся и раз в `flush_interval` сбрасываются одной транзакцией в фоновом
+    потоке — шаг заявки не ждёт диска. Незаписанные записи из памяти не
+    вытесняются. Пустые состояния (после clear) из таблицы удаляются, так что
+    она не растёт с каждым пользователем, когда-либо начавшим заявку.
+
+    Ключи с непустым состоянием дополнительно держатся множеством в памяти
+    (все, не только горячие): has_state() отвечает без обращения к SQLite.
+    """
+
+    def __init__(self, max_items: int = 10000, flush_interval: float = 0.5, path: Optional[str] = None):
+        self.max_items = max(1, max_items)
+        self.flush_interval = flush_interval
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self._hot: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty: set[str] = set()
+        self._active: set[str] = set()  # ключи с состоянием; заполняется при открытии базы
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = db.connect(self._path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fsm_state (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '',
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.commit()
+            self._active = {k for (k,) in self._conn.execute("SELECT key FROM fsm_state WHERE state IS NOT NULL")}
+        return self._conn
+
+    def _entry(self, key: StorageKey) -> Tuple[str, _Entry]:
+        k = self._key_builder.build(key)
+        entry = self._hot.get(k)
+        if entry is None:
+            row = self.conn.execute("SELECT state, data FROM fsm_state WHERE key = ?", (k,)).fetchone()
+            entry = (row[0], json.loads(row[1]) if row and row[1] else {}) if row else (None, {})
+            self._hot[k] = entry
+            self._evict(keep=k)
+        else:
+            self._hot.move_to_end(k)
+        return k, entry
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        if len(self._hot) <= self.max_items:
+            return
+        for k in list(self._hot):
+            if len(self._hot) <= self.max_items:
+                break
+            if k not in self._dirty and k != keep:
+                del self._hot[k]
+
+    def _put(self, k: str, entry: _Entry) -> None:
+        if entry[0] is None:
+            self._active.discard(k)
+        else:
+            self._active.add(k)
+        self._hot[k] = entry
+        self._hot.move_to_end(k)
+        self._dirty.add(k)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k, (_, data) = self._entry(key)
+        self._put(k, (state.state if isinstance(state, State) else state, data))
+
+    def has_state(self, key: StorageKey) -> bool:
+        """Есть ли у ключа состояние FSM (по множеству в памяти, без чтения записи)."""
+        if self._conn is None:
+            _ = self.conn  # первое обращение: открыть базу и загрузить ключи с состоянием
+        return self._key_builder.build(key) in self._active
 
-class Storage:
-    """Простое in-memory хранилище данных между шагами заявки."""
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._entry(key)[1][0]
 
-    def __init__(self):
-        # {user_id: {"step": str, "data": dict}}
-        self._sessions: Dict[int, Dict[str, Any]] = {}
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k, (state, _) = self._entry(key)
+        self._put(k, (state, dict(data)))
 
-    def start(self, user_id: int):
-        self._sessions[user_id] = {"step": None, "data": {}}
-        logger.debug(f"Начата новая сессия для {user_id}")
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self._entry(key)[1][1])
 
-    def set_step(self, user_id: int, step: str):
-        if user_id in self._sessions:
-            self._sessions[user_id]["step"] = step
-            logger.debug(f"[{user_id}] шаг -> {step}")
+    async def set_state_data(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        """Состояние и данные одной записью (StateSession.flush, когда изменилось и то, и другое)."""
+        k = self._key_builder.build(key)
+        self._put(k, (state.state if isinstance(state, State) else state, dict(data)))
+        self._evict(keep=k)
 
-    def get_step(self, user_id: int) -> Optional[str]:
-        return self._sessions.get(user_id, {}).get("step")
+    # --- запись на диск ---
+    def _write(self, batch: List[Tuple[str, Optional[str], str]]) -> None:
+        if self._write_conn is None:
+            self._write_conn = db.connect(self._path)
+        now = time.time()
+        with self._write_conn:
+            self._write_conn.executemany(
+                "DELETE FROM fsm_state WHERE key = ?", [(k,) for k, state, data in batch if state is None and not data]
+            )
+            self._write_conn.executemany(
+                "INSERT OR REPLACE INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                [(k, state, data, now) for k, state, data in batch if state is not None or data],
+            )
 
-    def set_data(self, user_id: int, key: str, value: Any):
-        if user_id not in self._sessions:
-            self.start(user_id)
-        self._sessions[user_id]["data"][key] = value
-        logger.debug(f"[{user_id}] {key} = {value}")
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            keys, self._dirty = self._dirty, set()
+            batch = [(k, self._hot[k][0], _dumps(self._hot[k][1])) for k in keys if k in self._hot]
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                self._dirty |= keys  # повторим при следующем сбросе
+                raise
+            self._evict()
+            return len(batch)
 
-    def get_data(self, user_id: int) -> Dict[str, Any]:
-        return self._sessions.get(user_id, {}).get("data", {})
+    async def _flush_loop(self) -> None:
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"FSM: не удалось сохранить состояния: {e}")
 
-    def clear(self, user_id: int):
-        if user_id in self._sessions:
-            del self._sessions[user_id]
-            logger.debug(f"[{user_id}] сессия очищена")
\ No newline at end of file
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await self.flush()
+        for conn in (self._conn, self._write_conn):
+            if conn is not None:
+                conn.close()
+        self._conn = self._write_conn = None
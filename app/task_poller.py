@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import asyncio
+import html
+import json
+import sqlite3
+from typing import List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from loguru import logger
+
+from . import db
+from .constants import COLUMNS
+from .send_scheduler import Priority, send_priority
+from .sheet_mirror import SheetMirror, SyncResult
+
+_FROM_ROW_KEY = "poller_from_row"
+
+
+def _cell(row: List[str], name: str) -> str:
+    i = COLUMNS[name]
+    return row[i].strip() if len(row) > i and row[i] else ""
+
+
+def format_task(row_index: int, row: List[str]) -> str:
+    """Текст сообщения о строке листа для группы."""
+    e = lambda name: html.escape(_cell(row, name))  # noqa: E731
+    lines = [
+        f"📌 <b>Заявка, строка {row_index}</b> — {e('date_fixed')}",
+        f"👤 {e('name')}",
+        f"⬇️ Получил: {e('amount_in')} {e('currency_in')}",
+        f"⬆️ Отдал: {e('amount_out')} {e('currency_out')}",
+    ]
+    if _cell(row, "commission"):
+        lines.append(f"💱 Комиссия: {e('commission')}%")
+    if _cell(row, "profit_eur"):
+        lines.append(f"💶 Прибыль: {e('profit_eur')} EUR")
+    if _cell(row, "comment"):
+        lines.append(f"📝 {e('comment')}")
+    return "\n".join(lines)
+
+
+class TaskPoller:
+    """Публикует новые строки листа в группу и правит уже опубликованные.
+
+    Лист не перечитывается: каждые `interval` секунд вызывается
+    SheetMirror.sync() (только новые и недавно правленные строки), а номера
+    добавленных/изменённых строк приходят подпиской на результат синхронизации.
+    За цикл отправляется не больше `batch_size` сообщений (с фоновым
+    приоритетом SendScheduler, после ответов пользователям). Какое сообщение
+    соответствует строке и с каким содержимым оно отправлено, хранится в
+    posted_tasks. Строки, которые были в листе до первого запуска, не
+    публикуются, но уже опубликованные сообщения (в т.ч. до обновления бота)
+    правятся при любом номере строки.
+    """
+
+    def __init__(self, mirror: SheetMirror, bot: Bot, chat_id: int, batch_size: int = 20, path: Optional[str] = None):
+        self.mirror = mirror
+        self.bot = bot
+        self.chat_id = chat_id
+        self.batch_size = max(1, batch_size)
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Set[int] = set()
+        self._from_row = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = db.connect(self._path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS posted_tasks (
+                    row_index INTEGER PRIMARY KEY,
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL
+                )
+                """
+            )
+            columns = {r[1] for r in self._conn.execute("PRAGMA table_info(posted_tasks)")}
+            if "hash" not in columns:  # хэш строки, с которым отправлено сообщение
+                self._conn.execute("ALTER TABLE posted_tasks ADD COLUMN hash TEXT")
+            self._conn.commit()
+        return self._conn
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # --- что публиковать ---
+    def _start(self) -> None:
+        """После первой синхронизации: граница «старых» строк и добор неопубликованного после перезапуска."""
+        conn = self.conn
+        row = conn.execute("SELECT value FROM sheet_sync WHERE key = ?", (_FROM_ROW_KEY,)).fetchone()
+        if row is None:
+            self._from_row = max(2, self.mirror.last_row + 1)  # строка 1 — заголовок
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sheet_sync (key, value) VALUES (?, ?)", (_FROM_ROW_KEY, str(self._from_row))
+                )
+        else:
+            self._from_row = int(row[0])
+        missing = conn.execute(
+            """
+            SELECT r.row_index FROM sheet_rows r LEFT JOIN posted_tasks p ON p.row_index = r.row_index
+            WHERE (p.row_index IS NULL AND r.row_index >= ?) OR (p.row_index IS NOT NULL AND p.hash IS NOT r.hash)
+            """,
+            (self._from_row,),
+        ).fetchall()
+        self._pending.update(i for (i,) in missing)
+
+    def _posted(self, rows: List[int]) -> Set[int]:
+        found = self.conn.execute(
+            "SELECT row_index FROM posted_tasks WHERE row_index IN (SELECT value FROM json_each(?))", (json.dumps(rows),)
+        ).fetchall()
+        return {i for (i,) in found}
+
+    async def _on_sync(self, result: SyncResult) -> None:
+        # граница _from_row — только для новых сообщений: уже опубликованные строки правятся всегда
+        touched = result.added + result.changed
+        old = [i for i in touched if i < self._from_row]
+        self._pending.update(i for i in touched if i >= self._from_row)
+        if old:
+            self._pending.update(self._posted(old))
+        if result.removed:
+            self._pending.difference_update(result.removed)
+            with self.conn:
+                self.conn.executemany("DELETE FROM posted_tasks WHERE row_index = ?", [(i,) for i in result.removed])
+
+    # --- публикация ---
+    async def _send(self, row_index: int, text: str, row_hash: str) -> None:
+        sent = await self.bot.send_message(self.chat_id, text)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO posted_tasks (row_index, chat_id, message_id, hash) VALUES (?, ?, ?, ?)",
+                (row_index, self.chat_id, sent.message_id, row_hash),
+            )
+
+    async def _publish_one(self, row_index: int) -> None:
+        found = self.conn.execute(
+            """
+            SELECT r.row, r.hash, p.chat_id, p.message_id, p.hash
+            FROM sheet_rows r LEFT JOIN posted_tasks p ON p.row_index = r.row_index
+            WHERE r.row_index = ?
+            """,
+            (row_index,),
+        ).fetchone()
+        if found is None:
+            return  # строку уже удалили из листа
+        row_json, row_hash, chat_id, message_id, posted_hash = found
+        if posted_hash == row_hash:
+            return
+        if message_id is None and row_index < self._from_row:
+            return  # строка была в листе до первого запуска — не публикуется
+        text = format_task(row_index, json.loads(row_json))
+        if message_id is None:
+            await self._send(row_index, text, row_hash)
+            return
+        try:
+            await self.bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id)
+        except TelegramBadRequest as e:
+            if "not modified" not in e.message:
+                logger.info(f"Задача строки {row_index}: сообщение {message_id} не изменить ({e.message}), отправляем заново")
+                await self._send(row_index, text, row_hash)
+                return
+        with self.conn:
+            self.conn.execute("UPDATE posted_tasks SET hash = ? WHERE row_index = ?", (row_hash, row_index))
+
+    async def publish(self) -> int:
+        """Отправляет/правит до `batch_size` строк; остальные — в следующем цикле."""
+        batch = sorted(self._pending)[: self.batch_size]
+        done = 0
+        with send_priority(Priority.BACKGROUND):
+            for row_index in batch:
+                try:
+                    await self._publish_one(row_index)
+                except Exception as e:
+                    logger.warning(f"Задача строки {row_index} не опубликована: {e}")
+                    continue
+                self._pending.discard(row_index)
+                done += 1
+        if self._pending:
+            logger.info(f"Задачи: опубликовано {done}, ждут следующего цикла {len(self._pending)}")
+        return done
+
+    async def run(self, interval: float) -> None:
+        await self.mirror.sheets.ready.wait()
+        started = False
+        while True:
+            try:
+                await self.mirror.sync()
+                if not started:
+                    self._start()
+                    self.mirror.subscribe(self._on_sync)
+                    started = True
+                await self.publish()
+            except Exception as e:
+                logger.warning(f"Задачи: ошибка цикла: {e}")
+            await asyncio.sleep(interval)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+from datetime import date, datetime
+
+DAY_FORMATS = ("%d.%m.%Y", "%Y-%m-%d", "%d.%m.%y")
+
+
+def parse_day(text: str) -> date:
+    """Дата как в листе (дд.мм.гггг) или ISO (гггг-мм-дд); время после пробела отбрасывается."""
+    value = (text or "").strip().split(" ")[0]
+    for fmt in DAY_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"дата «{text}» не в формате ДД.ММ.ГГГГ")
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import signal
+from typing import Any, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from loguru import logger
+
+from .config import settings
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Webhook-обработчик: сразу отвечает Telegram 200 и обрабатывает апдейт в фоне,
+    не больше `concurrency` хендлеров одновременно. При остановке новые запросы
+    получают 503 (Telegram повторит их позже), а начатые дорабатываются до конца
+    (не дольше `drain_timeout`). С `route` апдейт не обрабатывается здесь, а
+    передаётся дальше как есть (процессам-воркерам, см. app.workers)."""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        concurrency: int,
+        secret_token: Optional[str] = None,
+        drain_timeout: float = 30.0,
+        route: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **data: Any,
+    ) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, secret_token=secret_token, **data)
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self.route = route
+        self.drain_timeout = drain_timeout
+        self._closing = False
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._slots:
+            await super()._background_feed_update(bot, update)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._closing:
+            return web.Response(status=503, text="shutting down")
+        if self.route is None:
+            return await super().handle(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.bot):
+            return web.Response(body="Unauthorized", status=401)
+        self.route(await request.json(loads=self.bot.session.json_loads))
+        return web.json_response({}, dumps=self.bot.session.json_dumps)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self) -> None:
+        self._closing = True
+        pending = set(self._background_feed_update_tasks)
+        if not pending:
+            return
+        logger.info(f"Webhook: дожидаемся {len(pending)} апдейтов в обработке...")
+        _, not_done = await asyncio.wait(pending, timeout=self.drain_timeout)
+        if not_done:
+            logger.warning(f"Webhook: {len(not_done)} апдейтов не успели обработаться за {self.drain_timeout} с")
+
+    async def close(self) -> None:
+        await self.drain()
+        await super().close()
+
+
+def install_stop_signals(stop: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows / не главный поток
+
+
+def build_app(
+    dp: Dispatcher, bot: Bot, route: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> tuple[web.Application, BoundedRequestHandler]:
+    app = web.Application()
+    handler = BoundedRequestHandler(
+        dp,
+        bot,
+        concurrency=settings.webhook_concurrency,
+        secret_token=settings.webhook_secret or None,
+        drain_timeout=settings.webhook_drain_sec,
+        route=route,
+    )
+    handler.register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+    return app, handler
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    stop: Optional[asyncio.Event] = None,
+    route: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> None:
+    """Встроенный aiohttp-сервер для апдейтов вместо long polling; работает до SIGINT/SIGTERM или `stop`."""
+    stop = stop or asyncio.Event()
+    install_stop_signals(stop)
+
+    app, _ = build_app(dp, bot, route=route)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {settings.webhook_host}:{settings.webhook_port}{settings.webhook_path}")
+    try:
+        if settings.webhook_base_url:
+            await bot.set_webhook(
+                url=settings.webhook_base_url.rstrip("/") + settings.webhook_path,
+                secret_token=settings.webhook_secret or None,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(100, max(1, settings.webhook_concurrency)),
+            )
+        await stop.wait()
+    finally:
+        # останавливает приём, затем on_shutdown: дренаж апдейтов и остановка диспетчера
+        await runner.cleanup()
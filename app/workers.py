@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing as mp
+import signal
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from loguru import logger
+
+from . import metrics
+from .config import settings
+from .outbox import Outbox
+from .sharding import ChatLanes, HashRing, shard_key
+from .webhook import install_stop_signals, run_webhook
+
+Update = Dict[str, Any]
+
+
+# ===== Процесс-воркер =====
+async def _serve(index: int, inbox: "mp.Queue", acks: "mp.Queue") -> None:
+    from . import rates
+    from .bot import bot, dp, fsm_storage, outbox, sheets
+
+    await rates.open_client()
+    background = [asyncio.create_task(sheets.start()), asyncio.create_task(rates.warm_cache())]
+    metrics_runner = None
+    if metrics.enabled:  # у каждого воркера свой порт: METRICS_PORT + 1 + номер
+        metrics_runner = await metrics.start_server(settings.metrics_port + 1 + index)
+        background.append(asyncio.create_task(metrics.watch_loop_lag()))
+    await dp.emit_startup(bot=bot)
+
+    done: List[int] = []
+    enqueued = outbox.enqueued
+
+    async def handle(update: Update) -> None:
+        try:
+            await dp.feed_raw_update(bot, update)
+        finally:
+            done.append(update["update_id"])
+
+    async def ack() -> None:
+        # подтверждаем только то, чьё FSM-состояние уже на диске: после падения
+        # воркера неподтверждённые апдейты обработает его замена
+        nonlocal done, enqueued
+        if not done:
+            return
+        batch, done = done, []
+        try:
+            await fsm_storage.flush()
+        except Exception:
+            done = batch + done
+            raise
+        acks.put((batch, outbox.enqueued != enqueued))
+        enqueued = outbox.enqueued
+
+    async def ack_loop() -> None:
+        while True:
+            await asyncio.sleep(max(0.05, settings.fsm_flush_sec))
+            try:
+                await ack()
+            except Exception as e:
+                logger.warning(f"Воркер {index}: не удалось сохранить состояния: {e}")
+
+    lanes: ChatLanes[Update] = ChatLanes(handle, concurrency=settings.worker_concurrency)
+    acker = asyncio.create_task(ack_loop())
+    loop = asyncio.get_running_loop()
+    logger.info(f"Воркер {index} запущен")
+    try:
+        while True:
+            update = await loop.run_in_executor(None, inbox.get)
+            if update is None:
+                break
+            lanes.submit(shard_key(update), update)
+        await lanes.join()
+    finally:
+        acker.cancel()
+        await ack()
+        for task in background:
+            task.cancel()
+        await dp.emit_shutdown(bot=bot)
+        await rates.close_client()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+        logger.info(f"Воркер {index} остановлен")
+
+
+def worker_main(index: int, inbox: "mp.Queue", acks: "mp.Queue") -> None:
+    # Ctrl+C и SIGTERM получает вся группа процессов; останавливает воркеры фронт
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_serve(index, inbox, acks))
+
+
+# ===== Фронт =====
+class _Slot:
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[mp.process.BaseProcess] = None
+        self.inbox: Optional["mp.Queue"] = None
+        self.acks: Optional["mp.Queue"] = None
+        # отправленные воркеру и ещё не подтверждённые апдейты, в порядке отправки
+        self.pending: "OrderedDict[int, Update]" = OrderedDict()
+        self.restarts = 0
+
+
+class ShardedFront:
+    """Фронт-процесс: получает апдейты (polling или webhook) и раздаёт их
+    `workers` процессам по консистентному хешу chat_id. Чат всегда попадает в
+    один и тот же воркер — его FSM и кэш курсов остаются локальными, а
+    апдейты чата обрабатываются по порядку. Упавший воркер перезапускается и
+    получает заново все неподтверждённые апдейты. Outbox, зеркало листа и
+    прочие фоновые задачи работают только во фронте (см. run.py)."""
+
+    worker_target: Callable[[int, "mp.Queue", "mp.Queue"], None] = staticmethod(worker_main)
+
+    def __init__(self, workers: int, outbox: Optional[Outbox] = None, max_pending: int = 10000):
+        self._ctx = mp.get_context("spawn")
+        self.ring = HashRing(range(workers))
+        self.slots = [_Slot(i) for i in range(workers)]
+        self.outbox = outbox
+        self.max_pending = max_pending
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def backlog(self) -> int:
+        return sum(len(slot.pending) for slot in self.slots)
+
+    def route(self, update: Update) -> None:
+        slot = self.slots[self.ring.node_for(shard_key(update))]
+        slot.pending[update["update_id"]] = update
+        slot.inbox.put(update)
+
+    # --- жизненный цикл воркеров ---
+    def _spawn(self, slot: _Slot) -> None:
+        slot.inbox, slot.acks = self._ctx.Queue(), self._ctx.Queue()
+        slot.process = self._ctx.Process(
+            target=self.worker_target,
+            args=(slot.index, slot.inbox, slot.acks),
+            name=f"excelbot-worker-{slot.index}",
+            daemon=True,
+        )
+        slot.process.start()
+        for update in slot.pending.values():
+            slot.inbox.put(update)
+        threading.Thread(target=self._read_acks, args=(slot, slot.acks), daemon=True).start()
+
+    def _read_acks(self, slot: _Slot, acks: "mp.Queue") -> None:
+        while True:
+            try:
+                msg = acks.get()
+            except Exception as e:  # воркер упал посреди записи
+                logger.warning(f"Воркер {slot.index}: канал подтверждений повреждён: {e}")
+                return
+            if msg is None:
+                acks.close()
+                return
+            try:
+                self._loop.call_soon_threadsafe(self._on_ack, slot, *msg)
+            except RuntimeError:  # цикл событий фронта уже закрыт
+                return
+
+    def _on_ack(self, slot: _Slot, ids: List[int], enqueued: bool) -> None:
+        for update_id in ids:
+            slot.pending.pop(update_id, None)
+        if enqueued and self.outbox is not None:
+            self.outbox.wake()
+
+    @staticmethod
+    def _retire(slot: _Slot) -> None:
+        # очереди упавшего процесса могут быть повреждены — у замены будут новые;
+        # канал подтверждений закроет сам поток чтения, дочитав его до None
+        slot.acks.put(None)
+        slot.inbox.cancel_join_thread()
+        slot.inbox.close()
+
+    async def _supervise(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            for slot in self.slots:
+                if slot.process.is_alive():
+                    continue
+                slot.restarts += 1
+                logger.warning(
+                    f"Воркер {slot.index} завершился (код {slot.process.exitcode}), перезапуск #{slot.restarts}, "
+                    f"повторно отправим апдейтов: {len(slot.pending)}"
+                )
+                self._retire(slot)
+                self._spawn(slot)
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        for slot in self.slots:
+            slot.inbox.put(None)  # воркер дообработает очередь и выйдет
+        for slot in self.slots:
+            await asyncio.to_thread(slot.process.join, timeout)
+            if slot.process.is_alive():
+                logger.warning(f"Воркер {slot.index} не остановился за {timeout} с, завершаем принудительно")
+                slot.process.terminate()
+            await asyncio.to_thread(slot.process.join, 5)
+            # даём потоку чтения забрать последние подтверждения
+            self._retire(slot)
+        await asyncio.sleep(0)
+
+    # --- получение апдейтов ---
+    async def _poll(self, bot: Bot, allowed_updates: List[str]) -> None:
+        offset: Optional[int] = None
+        backoff = 1.0
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.warning(f"getUpdates: {e}; повтор через {backoff:.0f} с")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = 1.0
+            for update in updates:
+                offset = update.update_id + 1
+                self.route(update.model_dump(mode="json", by_alias=True, exclude_unset=True))
+            while self.backlog() > self.max_pending:
+                await asyncio.sleep(0.05)  # воркеры не успевают — не забираем новые апдейты
+
+    async def run(self, bot: Bot, dp: Dispatcher, stop: Optional[asyncio.Event] = None) -> None:
+        self._loop = asyncio.get_running_loop()
+        for slot in self.slots:
+            self._spawn(slot)
+        supervisor = asyncio.create_task(self._supervise())
+        logger.info(f"Запущено воркеров: {len(self.slots)}")
+        try:
+            if settings.run_mode == "webhook":
+                await run_webhook(dp, bot, stop=stop, route=self.route)
+            else:
+                stop = stop or asyncio.Event()
+                install_stop_signals(stop)
+                poller = asyncio.create_task(self._poll(bot, dp.resolve_used_update_types()))
+                waiter = asyncio.create_task(stop.wait())
+                try:
+                    await asyncio.wait([poller, waiter], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    poller.cancel()
+                    waiter.cancel()
+                if poller.done() and not poller.cancelled() and poller.exception():
+                    raise poller.exception()
+        finally:
+            supervisor.cancel()
+            await self.stop(timeout=settings.webhook_drain_sec)
@@ -0,0 +1,95 @@
+"""Per-message dispatch cost of group chatter that is not meant for the bot.
+
+Feeds `--messages` ordinary group messages from `--users` members of
+`--chats` chats (no command, no trigger word, nobody inside a deal dialog)
+through the real dispatcher of app.bot, twice:
+
+  filter  ChatterFilterMiddleware in front of FSM: dropped before the
+          storage is touched
+  none    the filter unregistered: FSM reads the state (SQLite on the first
+          message of every user) and every message filter runs
+
+Prints microseconds per message and FSM storage reads per run.
+
+    python benchmarks/bench_dispatch.py [--messages 50000] [--users 5000] [--chats 20]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+os.environ.setdefault("BOT_TOKEN", "42:bench")
+os.environ.setdefault("SPREADSHEET_ID", "bench")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="excelbot-dispatch-"), "bench.db")
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from loguru import logger  # noqa: E402
+
+import app.bot as bot_module  # noqa: E402
+from app.middlewares import ChatterFilterMiddleware  # noqa: E402
+from fakes import FakeTelegramSession, message_update  # noqa: E402
+
+WORDS = "курс сколько usdt привет ок фиксим завтра отдам рублей евро по чём есть наличные где встречаемся".split()
+
+
+def chatter(args: argparse.Namespace, seed: int) -> list:
+    rnd = random.Random(seed)
+    return [
+        message_update(
+            chat_id=-1000 - rnd.randrange(args.chats),
+            user_id=10_000 + rnd.randrange(args.users) + seed * args.users,  # new users each run: cold FSM keys
+            text=" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 12))),
+        )
+        for _ in range(args.messages)
+    ]
+
+
+async def run(updates: list) -> tuple[float, int]:
+    storage = bot_module.fsm_storage
+    reads = {"n": 0}
+    get_state = storage.get_state
+
+    async def counted(key):  # type: ignore[no-untyped-def]
+        reads["n"] += 1
+        return await get_state(key)
+
+    storage.get_state = counted  # type: ignore[method-assign]
+    try:
+        t = time.perf_counter()
+        for update in updates:
+            await bot_module.dp.feed_update(bot_module.bot, update)
+        return time.perf_counter() - t, reads["n"]
+    finally:
+        del storage.get_state
+
+
+async def main(args: argparse.Namespace) -> None:
+    logger.remove()
+    session = FakeTelegramSession()
+    bot_module.bot.session = session
+    outer = bot_module.dp.update.outer_middleware
+    chatter_filter = next(m for m in outer if isinstance(m, ChatterFilterMiddleware))
+
+    t_filter, reads_filter = await run(chatter(args, seed=1))
+    outer.unregister(chatter_filter)
+    t_none, reads_none = await run(chatter(args, seed=2))
+
+    print(f"{args.messages} messages, {args.users} users, {args.chats} chats; bot API calls: {len(session.calls)}")
+    print(f"  filter {t_filter * 1e6 / args.messages:8.2f} us/message, storage reads {reads_filter}")
+    print(f"  none   {t_none * 1e6 / args.messages:8.2f} us/message, storage reads {reads_none}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--chats", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
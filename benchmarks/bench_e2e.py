@@ -0,0 +1,160 @@
+"""End-to-end load test: full DealForm flows through the real `dp` of app/bot.py.
+
+Telegram, gspread and the four rate provider APIs are replaced by the local
+fakes in benchmarks/fakes.py, each with its own latency and failure rate.
+`--chats` simulated group chats run `--deals` deals each, concurrently; every
+deal is the nine updates of a real flow (фикс → menu → currencies → amounts →
+commission → expenses → comment). The outbox worker writes the deals to the
+fake sheet as in production.
+
+Reported: deals/s and updates/s, p50/p99 latency of every step, event-loop
+lag (p50/p99/max) and how long the outbox needed to drain.
+
+    python benchmarks/bench_e2e.py [--chats 200] [--deals 3] [--tg-latency 0.03]
+        [--rates-latency 0.1] [--sheets-latency 0.3] [--tg-failures 0] [--rates-failures 0.1]
+        [--sheets-failures 0.1] [--cold-rates] [--scheduler]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+os.environ.setdefault("BOT_TOKEN", "42:bench")
+os.environ.setdefault("SPREADSHEET_ID", "bench")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="excelbot-e2e-"), "bench.db")
+if "--cold-rates" in sys.argv:
+    os.environ["RATES_LATEST_TTL_SEC"] = "0"  # every rate lookup goes to the providers
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from aiogram.types import Update  # noqa: E402
+from loguru import logger  # noqa: E402
+
+import app.bot as bot_module  # noqa: E402
+from app import rates  # noqa: E402
+from fakes import (  # noqa: E402
+    FakeTelegramSession,
+    FakeWorksheet,
+    RateStub,
+    attach_fake_sheet,
+    callback_update,
+    message_update,
+)
+
+STEPS: List[tuple[str, Callable[[int, int], Update]]] = [
+    ("fix", lambda c, u: message_update(c, u, "фикс")),
+    ("menu_new", lambda c, u: callback_update(c, u, "menu:new")),
+    ("currency_in", lambda c, u: callback_update(c, u, "cur_in:USD")),
+    ("amount_in", lambda c, u: message_update(c, u, "100")),
+    ("currency_out", lambda c, u: callback_update(c, u, "cur_out:RUB")),
+    ("amount_out", lambda c, u: message_update(c, u, "9000")),
+    ("commission", lambda c, u: message_update(c, u, "-")),
+    ("expenses", lambda c, u: message_update(c, u, "-")),
+    ("comment", lambda c, u: message_update(c, u, "bench")),
+]
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+async def _loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.01) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - t - interval))
+
+
+async def main(args: argparse.Namespace) -> None:
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    logging.getLogger("aiogram").setLevel(logging.CRITICAL)  # injected Telegram failures are counted below
+
+    session = FakeTelegramSession(latency=args.tg_latency, failure_rate=args.tg_failures)
+    if args.scheduler:
+        session.middleware(bot_module.send_scheduler)
+    bot_module.bot.session = session
+    ws = FakeWorksheet(latency=args.sheets_latency, failure_rate=args.sheets_failures)
+    attach_fake_sheet(bot_module.sheets, ws)
+    stub = RateStub(rates.RATE_CODES, latency=args.rates_latency, failure_rate=args.rates_failures)
+    await stub.start()
+    stub.patch(rates)
+    await rates.open_client()
+
+    step_latency: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lag: List[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_loop_lag(lag, stop))
+    outbox_task = asyncio.create_task(bot_module.outbox.run())
+
+    async def feed(name: str, update: Update) -> None:
+        t = time.perf_counter()
+        try:
+            await bot_module.dp.feed_update(bot_module.bot, update)
+        except Exception:
+            errors[name] += 1
+        step_latency[name].append(time.perf_counter() - t)
+
+    async def chat(chat_id: int) -> None:
+        user_id = -chat_id
+        for _ in range(args.deals):
+            for name, make in STEPS:
+                await feed(name, make(chat_id, user_id))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(chat(-1_000_000 - i) for i in range(args.chats)))
+    t_flows = time.perf_counter() - t0
+    while bot_module.outbox.depth():
+        await asyncio.sleep(0.05)
+    t_drained = time.perf_counter() - t0
+
+    stop.set()
+    bot_module.outbox.stop()
+    await asyncio.gather(lag_task, outbox_task)
+    await rates.close_client()
+    await stub.close()
+
+    deals = args.chats * args.deals
+    updates = deals * len(STEPS)
+    print(f"chats={args.chats} deals/chat={args.deals} tg={args.tg_latency * 1000:.0f}ms/{args.tg_failures:.0%} "
+          f"rates={args.rates_latency * 1000:.0f}ms/{args.rates_failures:.0%} "
+          f"sheets={args.sheets_latency * 1000:.0f}ms/{args.sheets_failures:.0%}"
+          f"{' cold-rates' if args.cold_rates else ''}{' scheduler' if args.scheduler else ''}")
+    print(f"  flows done    {t_flows:7.2f} s  {deals / t_flows:8.1f} deals/s  {updates / t_flows:8.1f} updates/s")
+    print(f"  outbox drained {t_drained:6.2f} s  rows in sheet {len(ws.values)} of {deals} deals, "
+          f"sheet writes {ws.writes}, injected failures {ws.failures}")
+    print(f"  {'step':<13} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, _ in STEPS:
+        print(f"  {name:<13} {_pct(step_latency[name], 0.5):8.2f} {_pct(step_latency[name], 0.99):8.2f} "
+              f"{errors[name]:7d}")
+    print(f"  loop lag      p50 {_pct(lag, 0.5):.2f} ms  p99 {_pct(lag, 0.99):.2f} ms  max {max(lag, default=0) * 1000:.2f} ms")
+    print(f"  rate API hits {dict(stub.hits)}  coalesced {rates.coalesced_calls()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--deals", type=int, default=3)
+    parser.add_argument("--tg-latency", type=float, default=0.03)
+    parser.add_argument("--tg-failures", type=float, default=0.0)
+    parser.add_argument("--rates-latency", type=float, default=0.1)
+    parser.add_argument("--rates-failures", type=float, default=0.1)
+    parser.add_argument("--sheets-latency", type=float, default=0.3)
+    parser.add_argument("--sheets-failures", type=float, default=0.1)
+    parser.add_argument("--cold-rates", action="store_true")
+    parser.add_argument("--scheduler", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,86 @@
+"""Lookup cost of "rate for day D or the closest earlier business day".
+
+Fills `--years` of daily rates (weekends left out, as the ECB publishes them)
+into both stores and resolves every calendar day of that span for every
+currency:
+
+  cache   the old path: RateCache probes (code, day) keys walking back day by
+          day, as `_lookup_rate` did before the series (in-memory LRU hits and
+          misses that fall through to SQLite)
+  series  RateSeries.at_or_before: a few reads of the typed arrays
+
+Also reports the series file size and how long re-opening it (mmap) takes.
+
+    python benchmarks/bench_rate_series.py [--years 5]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+os.environ.setdefault("BOT_TOKEN", "42:bench")
+os.environ.setdefault("SPREADSHEET_ID", "bench")
+TMP = tempfile.mkdtemp(prefix="excelbot-series-")
+os.environ["DB_PATH"] = os.path.join(TMP, "bench.db")
+sys.path.insert(0, str(ROOT))
+
+from app.rate_cache import RateCache  # noqa: E402
+from app.rate_series import RateSeries  # noqa: E402
+from app.rates import RATE_CODES  # noqa: E402
+
+
+def main(args: argparse.Namespace) -> None:
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=365 * args.years)
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    business = [d for d in days if d.weekday() < 5]
+
+    cache = RateCache(max_items=2048, max_rows=10**7, latest_ttl=3600, path=os.path.join(TMP, "cache.db"))
+    series = RateSeries(os.path.join(TMP, "bench.rates"), RATE_CODES)
+    t = time.perf_counter()
+    for i, d in enumerate(business):
+        rates = {code: (Decimal(1) / Decimal(str(1 + j + i / 1000)), "frankfurter") for j, code in enumerate(RATE_CODES)}
+        cache.put_many(d.isoformat(), rates, 0.0)
+        series.put_day(d, rates, 0.0)
+    for d in days:
+        if d.weekday() >= 5:
+            series.put_day(d, {}, 0.0, missing=RATE_CODES)
+    fill = time.perf_counter() - t
+    series.save()
+
+    lookups = len(days) * len(RATE_CODES)
+    t = time.perf_counter()
+    for code in RATE_CODES:
+        for d in days:
+            for back in range(6):
+                if cache.get_entry(code, (d - timedelta(days=back)).isoformat()) is not None:
+                    break
+    t_cache = time.perf_counter() - t
+
+    t = time.perf_counter()
+    reopened = RateSeries(series.path, RATE_CODES)
+    size = len(reopened)
+    t_open = time.perf_counter() - t
+    t = time.perf_counter()
+    for code in RATE_CODES:
+        for d in days:
+            reopened.at_or_before(code, d)
+    t_series = time.perf_counter() - t
+
+    print(f"{args.years} years, {len(days)} days x {len(RATE_CODES)} codes = {lookups} lookups (filled in {fill:.1f} s)")
+    print(f"  cache   {t_cache * 1e6 / lookups:8.2f} us/lookup")
+    print(f"  series  {t_series * 1e6 / lookups:8.2f} us/lookup")
+    print(f"  series file {os.path.getsize(series.path) / 1024:.0f} KiB, {size} days, opened (mmap) in {t_open * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=5)
+    main(parser.parse_args())
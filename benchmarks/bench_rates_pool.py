@@ -0,0 +1,112 @@
+"""Handshake cost of rate lookups: per-call AsyncClient vs the shared pool.
+
+Runs a local HTTPS stub (self-signed cert via openssl) that mimics the
+Frankfurter response and counts TCP connections accepted by the server.
+
+    python benchmarks/bench_rates_pool.py --requests 200 [--plain]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("SPREADSHEET_ID", "bench")
+
+import httpx  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from app import rates  # noqa: E402
+
+
+def _make_cert(tmp: Path) -> tuple[Path, Path]:
+    cert, key = tmp / "cert.pem", tmp / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+            "-keyout", str(key), "-out", str(cert),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+async def _start_stub(ssl_ctx: ssl.SSLContext | None) -> tuple[web.AppRunner, int, set[object]]:
+    connections: set[object] = set()
+
+    async def handle(request: web.Request) -> web.Response:
+        connections.add(request.transport)
+        return web.json_response({"amount": 1.0, "base": "USD", "rates": {"EUR": 0.92}})
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=ssl_ctx)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    return runner, port, connections
+
+
+async def _per_call(url: str, n: int) -> None:
+    for _ in range(n):
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            r = await client.get(url)
+            r.raise_for_status()
+            r.json()
+
+
+async def _pooled(url: str, n: int) -> None:
+    await rates.open_client()
+    try:
+        for _ in range(n):
+            await rates._get_json(url)
+    finally:
+        await rates.close_client()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--plain", action="store_true", help="HTTP instead of HTTPS")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ssl_ctx = None
+        scheme = "http"
+        if not args.plain:
+            cert, key = _make_cert(Path(tmp))
+            ssl_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_ctx.load_cert_chain(cert, key)
+            # httpx (trust_env) picks the self-signed cert up as the trusted CA
+            os.environ["SSL_CERT_FILE"] = str(cert)
+            scheme = "https"
+
+        runner, port, connections = await _start_stub(ssl_ctx)
+        url = f"{scheme}://localhost:{port}/latest?from=USD&to=EUR"
+        try:
+            for name, fn in (("per-call client", _per_call), ("shared pool", _pooled)):
+                connections.clear()
+                t0 = time.perf_counter()
+                await fn(url, args.requests)
+                dt = time.perf_counter() - t0
+                print(
+                    f"{name:16s} {args.requests} req  {dt * 1000:8.1f} ms total  "
+                    f"{dt / args.requests * 1000:6.2f} ms/req  connections={len(connections)}"
+                )
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Outbound send scheduler (app.send_scheduler) under a cleanup flood.
+
+Every chat gets a burst of message deletions (a third of them repeated, as
+when cleanup runs twice) together with a few user prompts. The fake Bot API
+answers 429 like Telegram: above `--global-rate` calls per second, or two
+sends to one chat closer than `--chat-interval`. Compared: requests straight
+to the API vs through SendScheduler.
+
+    python benchmarks/bench_send_scheduler.py [--chats 20] [--deletes 60] [--prompts 3]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault("BOT_TOKEN", "42:bench")
+os.environ.setdefault("SPREADSHEET_ID", "bench")
+
+from aiogram import Bot  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from app.send_scheduler import SendScheduler  # noqa: E402
+from fakes import FakeTelegramSession  # noqa: E402
+
+
+async def scenario(args: argparse.Namespace, scheduled: bool) -> None:
+    session = FakeTelegramSession(latency=0.02, global_rate=args.global_rate, chat_interval=args.chat_interval)
+    scheduler = SendScheduler(global_rate=args.global_rate * 0.9, chat_rate=0.9 / args.chat_interval, chat_burst=1)
+    if scheduled:
+        session.middleware(scheduler)
+    bot = Bot("42:bench", session=session)
+    prompt_latency: list[float] = []
+    failed = 0
+
+    async def delete(chat_id: int, mid: int) -> None:
+        nonlocal failed
+        try:
+            await bot.delete_message(chat_id, mid)
+        except Exception:
+            failed += 1
+
+    async def prompt(chat_id: int, n: int) -> None:
+        nonlocal failed
+        await asyncio.sleep(n * args.chat_interval * 1.5)  # пользователь отвечает не мгновенно
+        t = time.perf_counter()
+        try:
+            await bot.send_message(chat_id, f"step {n}")
+            prompt_latency.append(time.perf_counter() - t)
+        except Exception:
+            failed += 1
+
+    jobs = []
+    for chat_id in range(1, args.chats + 1):
+        mids = list(range(args.deletes)) + list(range(args.deletes // 3))
+        jobs += [delete(chat_id, mid) for mid in mids]
+        jobs += [prompt(chat_id, n) for n in range(args.prompts)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*jobs)
+    total = time.perf_counter() - t0
+    lat = sorted(prompt_latency) or [0.0]
+    print(f"{'scheduler' if scheduled else 'direct':>9}: total {total:6.2f} s  429s {session.flood_errors:5d}  "
+          f"failed {failed:5d}  prompt p50 {statistics.median(lat) * 1000:7.1f} ms  "
+          f"p99 {lat[min(len(lat) - 1, int(0.99 * len(lat)))] * 1000:7.1f} ms  "
+          f"API calls {len(session.calls):5d}  deduplicated {scheduler.stats['deduplicated']}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    logger.remove()
+    await scenario(args, scheduled=False)
+    await scenario(args, scheduled=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--deletes", type=int, default=60)
+    parser.add_argument("--prompts", type=int, default=3)
+    parser.add_argument("--global-rate", type=int, default=30)
+    parser.add_argument("--chat-interval", type=float, default=1.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,90 @@
+"""Startup cost of the bot: `import app.bot` and time to the first handled update.
+
+The Telegram API is replaced by benchmarks/fakes.py and Google Sheets by a
+connect() that sleeps `--sheets-delay` seconds, to show that a slow Google
+no longer holds polling back.
+
+    python benchmarks/bench_startup.py [--runs 5] [--sheets-delay 3]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+ENV = {
+    "BOT_TOKEN": "42:bench",
+    "SPREADSHEET_ID": "bench",
+    "DB_PATH": os.path.join(tempfile.gettempdir(), "excelbot-bench-startup.db"),
+}
+
+
+def _child(sheets_delay: float) -> None:
+    import asyncio
+
+    t0 = time.perf_counter()
+    sys.path.insert(0, str(ROOT))
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import app.bot as bot_module
+    from fakes import FakeTelegramSession, message_update
+
+    t_import = time.perf_counter() - t0
+
+    def slow_connect() -> None:
+        time.sleep(sheets_delay)
+
+    bot_module.sheets.connect = slow_connect  # type: ignore[method-assign]
+
+    async def main() -> float:
+        session = FakeTelegramSession()
+        bot_module.bot.session = session
+        handled = asyncio.Event()
+        session.listeners.append(lambda method, result: type(method).__name__ == "SendMessage" and handled.set())
+        await session.updates.put(message_update(chat_id=1001, user_id=1001, text="/start"))
+        sheets_task = asyncio.create_task(bot_module.sheets.start())
+        polling = asyncio.create_task(bot_module.dp.start_polling(bot_module.bot, handle_signals=False))
+        await handled.wait()
+        first = time.perf_counter() - t0
+        await bot_module.dp.stop_polling()
+        await polling
+        sheets_task.cancel()
+        return first
+
+    t_first = asyncio.run(main())
+    print(f"{t_import:.4f} {t_first:.4f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sheets-delay", type=float, default=3.0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.sheets_delay)
+        return
+
+    imports, firsts = [], []
+    env = {**os.environ, **ENV}
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", "--sheets-delay", str(args.sheets_delay)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout.split()
+        imports.append(float(out[-2]))
+        firsts.append(float(out[-1]))
+    print(f"import app.bot        median {statistics.median(imports) * 1000:8.1f} ms  (min {min(imports) * 1000:.1f})")
+    print(
+        f"first update handled  median {statistics.median(firsts) * 1000:8.1f} ms  "
+        f"(Google connect takes {args.sheets_delay:.1f} s in the background)"
+    )
+
+
+if __name__ == "__main__":
+    main()
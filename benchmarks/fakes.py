@@ -0,0 +1,331 @@
+"""Local stand-ins for the Telegram Bot API, gspread and the rate providers
+used by the benchmarks.
+
+FakeTelegramSession plugs into aiogram's Bot in place of the aiohttp
+session: every API call is answered locally after `latency` seconds and
+fails with probability `failure_rate`. getUpdates is served from `updates`.
+With `global_rate` / `chat_interval` set it also answers 429 Too Many
+Requests like Telegram: more than `global_rate` calls in a second, or two
+sends/edits to one chat closer than `chat_interval` seconds.
+
+FakeWorksheet / FakeSpreadsheet replace the gspread objects behind
+app.google_sheets.Sheets (see `attach_fake_sheet`). RateStub serves the four
+rate provider APIs from a local aiohttp server (see `RateStub.patch`).
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import itertools
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import (
+    EditMessageText,
+    GetMe,
+    GetUpdates,
+    SendMessage,
+    TelegramMethod,
+)
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+from aiohttp import web
+from gspread.utils import a1_to_rowcol
+
+BOT_USER = User(id=42, is_bot=True, first_name="ExcelBot", username="excelbot_bench_bot")
+
+
+class FakeTelegramSession(BaseSession):
+    def __init__(
+        self,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 1,
+        global_rate: Optional[int] = None,
+        chat_interval: Optional[float] = None,
+    ):
+        super().__init__()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.flood_errors = 0
+        self._recent: "collections.deque[float]" = collections.deque()
+        self._last_send: Dict[Any, float] = {}
+        self.updates: "asyncio.Queue[Update]" = asyncio.Queue()
+        self.calls: List[tuple[float, str, Any]] = []
+        self.listeners: List[Callable[[TelegramMethod[Any], Any], None]] = []
+        self._ids = itertools.count(100_000)
+        self._rnd = random.Random(seed)
+
+    def _message(self, chat_id: Any, text: Optional[str]) -> Message:
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "supergroup"
+        return Message(
+            message_id=next(self._ids),
+            date=int(time.time()),
+            chat=Chat(id=int(chat_id), type=chat_type),
+            from_user=BOT_USER,
+            text=text,
+        )
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        if isinstance(method, GetUpdates):
+            result = await self._get_updates(method)
+        else:
+            self._check_flood(method)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.failure_rate and self._rnd.random() < self.failure_rate:
+                raise TelegramNetworkError(method=method, message="fake network failure")
+            if isinstance(method, GetMe):
+                result = BOT_USER
+            elif isinstance(method, SendMessage):
+                result = self._message(method.chat_id, method.text)
+            elif isinstance(method, EditMessageText):
+                result = self._message(method.chat_id or -1, method.text)
+            else:
+                result = True
+        self.calls.append((time.perf_counter(), type(method).__name__, method))
+        for listener in self.listeners:
+            listener(method, result)
+        return result
+
+    def _check_flood(self, method: TelegramMethod[Any]) -> None:
+        now = time.monotonic()
+        if self.global_rate:
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.global_rate:
+                self.flood_errors += 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+            self._recent.append(now)
+        chat_id = getattr(method, "chat_id", None)
+        if self.chat_interval and chat_id is not None and type(method).__name__.startswith(("Send", "Edit")):
+            last = self._last_send.get(chat_id)
+            if last is not None and now - last < self.chat_interval:
+                self.flood_errors += 1
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+            self._last_send[chat_id] = now
+
+    async def _get_updates(self, method: GetUpdates) -> List[Update]:
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout=min(method.timeout or 0, 1) or 0.05)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while not self.updates.empty() and len(batch) < (method.limit or 100):
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    async def stream_content(
+        self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+        chunk_size: int = 65536, raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def message_update(chat_id: int, user_id: int, text: str, chat_type: str | None = None) -> Update:
+    chat_type = chat_type or ("private" if chat_id > 0 else "supergroup")
+    return Update(
+        update_id=next(_update_ids),
+        message=Message(
+            message_id=next(_message_ids),
+            date=int(time.time()),
+            chat=Chat(id=chat_id, type=chat_type),
+            from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}"),
+            text=text,
+        ),
+    )
+
+
+def callback_update(chat_id: int, user_id: int, data: str, message_id: int | None = None) -> Update:
+    chat_type = "private" if chat_id > 0 else "supergroup"
+    return Update(
+        update_id=next(_update_ids),
+        callback_query=CallbackQuery(
+            id=str(next(_update_ids)),
+            from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}"),
+            chat_instance=str(chat_id),
+            data=data,
+            message=Message(
+                message_id=message_id or next(_message_ids),
+                date=int(time.time()),
+                chat=Chat(id=chat_id, type=chat_type),
+                from_user=BOT_USER,
+                text="prompt",
+            ),
+        ),
+    )
+
+
+class FakeWorksheet:
+    """In-memory worksheet with the gspread calls Sheets uses. Every call
+    takes `latency` seconds; a write fails with probability `failure_rate`,
+    half of the time after the rows were stored (a lost response)."""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.values: List[List[str]] = []
+        self.writes = 0
+        self.failures = 0
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _fail(self) -> Optional[str]:
+        if self.failure_rate and self._rnd.random() < self.failure_rate:
+            self.failures += 1
+            return self._rnd.choice(("before", "after"))
+        return None
+
+    def append_rows(self, rows: List[List[str]], value_input_option: Any = None) -> None:
+        self._call()
+        fail = self._fail()
+        if fail == "before":
+            raise ConnectionError("fake gspread: connection reset")
+        with self._lock:
+            self.values.extend([list(map(str, r)) for r in rows])
+            self.writes += 1
+        if fail == "after":
+            raise TimeoutError("fake gspread: response lost")
+
+    def append_row(self, row: List[str], value_input_option: Any = None) -> None:
+        self.append_rows([row], value_input_option)
+
+    def col_values(self, col: int) -> List[str]:
+        self._call()
+        with self._lock:
+            return [r[col - 1] if len(r) >= col else "" for r in self.values]
+
+    def get(self, rng: str) -> List[List[str]]:
+        self._call()
+        start, _, end = rng.partition(":")
+        first = a1_to_rowcol(start)[0]
+        last = a1_to_rowcol(end)[0] if re.search(r"\d", end) else None
+        with self._lock:
+            return [list(r) for r in self.values[first - 1:last]]
+
+    def get_all_values(self) -> List[List[str]]:
+        self._call()
+        with self._lock:
+            return [list(r) for r in self.values]
+
+    def batch_update(self, data: List[Dict[str, Any]], value_input_option: Any = None) -> None:
+        self._call()
+        with self._lock:
+            for item in data:
+                start, _, _ = item["range"].partition(":")
+                row, col = a1_to_rowcol(start)
+                for offset, values in enumerate(item["values"]):
+                    target = self.values[row - 1 + offset]
+                    target.extend([""] * (col - 1 + len(values) - len(target)))
+                    target[col - 1:col - 1 + len(values)] = [str(v) for v in values]
+            self.writes += 1
+
+
+class FakeSpreadsheet:
+    def __init__(self, ws: FakeWorksheet):
+        self.ws = ws
+
+    def worksheet(self, name: str) -> FakeWorksheet:
+        return self.ws
+
+    def get_lastUpdateTime(self) -> str:
+        return str(self.ws.writes)
+
+
+def attach_fake_sheet(sheets: Any, ws: FakeWorksheet) -> None:
+    """Points an app.google_sheets.Sheets at `ws` and marks it connected."""
+    sheets.spreadsheet = FakeSpreadsheet(ws)
+    sheets._ws = ws
+    sheets.ready.set()
+
+
+# Of the bot's currencies the ECB (and so Frankfurter) publishes only these
+ECB_CODES = ("USD", "TRY")
+
+
+class RateStub:
+    """Local server for Frankfurter, exchangerate.host, fawaz and floatrates.
+    Every response waits `latency` seconds and is a 500 with probability
+    `failure_rate`; `hits` counts requests per provider. Frankfurter answers
+    with ECB_CODES only, like the real one, so the other providers fill the gaps."""
+
+    def __init__(self, codes: List[str], latency: float = 0.0, failure_rate: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.per_eur = {code: round(1.0 + i * 0.37, 4) for i, code in enumerate(codes)}
+        self.hits: Dict[str, int] = collections.Counter()
+        self._rnd = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def _respond(self, provider: str, payload: Dict[str, Any]) -> web.Response:
+        self.hits[provider] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and self._rnd.random() < self.failure_rate:
+            return web.Response(status=500, text="fake outage")
+        return web.json_response(payload)
+
+    async def _frankfurter(self, request: web.Request) -> web.Response:
+        start, sep, end = request.match_info["day"].partition("..")
+        ecb = {c: v for c, v in self.per_eur.items() if c in ECB_CODES}
+        if not sep:
+            return await self._respond("frankfurter", {"base": "EUR", "rates": ecb})
+        days = (date.fromisoformat(start) + timedelta(days=i) for i in range(
+            (date.fromisoformat(end) - date.fromisoformat(start)).days + 1))
+        series = {d.isoformat(): ecb for d in days if d.weekday() < 5}  # time series: business days only
+        return await self._respond("frankfurter_series", {"base": "EUR", "rates": series})
+
+    async def _exhost(self, request: web.Request) -> web.Response:
+        return await self._respond("exhost", {"base": "EUR", "rates": self.per_eur})
+
+    async def _fawaz(self, request: web.Request) -> web.Response:
+        return await self._respond("fawaz", {"eur": {c.lower(): v for c, v in self.per_eur.items()}})
+
+    async def _floatrates(self, request: web.Request) -> web.Response:
+        return await self._respond(
+            "floatrates", {c.lower(): {"rate": v, "inverseRate": 1 / v} for c, v in self.per_eur.items()}
+        )
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/frankfurter/{day}", self._frankfurter)
+        app.router.add_get("/exhost/{day}", self._exhost)
+        app.router.add_get("/fawaz/{vers}/eur.json", self._fawaz)
+        app.router.add_get("/floatrates/eur.json", self._floatrates)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+
+    def patch(self, rates: Any) -> None:
+        """Points the provider URLs of app.rates at this server."""
+        base = f"http://127.0.0.1:{self.port}"
+        rates.FRANKFURTER_URL = base + "/frankfurter/{day}?from=EUR"
+        rates.EXHOST_URL = base + "/exhost/{day}?base=EUR&symbols={symbols}"
+        rates.FAWAZ_URL = base + "/fawaz/{vers}/eur.json"
+        rates.FLOATRATES_URL = base + "/floatrates/eur.json"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
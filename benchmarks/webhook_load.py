@@ -0,0 +1,131 @@
+"""Load test for the webhook mode (RUN_MODE=webhook).
+
+Starts app.webhook.run_webhook in-process on a local port with the real
+dispatcher. Outgoing Bot API calls go to benchmarks/fakes.py. A local fake
+Telegram sender then POSTs synthetic /start updates with the secret header,
+`--concurrency` requests at a time. Reports the ack latency (what Telegram
+sees), the time until every reply was sent, and checks that a wrong secret
+is rejected and that shutdown drains updates still in flight.
+
+    python benchmarks/webhook_load.py [--updates 2000] [--concurrency 50] [--api-latency 0.05]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SECRET = "bench-secret"
+PORT = 18089
+
+os.environ.setdefault("BOT_TOKEN", "42:bench")
+os.environ.setdefault("SPREADSHEET_ID", "bench")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="excelbot-webhook-"), "bench.db")
+os.environ["WEBHOOK_SECRET"] = SECRET
+os.environ["WEBHOOK_HOST"] = "127.0.0.1"
+os.environ["WEBHOOK_PORT"] = str(PORT)
+os.environ["WEBHOOK_BASE_URL"] = ""
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import aiohttp  # noqa: E402
+from loguru import logger  # noqa: E402
+
+import app.bot as bot_module  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.webhook import run_webhook  # noqa: E402
+from fakes import FakeTelegramSession, message_update  # noqa: E402
+
+URL = f"http://127.0.0.1:{PORT}{settings.webhook_path}"
+
+
+def _payload(i: int) -> str:
+    chat_id = 10_000 + i
+    return message_update(chat_id=chat_id, user_id=chat_id, text="/start").model_dump_json(
+        by_alias=True, exclude_none=True
+    )
+
+
+def _pct(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+async def _post(http: aiohttp.ClientSession, body: str, secret: str = SECRET) -> int:
+    async with http.post(
+        URL,
+        data=body,
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret},
+    ) as resp:
+        await resp.read()
+        return resp.status
+
+
+async def main(updates: int, concurrency: int, api_latency: float) -> None:
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    session = FakeTelegramSession(latency=api_latency)
+    bot_module.bot.session = session
+    replies = 0
+    all_sent = asyncio.Event()
+
+    def on_call(method, result) -> None:
+        nonlocal replies
+        if type(method).__name__ == "SendMessage":
+            replies += 1
+            if replies >= updates:
+                all_sent.set()
+
+    session.listeners.append(on_call)
+    stop = asyncio.Event()
+    server = asyncio.create_task(run_webhook(bot_module.dp, bot_module.bot, stop=stop))
+    await asyncio.sleep(0.3)
+
+    async with aiohttp.ClientSession() as http:
+        assert await _post(http, _payload(-1), secret="wrong") == 401, "wrong secret must be rejected"
+
+        acks: list[float] = []
+        slots = asyncio.Semaphore(concurrency)
+
+        async def send(i: int) -> None:
+            async with slots:
+                t = time.perf_counter()
+                status = await _post(http, _payload(i))
+                acks.append(time.perf_counter() - t)
+                assert status == 200, status
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(updates)))
+        t_acked = time.perf_counter() - t0
+        await asyncio.wait_for(all_sent.wait(), timeout=120)
+        t_done = time.perf_counter() - t0
+
+        # graceful shutdown: updates accepted right before stop are still answered
+        tail = 50
+        before = replies
+        await asyncio.gather(*(_post(http, _payload(updates + i)) for i in range(tail)))
+        stop.set()
+        await server
+        drained = replies - before
+
+    print(f"updates={updates} concurrency={concurrency} api_latency={api_latency * 1000:.0f} ms "
+          f"handler_concurrency={settings.webhook_concurrency}")
+    print(f"  ack latency   p50 {_pct(acks, 0.5):7.2f} ms   p99 {_pct(acks, 0.99):7.2f} ms")
+    print(f"  all acked     {t_acked:7.2f} s  ({updates / t_acked:8.0f} updates/s)")
+    print(f"  all answered  {t_done:7.2f} s  ({updates / t_done:8.0f} updates/s)")
+    print(f"  drained on shutdown: {drained}/{tail}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(main(args.updates, args.concurrency, args.api_latency))
@@ -2,18 +2,51 @@ import asyncio
 import logging
 from loguru import logger
 
-from app.bot import dp, bot
+from app.bot import dp, bot, outbox, mirror, sheets, task_poller
+from app.config import settings
+from app import metrics, rates
+from app.webhook import run_webhook
+from app.workers import ShardedFront
 
 
 async def main() -> None:
     logging.basicConfig(level=logging.INFO)
-    logger.info("ExcelBot v2 starting polling...")
+    logger.info(f"ExcelBot v2 starting ({settings.run_mode})...")
+    await rates.open_client()
+    # Google Sheets и прогрев кэша курсов — в фоне, параллельно с запуском polling
+    background = [
+        asyncio.create_task(sheets.start()),
+        asyncio.create_task(rates.warm_cache()),
+        asyncio.create_task(mirror.run(settings.mirror_sync_sec)),
+    ]
+    if settings.group_chat_id:
+        background.append(asyncio.create_task(task_poller.run(settings.send_interval_sec)))
+    metrics_runner = None
+    if metrics.enabled:
+        metrics_runner = await metrics.start_server(settings.metrics_port)
+        background.append(asyncio.create_task(metrics.watch_loop_lag()))
+    outbox_task = asyncio.create_task(outbox.run())
     try:
-        await dp.start_polling(bot)
+        if settings.workers > 1:
+            await ShardedFront(settings.workers, outbox=outbox).run(bot, dp)
+        elif settings.run_mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
     finally:
+        for task in background:
+            task.cancel()
+        outbox.stop()
+        try:
+            await asyncio.wait_for(outbox_task, timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning(f"Запись в таблицу прервана, в очереди: {outbox.depth()} (допишутся при следующем запуске)")
+        await rates.close_client()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await bot.session.close()
         logger.info("ExcelBot v2 stopped.")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())